@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+#
+#  Copyright 2002-2025 Barcelona Supercomputing Center (www.bsc.es)
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+# -*- coding: utf-8 -*-
+
+"""Overhead of deploy_services on synthetic services of growing size.
+
+Each service has the given number of roles plus one context per ten
+roles. Images are "built" by a stand-in docker executable that sleeps for
+--latency seconds, and the definition is published over a real Zenoh
+session to a subscriber on localhost, so only the tool itself is measured:
+
+    python3 benchmarks/deploy_benchmark.py --roles 1 10 100 500 --latency 0.05 --jobs 8
+
+For every size it reports the wall-clock time of a deployment building
+every image (cold) and of a repeated deployment where every image is
+unchanged (warm), the time from the start of the publish phase to the
+definition reaching the subscriber, and the peak Python memory of a cold
+deployment.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import socket
+import stat
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import zenoh  # noqa: E402
+
+from deployment.build_manifest import MANIFEST_FILE  # noqa: E402
+from deployment.colmena_deploy import deploy_services  # noqa: E402
+from deployment.metrics import MetricsRecorder  # noqa: E402
+from deployment.options import DeployOptions  # noqa: E402
+from deployment.publisher import SERVICE_DEFINITIONS_KEY, ServicePublisher  # noqa: E402
+
+FAKE_DOCKER = """#!/bin/sh
+# stand-in docker: waits, prints some progress and writes the buildx metadata file
+sleep "${COLMENA_BENCHMARK_LATENCY:-0}"
+while [ $# -gt 0 ]; do
+    if [ "$1" = "--metadata-file" ]; then
+        printf '{"containerimage.digest": "sha256:%064d"}' "$$" > "$2"
+    fi
+    shift
+done
+echo "#1 [internal] load build definition from Dockerfile"
+echo "#1 DONE 0.0s"
+"""
+
+
+def synthetic_service(build_path: str, roles: int) -> str:
+    """Write a service with the given number of roles, and one context per ten roles."""
+    contexts = roles // 10
+    definition = {
+        "id": {"value": f"benchmark-{roles}"},
+        "dockerRoleDefinitions": [{"id": f"role{i}", "imageId": f"benchmark-role{i}",
+                                   "kpis": [{"query": f"avg_over_time(latency[{i % 60 + 1}s]) < 1"}]}
+                                  for i in range(roles)],
+        "dockerContextDefinitions": [{"id": f"context{i}", "imageId": f"benchmark-context{i}"}
+                                     for i in range(contexts)],
+    }
+    folders = [f"role{i}" for i in range(roles)] + [os.path.join("context", f"context{i}") for i in range(contexts)]
+    for folder in folders:
+        os.makedirs(os.path.join(build_path, folder, "src"))
+        with open(os.path.join(build_path, folder, "Dockerfile"), "w") as f:
+            f.write("FROM python:3.12-slim\nCOPY src /app\nCMD [\"python3\", \"/app/main.py\"]\n")
+        with open(os.path.join(build_path, folder, "src", "main.py"), "w") as f:
+            f.write(f"print({folder!r})\n" * 200)
+    with open(os.path.join(build_path, "service_description.json"), "w") as f:
+        json.dump(definition, f)
+    return build_path
+
+
+def install_fake_docker(directory: str, latency: float):
+    path = os.path.join(directory, "docker")
+    with open(path, "w") as f:
+        f.write(FAKE_DOCKER)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    os.environ["PATH"] = directory + os.pathsep + os.environ["PATH"]
+    os.environ["COLMENA_BENCHMARK_LATENCY"] = str(latency)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def zenoh_config(directory: str, name: str, listen=(), connect=()) -> str:
+    path = os.path.join(directory, f"{name}.json5")
+    with open(path, "w") as f:
+        json.dump({"mode": "peer", "listen": {"endpoints": list(listen)},
+                   "connect": {"endpoints": list(connect)},
+                   "scouting": {"multicast": {"enabled": False}}}, f)
+    return path
+
+
+class Swarm:
+    """Local Zenoh peer standing in for the COLMENA agents, recording when definitions arrive."""
+
+    def __init__(self, config_path: str):
+        self.session = zenoh.open(zenoh.Config.from_file(config_path))
+        self.received = {}
+        self._arrived = threading.Condition()
+        self.subscriber = self.session.declare_subscriber(f"{SERVICE_DEFINITIONS_KEY}/**", self._on_sample)
+
+    def _on_sample(self, sample):
+        with self._arrived:
+            self.received[str(sample.key_expr)] = time.time()
+            self._arrived.notify_all()
+
+    def wait_for(self, key: str, timeout: float = 10.0) -> float:
+        with self._arrived:
+            if not self._arrived.wait_for(lambda: key in self.received, timeout):
+                raise TimeoutError(f"{key} was not received")
+            return self.received.pop(key)
+
+    def close(self):
+        self.subscriber.undeclare()
+        self.session.close()
+
+
+def connect_publisher(publisher: ServicePublisher, swarm: Swarm):
+    """Open the publisher's session and wait until the swarm receives from it."""
+    publisher.open()
+    key = f"{SERVICE_DEFINITIONS_KEY}/warm-up"
+    deadline = time.monotonic() + 10
+    while key not in swarm.received:
+        if time.monotonic() > deadline:
+            raise TimeoutError("the local Zenoh peers did not connect")
+        publisher.session.put(key, b"{}")
+        time.sleep(0.05)
+    swarm.received.clear()
+
+
+def deploy(build_path: str, publisher: ServicePublisher, jobs: int, cold: bool, metrics: MetricsRecorder):
+    if cold:
+        # forget every image pushed, so they are all built and the manifest is written again
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(build_path, MANIFEST_FILE))
+    args = argparse.Namespace(local_debug=False)
+    with contextlib.redirect_stdout(io.StringIO()):
+        deploy_services(args, [build_path], "linux/amd64", "benchmark", False, DeployOptions(jobs=jobs), metrics,
+                        publisher=publisher)
+
+
+def measure(build_path: str, publisher: ServicePublisher, swarm: Swarm, jobs: int, repeat: int):
+    key = f"{SERVICE_DEFINITIONS_KEY}/{os.path.basename(build_path)}"
+    cold, warm, latency = [], [], []
+    for _ in range(repeat):
+        for is_cold, times in ((True, cold), (False, warm)):
+            metrics = MetricsRecorder()
+            started = time.perf_counter()
+            deploy(build_path, publisher, jobs, is_cold, metrics)
+            times.append(time.perf_counter() - started)
+            arrived = swarm.wait_for(key)
+            [publish] = [span for span in metrics.spans if span["name"] == "publish"]
+            latency.append(arrived - publish["start"])
+
+    tracemalloc.start()
+    deploy(build_path, publisher, jobs, True, MetricsRecorder(enabled=False))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    swarm.wait_for(key)
+    return min(cold), min(warm), min(latency), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--roles", type=int, nargs="+", default=[1, 10, 100, 500], help="Number of roles")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds each fake docker call takes")
+    parser.add_argument("--jobs", type=int, default=8, help="Images built in parallel")
+    parser.add_argument("--repeat", type=int, default=3, help="Deployments per measurement, the best is reported")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="colmena-benchmark-") as root:
+        install_fake_docker(root, args.latency)
+        endpoint = f"tcp/127.0.0.1:{free_port()}"
+        swarm = Swarm(zenoh_config(root, "swarm", listen=[endpoint]))
+        publisher = ServicePublisher(config_path=zenoh_config(root, "publisher", connect=[endpoint]))
+        try:
+            started = time.perf_counter()
+            connect_publisher(publisher, swarm)
+            print(f"zenoh session ready in {(time.perf_counter() - started) * 1000:.1f} ms")
+            print(f"{'roles':>6} {'images':>7} {'cold s':>8} {'warm s':>8} {'publish ms':>11} {'peak MiB':>9}")
+            for roles in args.roles:
+                build_path = synthetic_service(os.path.join(root, f"benchmark-{roles}"), roles)
+                cold, warm, latency, peak = measure(build_path, publisher, swarm, args.jobs, args.repeat)
+                print(f"{roles:>6} {roles + roles // 10:>7} {cold:>8.3f} {warm:>8.3f} {latency * 1000:>11.2f} "
+                      f"{peak / (1 << 20):>9.2f}")
+        finally:
+            publisher.close()
+            swarm.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+#
+#  Copyright 2002-2025 Barcelona Supercomputing Center (www.bsc.es)
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+# -*- coding: utf-8 -*-
+
+"""Payload size and encode/decode time of every service definition wire format.
+
+The sample fixture is scaled up to many roles, each with KPIs and an
+environment block, to resemble a large service:
+
+    python3 benchmarks/encoding_benchmark.py --roles 10 100 1000
+"""
+
+import copy
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from deployment.encoding import ENCODINGS, available_encodings, decode_definition, encode_definition  # noqa: E402
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests", "fixtures",
+                       "sample_service_description.json")
+
+
+def scaled_definition(roles: int):
+    """Return the sample service definition with the given number of roles."""
+    with open(FIXTURE) as f:
+        definition = json.load(f)
+    template = definition["dockerRoleDefinitions"][0]
+    definition["dockerRoleDefinitions"] = []
+    for i in range(roles):
+        role = copy.deepcopy(template)
+        role["id"] = f"{template['id']}-{i}"
+        role["imageId"] = f"colmenaswarm/{template['imageId']}-{i}"
+        role["kpis"] = [{"query": f"avg_over_time(processing_time[{i % 60 + 1}s]) < 1",
+                         "scope": "role"}]
+        role["env"] = {f"VARIABLE_{j}": f"value-{i}-{j}" for j in range(8)}
+        definition["dockerRoleDefinitions"].append(role)
+    return definition
+
+
+def measure(definition, encoding, repeat):
+    payload, zenoh_encoding = encode_definition(definition, encoding)
+    raw = payload.encode() if isinstance(payload, str) else payload
+    number = max(1, repeat)
+    encode_time = min(timeit.repeat(lambda: encode_definition(definition, encoding), number=number, repeat=3)) / number
+    decode_time = min(timeit.repeat(lambda: decode_definition(raw, zenoh_encoding), number=number, repeat=3)) / number
+    return len(raw), encode_time, decode_time
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--roles", type=int, nargs="+", default=[10, 100, 1000], help="Number of roles")
+    parser.add_argument("--repeat", type=int, default=20, help="Encodings per measurement")
+    args = parser.parse_args()
+
+    encodings = available_encodings()
+    missing = [each for each in ENCODINGS if each not in encodings]
+    if missing:
+        print(f"skipping {', '.join(missing)}: optional dependencies not installed")
+
+    print(f"{'roles':>6} {'encoding':<9} {'bytes':>10} {'ratio':>6} {'encode ms':>10} {'decode ms':>10}")
+    for roles in args.roles:
+        definition = scaled_definition(roles)
+        baseline = None
+        for encoding in encodings:
+            size, encode_time, decode_time = measure(definition, encoding, args.repeat)
+            baseline = baseline or size
+            print(f"{roles:>6} {encoding:<9} {size:>10} {size / baseline:>6.2f} "
+                  f"{encode_time * 1000:>10.3f} {decode_time * 1000:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,17 @@
 # Only import functions that are meant to be used as a library
 # Don't import modules that are meant to be executed directly (like colmena_deploy)
 from .build_image import Image, build_container_images
+from .deployer import Deployer, DeployResult, ImageResult, PublishResult
+from .options import DeployOptions
+from .publisher import ServicePublisher
 
 __all__ = [
     'Image',
-    'build_container_images'
+    'build_container_images',
+    'ServicePublisher',
+    'Deployer',
+    'DeployOptions',
+    'DeployResult',
+    'ImageResult',
+    'PublishResult'
 ]
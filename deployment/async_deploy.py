@@ -0,0 +1,272 @@
+#!/usr/bin/python
+#
+#  Copyright 2002-2025 Barcelona Supercomputing Center (www.bsc.es)
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+# -*- coding: utf-8 -*-
+
+"""Asynchronous deployment pipeline.
+
+Images are built by asyncio subprocesses while the Zenoh session is opened
+in the background, and each service definition is published as soon as
+the last of its images is pushed instead of after every build. Session
+setup is therefore off the critical path, and the pipeline can be awaited
+from an asyncio application:
+
+    keys = await deploy_services_async(args, build_paths, "linux/amd64", "user", False, DeployOptions(jobs=4))
+"""
+
+import asyncio
+import subprocess
+import tempfile
+from collections import deque
+from typing import Dict, List, Optional
+
+from .build_image import (BuildError, BuildResult, CacheConfig, Image, docker_build_command, metadata_path,
+                          read_metadata)
+from .build_manifest import BuildManifest
+from .colmena_deploy import plan_deployment
+from .executor import (DEFAULT_RETRY, NO_RETRY, TAIL_LINES, TERMINATE_GRACE, RetryPolicy, backoff_attempts,
+                       log_line, retry_delay)
+from .metrics import NO_METRICS, MetricsRecorder
+from .options import DeployOptions
+from .publisher import ServicePublisher
+
+# longest output line of a build, BuildKit progress lines can be long
+STREAM_LIMIT = 1 << 20
+
+
+async def run_streamed_async(command: List[str], prefix: str, timeout: Optional[float] = None,
+                             retry: RetryPolicy = NO_RETRY):
+    """Run a command without a shell, printing its output line by line with a prefix.
+
+    The process is terminated when the timeout expires or the calling task
+    is cancelled. Failures with a transient registry error are run again
+    as retry allows, each attempt getting the full timeout.
+
+    Args:
+        command: Program and arguments to run
+        prefix: Shown in front of every output line
+        timeout: Seconds each attempt may run, None waits forever
+        retry: How often and after how long transient failures are retried
+
+    Raises:
+        subprocess.CalledProcessError: The command exited with a non-zero code
+        TimeoutError: The command did not finish in time
+    """
+    for attempt in backoff_attempts(retry):
+        try:
+            await _run_once(command, prefix, timeout)
+            return
+        except subprocess.CalledProcessError as error:
+            delay = retry_delay(retry, attempt, error, prefix)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+
+
+async def _run_once(command: List[str], prefix: str, timeout: Optional[float]):
+    process = await asyncio.create_subprocess_exec(*command,
+                                                   stdout=asyncio.subprocess.PIPE,
+                                                   stderr=asyncio.subprocess.STDOUT,
+                                                   limit=STREAM_LIMIT)
+    tail = deque(maxlen=TAIL_LINES)
+    try:
+        await asyncio.wait_for(_stream(process, prefix, tail), timeout)
+    except asyncio.TimeoutError:
+        if process.returncode != 0:
+            await _terminate(process)
+            raise TimeoutError(f"{' '.join(command)} did not finish within {timeout} seconds") from None
+        # exited successfully right before the timeout
+    except BaseException:
+        await _terminate(process)
+        raise
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command, output="\n".join(tail))
+
+
+async def _stream(process: asyncio.subprocess.Process, prefix: str, tail: deque):
+    async for line in process.stdout:
+        line = line.decode(errors="replace").rstrip()
+        log_line(prefix, line)
+        tail.append(line)
+    await process.wait()
+
+
+async def _terminate(process: asyncio.subprocess.Process):
+    if process.returncode is not None:
+        return
+    process.terminate()
+    try:
+        await asyncio.wait_for(process.wait(), TERMINATE_GRACE)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+
+
+async def build_image_async(image: Image, platform: str, local_debug: bool,
+                            cache: Optional[CacheConfig] = None, metadata_dir: Optional[str] = None,
+                            timeout: Optional[float] = None, retry: RetryPolicy = DEFAULT_RETRY,
+                            builder: Optional[str] = None) -> BuildResult:
+    """Build and push (or load, with local_debug) one image without blocking the event loop.
+
+    Args:
+        image: Image to build
+        platform: Docker buildx platform specification (e.g., "linux/amd64")
+        local_debug: Load the image into the local store instead of pushing it
+        cache: BuildKit cache settings, by default only the builder's own cache is used
+        metadata_dir: Directory for the buildx metadata file the pushed digest is read from
+        timeout: Seconds the build may run, None waits forever
+        retry: How the build is run again when it fails with a transient registry error
+        builder: Buildx builder to build with, None uses the current one
+    """
+    print(f"building {image.tag} with path {image.path}")
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    metadata_file = metadata_path(metadata_dir, image.tag)
+    await run_streamed_async(docker_build_command(image, platform, local_debug, cache, metadata_file, builder),
+                             image.id, timeout, retry)
+    return BuildResult(image, read_metadata(metadata_file).get("containerimage.digest"), loop.time() - started)
+
+
+async def deploy_service_async(_args, build_path: str, platform: str, user: str, skip_build: bool,
+                               options: Optional[DeployOptions] = None,
+                               metrics: MetricsRecorder = NO_METRICS) -> List[Optional[str]]:
+    """Deploy the service of one build folder, see deploy_services_async."""
+    return await deploy_services_async(_args, [build_path], platform, user, skip_build, options, metrics)
+
+
+async def deploy_services_async(_args, build_paths: List[str], platform: str, user: str, skip_build: bool,
+                                options: Optional[DeployOptions] = None,
+                                metrics: MetricsRecorder = NO_METRICS) -> List[Optional[str]]:
+    """Deploy the services of several build folders, overlapping builds and publishing.
+
+    Takes the same options as deploy_services, except bake, split_platforms
+    and build_only. The Zenoh session is opened while the images build and
+    each definition is published once all of its images are pushed. The
+    first failure cancels every pending build and publish; with keep_going
+    the other services are still built and published (except the images
+    building from a failed one), and a BuildError lists the failed images at
+    the end. Cancelling the task terminates the running builds.
+
+    Returns:
+        The key each definition was published under, None for the
+        definitions left unpublished by only_changed
+
+    Raises:
+        ValueError: The options ask for bake, split_platforms or build_only
+    """
+    options = options or DeployOptions()
+    if options.bake or options.split_platforms or options.build_only:
+        raise ValueError("the pipeline builds and publishes every image on its own, "
+                         "it cannot bake, split platforms or only build")
+    loop = asyncio.get_running_loop()
+    with metrics.span("deploy", services=len(build_paths)):
+        publisher = options.publisher()
+        opened = loop.run_in_executor(None, _open, publisher, metrics)
+        try:
+            with tempfile.TemporaryDirectory(prefix="colmena-build-") as metadata_dir:
+                # hashing the build contexts reads every file, keep it off the event loop
+                plan = await loop.run_in_executor(
+                    None, lambda: plan_deployment(_args, build_paths, platform, user, skip_build,
+                                                  options.force_build, options.verify_registry, metrics))
+                services, owners = plan.services, plan.owners
+                images = plan.build if not skip_build else []
+                manifests: Dict[str, BuildManifest] = plan.manifests
+                semaphore = asyncio.Semaphore(max(1, len(images) if options.jobs < 1 else options.jobs))
+
+                async def build(image: Image) -> BuildResult:
+                    for parent in plan.dependencies.get(image.tag, []):
+                        if parent in builds:
+                            try:
+                                await asyncio.shield(builds[parent])
+                            except Exception:
+                                raise RuntimeError(f"not built, {parent} failed to build") from None
+                    async with semaphore:
+                        with metrics.span("build_image", tag=image.tag, id=image.id, service=image.service,
+                                          cache="miss") as span:
+                            result = await build_image_async(
+                                image, platform, _args.local_debug, options.cache,
+                                None if _args.local_debug else metadata_dir, options.image_timeout, options.retry,
+                                options.builder)
+                            span.update(exit_code=0, digest=result.digest)
+                    if manifests:
+                        manifests[owners[image.tag]].record(image, result.digest)
+                    return result
+
+                async def publish(service_definition, service_images: List[Image]) -> Optional[str]:
+                    results = await asyncio.gather(*(builds[each.tag] for each in service_images
+                                                     if each.tag in builds))
+                    await opened
+                    with metrics.span("publish", service=service_definition["id"]["value"]) as span:
+                        key = await loop.run_in_executor(None, publisher.publish, service_definition,
+                                                         plan.digests(results))
+                        span["published"] = key is not None
+                        if key in publisher.visible_after:
+                            span["visible_after"] = publisher.visible_after[key]
+                    return key
+
+                builds = {each.tag: asyncio.ensure_future(build(each)) for each in images}
+                publishes = [asyncio.ensure_future(publish(service_definition, service_images))
+                             for service_definition, service_images in services]
+                try:
+                    await _wait(list(builds.values()) + publishes, options.keep_going)
+                finally:
+                    for manifest in manifests.values():
+                        manifest.flush()
+                failures = {tag: task.exception() for tag, task in builds.items() if task.exception() is not None}
+                for task in publishes:
+                    # services whose images failed already show up in the failures
+                    if task.exception() is not None and task.exception() not in failures.values():
+                        raise task.exception()
+                if failures:
+                    raise BuildError(failures)
+                return [task.result() for task in publishes]
+        finally:
+            await _close(publisher, opened)
+
+
+def _open(publisher: ServicePublisher, metrics: MetricsRecorder):
+    with metrics.span("zenoh_open"):
+        publisher.open()
+
+
+async def _wait(tasks: List["asyncio.Future"], keep_going: bool):
+    """Wait for every task, cancelling all of them on the first failure unless keep_going is set.
+
+    In fail-fast mode the first failure is raised. Cancelling the caller
+    cancels the tasks too.
+    """
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_EXCEPTION)
+            failed = [task for task in done if not task.cancelled() and task.exception() is not None]
+            if failed and not keep_going:
+                raise failed[0].exception()
+    finally:
+        for task in tasks:
+            task.cancel()
+        # let the cancelled builds terminate their processes
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _close(publisher: ServicePublisher, opened: "asyncio.Future"):
+    try:
+        await asyncio.shield(opened)
+    except Exception:
+        # an open failure is raised by the publishes waiting for the session
+        pass
+    publisher.close()
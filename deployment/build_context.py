@@ -0,0 +1,205 @@
+#!/usr/bin/python
+#
+#  Copyright 2002-2025 Barcelona Supercomputing Center (www.bsc.es)
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+# -*- coding: utf-8 -*-
+
+"""Size and minimization of the build contexts sent to BuildKit.
+
+Every file of a role or context folder not excluded by its .dockerignore
+is sent to the builder on each build, even when the Dockerfile never
+copies it. The sources of the Dockerfile's COPY and ADD instructions tell
+which files are actually needed, so large unused files (model weights,
+datasets, virtual environments) can be reported and left out with a
+generated .dockerignore.
+"""
+
+import json
+import os
+import posixpath
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from .build_image import Image
+from .dockerignore import DockerIgnore
+from .planner import dockerfile_instructions
+
+# contexts larger than this are reported when their image is built
+CONTEXT_WARNING_SIZE = 100 * 1024 * 1024
+GENERATED_HEADER = "# generated by the COLMENA deployment tool from the COPY and ADD sources of the Dockerfile"
+
+
+def copy_sources(dockerfile: str) -> Optional[List[str]]:
+    """Return the context paths and patterns the COPY and ADD instructions of a Dockerfile read.
+
+    Sources copied from other stages or images, remote URLs and heredocs
+    do not come from the context and are left out.
+
+    Returns:
+        The sorted sources, or None when the whole context may be needed: a
+        source is the context root or uses a variable
+    """
+    sources = set()
+    for instruction, words in dockerfile_instructions(dockerfile):
+        if instruction not in ("COPY", "ADD"):
+            continue
+        options = [word for word in words if word.startswith("--")]
+        if any(option.startswith("--from=") for option in options):
+            continue
+        words = words[len(options):]
+        if words and words[0].startswith("["):
+            try:
+                words = json.loads(" ".join(words))
+            except ValueError:
+                continue
+        for source in words[:-1]:
+            if source.startswith("<<") or "://" in source or source.startswith("git@"):
+                continue
+            if "$" in source:
+                return None
+            source = posixpath.normpath(source.lstrip("/"))
+            if source == ".":
+                return None
+            sources.add(source)
+    return sorted(sources)
+
+
+def format_size(size: float) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+@dataclass
+class ContextReport:
+    """What the build context of an image contains and what its Dockerfile uses.
+
+    Attributes:
+        image: The image
+        sources: Paths and patterns its COPY and ADD instructions read, None
+            when the whole context may be needed
+        files: Number of files sent to the builder
+        size: Bytes sent to the builder
+        used_size: Bytes of the files the Dockerfile reads
+        unused: Bytes sent but never read, per top-level entry of the context
+        missing: Sources that match no file sent to the builder, which the
+            build cannot find
+    """
+    image: Image
+    sources: Optional[List[str]]
+    files: int = 0
+    size: int = 0
+    used_size: int = 0
+    unused: Dict[str, int] = field(default_factory=dict)
+    missing: List[str] = field(default_factory=list)
+
+    @property
+    def unused_size(self) -> int:
+        return sum(self.unused.values())
+
+    def describe(self, largest: int = 5) -> str:
+        """Return the size report of the context, listing its largest unused entries."""
+        lines = [f"{self.image.tag}: {format_size(self.size)} in {self.files} file(s) sent from {self.image.path}"]
+        if self.sources is None:
+            lines.append("  the Dockerfile may read the whole context")
+        else:
+            lines.append(f"  {format_size(self.used_size)} used by COPY/ADD, {format_size(self.unused_size)} unused")
+            for entry, size in sorted(self.unused.items(), key=lambda item: (-item[1], item[0]))[:largest]:
+                lines.append(f"    unused {entry}: {format_size(size)}")
+        for source in self.missing:
+            lines.append(f"  warning: {source} is copied but not sent to the builder, check the .dockerignore")
+        return "\n".join(lines)
+
+
+def analyze_context(image: Image, files: Optional[List[Tuple[str, int]]] = None) -> ContextReport:
+    """Measure the build context of an image against the sources of its Dockerfile.
+
+    Args:
+        image: The image
+        files: Relative path and size of every file of the context, when they
+            are already known (see BuildManifest.contexts); by default the
+            context is walked
+    """
+    try:
+        sources = copy_sources(os.path.join(image.path, "Dockerfile"))
+    except FileNotFoundError:
+        sources = None
+    report = ContextReport(image, sources)
+    # like .dockerignore patterns, a source matches the files it names and everything below
+    # the directories it names
+    patterns = {source: DockerIgnore([source]) for source in sources or []}
+    matched = set()
+    if files is None:
+        files = [(relative_path, os.lstat(os.path.join(image.path, relative_path)).st_size)
+                 for relative_path in DockerIgnore.from_context(image.path).walk(image.path)]
+    for relative_path, size in files:
+        report.files += 1
+        report.size += size
+        reading = {source for source, pattern in patterns.items() if pattern.is_excluded(relative_path)}
+        matched.update(reading)
+        if sources is None or reading or relative_path in ("Dockerfile", ".dockerignore"):
+            report.used_size += size
+        else:
+            entry = relative_path.split("/", 1)[0]
+            report.unused[entry] = report.unused.get(entry, 0) + size
+    report.missing = [source for source in sources or [] if source not in matched]
+    return report
+
+
+def minimal_dockerignore(sources: List[str]) -> List[str]:
+    """Return .dockerignore lines that only send the given sources (and the Dockerfile) to the builder."""
+    return [GENERATED_HEADER, "*", "!Dockerfile"] + [f"!{source}" for source in sources]
+
+
+def write_dockerignore(image: Image) -> Optional[str]:
+    """Write a minimal .dockerignore for an image whose context does not have one yet.
+
+    Existing .dockerignore files are left untouched, they can be checked
+    with analyze_context instead.
+
+    Returns:
+        The path written, or None when the context already has a
+        .dockerignore or the Dockerfile may read the whole context
+    """
+    path = os.path.join(image.path, ".dockerignore")
+    if os.path.exists(path):
+        return None
+    try:
+        sources = copy_sources(os.path.join(image.path, "Dockerfile"))
+    except FileNotFoundError:
+        return None
+    if sources is None:
+        return None
+    with open(path, "w") as f:
+        f.write("\n".join(minimal_dockerignore(sources)) + "\n")
+    return path
+
+
+def warn_large_contexts(images: List[Image], limit: int = CONTEXT_WARNING_SIZE,
+                        contexts: Optional[Dict[str, List[Tuple[str, int]]]] = None):
+    """Print the size report of the images whose build context is larger than limit bytes.
+
+    Args:
+        contexts: Files of the contexts already walked, by image tag (see analyze_context)
+    """
+    for each in images:
+        report = analyze_context(each, (contexts or {}).get(each.tag))
+        if report.size > limit:
+            print(f"warning: large build context\n{report.describe()}")
+        elif report.missing:
+            print(report.describe())
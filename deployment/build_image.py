@@ -17,10 +17,21 @@
 
 # -*- coding: utf-8 -*-
 
+import json
 import os
+import re
 import subprocess
-from dataclasses import dataclass
-from typing import List
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Dict, List, Optional
+
+from .executor import DEFAULT_RETRY, NO_RETRY, RetryPolicy, log_line, run_with_retries
+from .metrics import NO_METRICS, MetricsRecorder
+
+CACHE_MODES = ("builder", "local", "registry")
 
 
 @dataclass
@@ -28,29 +39,493 @@ class Image:
     tag: str
     id: str
     path: str
+    service: str = ""
+
+
+@dataclass
+class CacheConfig:
+    """BuildKit layer cache settings shared by all the images of a service.
+
+    Attributes:
+        mode: "builder" only uses the builder's own cache, "local" imports and
+            exports the cache to a directory and "registry" to a registry repository
+        location: Cache directory ("local") or repository ("registry")
+        namespace: Groups the cache entries of all the images, by default they
+            are grouped by the service each image belongs to
+        no_cache: Build without using any cache
+    """
+    mode: str = "builder"
+    location: str = ""
+    namespace: str = ""
+    no_cache: bool = False
+
+    def cache_from(self, image: Image) -> Optional[str]:
+        """Return the cache import specification for an image, if any."""
+        if self.no_cache:
+            return None
+        if self.mode == "local":
+            return f"type=local,src={self._directory(image)}"
+        if self.mode == "registry":
+            return f"type=registry,ref={self._ref(image)}"
+        return None
+
+    def cache_to(self, image: Image) -> Optional[str]:
+        """Return the cache export specification for an image, if any."""
+        if self.no_cache:
+            return None
+        if self.mode == "local":
+            return f"type=local,dest={self._directory(image)},mode=max"
+        if self.mode == "registry":
+            return f"type=registry,ref={self._ref(image)},mode=max"
+        return None
+
+    def cache_args(self, image: Image) -> List[str]:
+        """Return the buildx cache arguments for an image."""
+        if self.no_cache:
+            return ["--no-cache"]
+        args = []
+        if self.cache_from(image):
+            args.extend(["--cache-from", self.cache_from(image)])
+        if self.cache_to(image):
+            args.extend(["--cache-to", self.cache_to(image)])
+        return args
+
+    def _directory(self, image: Image) -> str:
+        return os.path.join(self.location, self.namespace or image.service, image.id)
+
+    def _ref(self, image: Image) -> str:
+        # registry tags only allow [A-Za-z0-9_.-]
+        namespace = self.namespace or image.service
+        cache_tag = re.sub(r"[^A-Za-z0-9_.-]", "-", f"{namespace}-{image.id}".strip("-"))[:128]
+        return f"{self.location}:{cache_tag}"
+
+
+@dataclass
+class BuildResult:
+    """Outcome of a successful image build.
+
+    Attributes:
+        image: The image that was built
+        digest: Manifest digest of the pushed image, when buildx reported it
+        duration: Seconds spent building (and pushing) the image, None when it
+            was built together with other images
+    """
+    image: Image
+    digest: Optional[str] = None
+    duration: Optional[float] = None
+
+
+class BuildError(Exception):
+    """Raised when one or more images could not be built.
+
+    Attributes:
+        failures: Mapping of image tag to the exception raised by its build
+    """
+
+    def __init__(self, failures: Dict[str, Exception]):
+        self.failures = failures
+        super().__init__(f"failed to build {len(failures)} image(s): {', '.join(failures)}")
+
+
+class _BuildScheduler:
+    """Runs image builds on a bounded thread pool.
+
+    In fail-fast mode the first failure skips the builds that have not
+    started yet and terminates the ones that are still running.
+
+    When platforms are given, every image is built once per platform and
+    each build counts towards the jobs limit; once all the platforms of an
+    image are pushed, merge_command stitches them into one manifest list.
+
+    Images listed in dependencies only start once the images they build
+    from are pushed; the others start right away. Images whose parent
+    failed are not built.
+
+    Every command may run for timeout seconds and is run again, as retry
+    allows, when it fails with a transient registry error; the images
+    already pushed are kept either way.
+    """
+
+    def __init__(self, jobs: int, keep_going: bool, on_built: Optional[Callable[[BuildResult], None]],
+                 build_command: Callable[[Image, Optional[str], Optional[str]], List[str]],
+                 metadata_dir: Optional[str], metrics: MetricsRecorder, platforms: Optional[List[str]] = None,
+                 merge_command: Optional[Callable[[Image, List[str]], List[str]]] = None,
+                 dependencies: Optional[Dict[str, List[str]]] = None, timeout: Optional[float] = None,
+                 retry: RetryPolicy = NO_RETRY):
+        self.jobs = jobs
+        self.keep_going = keep_going
+        self.on_built = on_built
+        self.build_command = build_command
+        self.metadata_dir = metadata_dir
+        self.metrics = metrics
+        self.platforms: List[Optional[str]] = list(platforms) if platforms else [None]
+        self.merge_command = merge_command
+        self.dependencies = dependencies or {}
+        self.timeout = timeout
+        self.retry = retry
+        self.results: Dict[str, BuildResult] = {}
+        self.failures: Dict[str, Exception] = {}
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._processes: Dict[str, subprocess.Popen] = {}
+        self._digests: Dict[str, Dict[str, Optional[str]]] = {}
+        self._started: Dict[str, float] = {}
+
+    def run(self, images: List[Image]) -> List[BuildResult]:
+        units = len(images) * len(self.platforms)
+        workers = units if self.jobs < 1 else min(self.jobs, units)
+        tags = {each.tag for each in images}
+        waiting = {each.tag: {parent for parent in self.dependencies.get(each.tag, []) if parent in tags}
+                   for each in images}
+        children: Dict[str, List[Image]] = {}
+        for each in images:
+            for parent in waiting[each.tag]:
+                children.setdefault(parent, []).append(each)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            running: Dict[Future, Image] = {}
+
+            def start(image: Image):
+                for platform in self.platforms:
+                    running[executor.submit(self._run_one, image, platform)] = image
+
+            for each in images:
+                if not waiting[each.tag]:
+                    start(each)
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    image = running.pop(future)
+                    if image.tag not in self.results:
+                        # another platform is still building, or the build failed
+                        continue
+                    for child in children.get(image.tag, []):
+                        waiting[child.tag].discard(image.tag)
+                        if not waiting[child.tag] and not self._stopped.is_set():
+                            start(child)
+
+        for each in images:
+            if each.tag not in self.results and waiting[each.tag] and self.keep_going:
+                self.failures[each.tag] = RuntimeError(f"not built, {', '.join(sorted(waiting[each.tag]))} "
+                                                       f"failed to build")
+        unbuilt = [each.tag for each in images if each.tag not in self.results]
+        if unbuilt and not self.failures:
+            raise RuntimeError(f"images depend on each other in a cycle: {', '.join(unbuilt)}")
+        if self.failures and not self.keep_going:
+            raise next(iter(self.failures.values()))
+        if self.failures:
+            raise BuildError(self.failures)
+        return [self.results[each.tag] for each in images]
+
+    def _run_one(self, image: Image, platform: Optional[str]):
+        if self._stopped.is_set():
+            return
+        attributes = {"platform": platform} if platform is not None else {}
+        try:
+            with self.metrics.span("build_image", tag=image.tag, id=image.id, service=image.service,
+                                   cache="miss", **attributes) as span:
+                result = self._build(image, platform)
+                span.update(exit_code=0, digest=result.digest)
+            if platform is not None:
+                result = self._merge(image, platform, result.digest)
+                if result is None:
+                    # other platforms of the image are still building
+                    return
+            with self._lock:
+                self.results[image.tag] = result
+            if self.on_built is not None:
+                self.on_built(result)
+        except Exception as error:
+            with self._lock:
+                if self._stopped.is_set():
+                    # terminated because another image failed first
+                    return
+                self.failures[_unit_key(image, platform)] = error
+                if not self.keep_going:
+                    self._stopped.set()
+                    for process in self._processes.values():
+                        process.terminate()
+            log_line(_unit_prefix(image, platform), f"build failed: {error}")
+
+    def _build(self, image: Image, platform: Optional[str]) -> BuildResult:
+        key = _unit_key(image, platform)
+        print(f"building {key} with path {image.path}")
+        started = time.perf_counter()
+        with self._lock:
+            self._started.setdefault(image.tag, started)
+        metadata_file = metadata_path(self.metadata_dir, key)
+        run_with_retries(self.build_command(image, platform, metadata_file), _unit_prefix(image, platform),
+                         self.timeout, self.retry, lambda process: self._register(key, process), self._stopped)
+        return BuildResult(image, read_metadata(metadata_file).get("containerimage.digest"),
+                           time.perf_counter() - started)
+
+    def _merge(self, image: Image, platform: str, digest: Optional[str]) -> Optional[BuildResult]:
+        """Record a pushed platform and, once it is the last one, create the image's manifest list."""
+        with self._lock:
+            digests = self._digests.setdefault(image.tag, {})
+            digests[platform] = digest
+            if len(digests) < len(self.platforms):
+                return None
+        missing = [each for each in self.platforms if not digests[each]]
+        if missing:
+            raise RuntimeError(f"buildx did not report the digest of {image.tag} for {', '.join(missing)}")
+        with self.metrics.span("merge_manifest", tag=image.tag, platforms=len(self.platforms)) as span:
+            run_with_retries(self.merge_command(image, [digests[each] for each in self.platforms]), image.id,
+                             self.timeout, self.retry, lambda process: self._register(image.tag, process),
+                             self._stopped)
+            # the digest of the manifest list is only known to the registry
+            from .registry import inspect_remote
+            remote = inspect_remote(image.tag)
+            span["digest"] = remote.digest if remote is not None else None
+        return BuildResult(image, span["digest"], time.perf_counter() - self._started[image.tag])
+
+    def _register(self, key: str, process: Optional[subprocess.Popen]):
+        with self._lock:
+            if process is None:
+                self._processes.pop(key, None)
+                return
+            if self._stopped.is_set():
+                process.terminate()
+            self._processes[key] = process
+
 
+def _unit_key(image: Image, platform: Optional[str]) -> str:
+    return image.tag if platform is None else f"{image.tag} ({platform})"
 
-def build_container_images(images: List[Image], platform: str, local_debug: bool):
+
+def _unit_prefix(image: Image, platform: Optional[str]) -> str:
+    return image.id if platform is None else f"{image.id} {platform}"
+
+
+def metadata_path(metadata_dir: Optional[str], name: str) -> Optional[str]:
+    """Return where a build writes its buildx --metadata-file, None without a metadata directory."""
+    if metadata_dir is None:
+        return None
+    return os.path.join(metadata_dir, re.sub(r"[^A-Za-z0-9_.-]", "_", name) + ".json")
+
+
+def read_metadata(metadata_file: Optional[str]) -> Dict[str, Any]:
+    """Read a buildx --metadata-file, which is missing when the build did not write one."""
+    if metadata_file is None:
+        return {}
+    try:
+        with open(metadata_file) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def build_container_images(images: List[Image], platform: str, local_debug: bool,
+                           jobs: int = 1, keep_going: bool = False,
+                           on_built: Optional[Callable[[BuildResult], None]] = None,
+                           cache: Optional[CacheConfig] = None, bake: bool = False,
+                           metrics: MetricsRecorder = NO_METRICS, split_platforms: bool = False,
+                           builders: Optional[Dict[str, str]] = None,
+                           dependencies: Optional[Dict[str, List[str]]] = None,
+                           timeout: Optional[float] = None,
+                           retry: RetryPolicy = DEFAULT_RETRY,
+                           build_command: Optional[Callable[[Image, Optional[str], Optional[str]], List[str]]] = None,
+                           builder: Optional[str] = None) -> List[BuildResult]:
     """Build Docker container images for the given list of images.
     
     Args:
         images: List of Image objects containing tag, id, and path
         platform: Docker buildx platform specification (e.g., "linux/amd64")
-        local_debug: Debug flag (currently unused but kept for compatibility)
+        local_debug: Build and load the images into the local store instead of pushing them
+        jobs: Maximum number of images built at the same time, 0 builds all of them at once
+        keep_going: Keep building the remaining images when one fails and raise a
+            BuildError listing every failure at the end, instead of stopping at the first one
+        on_built: Called from the build thread with the result of each image built successfully
+        cache: BuildKit cache settings, by default only the builder's own cache is used
+        bake: Build all the images with a single ``docker buildx bake`` invocation, which
+            lets BuildKit share base layers and run and push the builds in parallel itself
+            (jobs and keep_going do not apply)
+        metrics: Records a timing span for every image build
+        split_platforms: Build each platform of a multi-platform image separately, so the
+            platforms build in parallel (each counts towards jobs), push them by digest and
+            stitch them into one manifest list with ``docker buildx imagetools create``.
+            Ignored with local_debug, which only builds one platform.
+        builders: Buildx builder to use for each platform when splitting, for example a
+            native arm64 node for "linux/arm64"; other platforms use builder
+        dependencies: Tags of the given images each image builds from (see
+            deployment.planner); an image starts as soon as those are pushed
+        timeout: Seconds each image build (and push) may run before it is terminated,
+            None waits forever; it does not apply to bake
+        retry: How builds failing with a transient registry error (5xx answer, rate
+            limit, dropped connection) are run again; images already pushed are kept
+        build_command: Returns the command building an image instead of ``docker buildx
+            build --push``, given the image, None and the path of its buildx metadata
+            file; used to write the images elsewhere, as deployment.export does. It
+            cannot be combined with bake or split_platforms.
+        builder: Buildx builder of the builds, passed with ``--builder``; None uses the
+            current one (``docker buildx use`` or BUILDX_BUILDER)
+
+    Returns:
+        The result of every image, in the given order
+    """
+    if not images:
+        return []
+    if bake and split_platforms:
+        raise ValueError("bake builds every platform together, it cannot split platforms")
+    if build_command is not None and (bake or split_platforms):
+        raise ValueError("a build command cannot be combined with bake or split_platforms")
+    os.environ["DOCKER_BUILDKIT"] = str(1)
+    if bake:
+        with metrics.span("bake", images=len(images)) as span:
+            results = bake_container_images(images, platform, local_debug, on_built=on_built, cache=cache,
+                                            dependencies=dependencies, retry=retry, builder=builder)
+            span["exit_code"] = 0
+        return results
+    platforms = [each.strip() for each in platform.split(",")] if platform else []
+    with tempfile.TemporaryDirectory(prefix="colmena-build-") as metadata_dir:
+        if split_platforms and not local_debug and len(platforms) > 1:
+            scheduler = _BuildScheduler(
+                jobs, keep_going, on_built,
+                lambda image, image_platform, metadata_file: docker_platform_build_command(
+                    image, image_platform, cache, metadata_file, (builders or {}).get(image_platform, builder)),
+                metadata_dir, metrics, platforms, imagetools_create_command, dependencies, timeout, retry)
+        else:
+            scheduler = _BuildScheduler(
+                jobs, keep_going, on_built,
+                build_command or (lambda image, _, metadata_file: docker_build_command(image, platform, local_debug,
+                                                                                       cache, metadata_file, builder)),
+                None if local_debug else metadata_dir, metrics, dependencies=dependencies, timeout=timeout,
+                retry=retry)
+        return scheduler.run(images)
+
+
+def bake_definition(images: List[Image], platform: str, local_debug: bool,
+                    cache: Optional[CacheConfig] = None,
+                    dependencies: Optional[Dict[str, List[str]]] = None) -> Dict[str, Any]:
+    """Return a buildx bake file (JSON format) with one target per image.
+
+    Args:
+        images: List of Image objects containing tag, id, and path
+        platform: Docker buildx platform specification (e.g., "linux/amd64")
+        local_debug: Load the images into the local store instead of pushing them
+        cache: BuildKit cache settings
+        dependencies: Tags of the given images each image builds from, which are
+            linked to their targets so bake builds them first and uses the result
+    """
+    from .planner import parent_references
+
+    targets: Dict[str, Dict[str, Any]] = {}
+    names = {each.tag: name for name, each in _bake_targets(images).items()}
+    for name, each in _bake_targets(images).items():
+        target: Dict[str, Any] = {
+            "context": each.path,
+            "dockerfile": "Dockerfile",
+            "tags": [each.tag],
+        }
+        if local_debug:
+            target["output"] = ["type=docker"]
+        else:
+            if platform:
+                target["platforms"] = platform.split(",")
+            target["output"] = ["type=registry"]
+        if cache is not None and cache.no_cache:
+            target["no-cache"] = True
+        elif cache is not None:
+            if cache.cache_from(each):
+                target["cache-from"] = [cache.cache_from(each)]
+            if cache.cache_to(each):
+                target["cache-to"] = [cache.cache_to(each)]
+        parents = set((dependencies or {}).get(each.tag, []))
+        # a context only replaces the image when it is named like the Dockerfile refers to it
+        contexts = {reference: f"target:{names[parent]}"
+                    for reference, parent in parent_references(each, names).items() if parent in parents}
+        if contexts:
+            target["contexts"] = contexts
+        targets[name] = target
+    return {
+        "group": {"default": {"targets": list(targets)}},
+        "target": targets,
+    }
+
+
+def _bake_targets(images: List[Image]) -> Dict[str, Image]:
+    targets: Dict[str, Image] = {}
+    for each in images:
+        # target names only allow [a-zA-Z0-9_-] and must be unique
+        name = re.sub(r"[^a-zA-Z0-9_-]", "_", each.id)
+        while name in targets:
+            name += "_"
+        targets[name] = each
+    return targets
+
+
+def bake_container_images(images: List[Image], platform: str, local_debug: bool,
+                          on_built: Optional[Callable[[BuildResult], None]] = None,
+                          cache: Optional[CacheConfig] = None,
+                          dependencies: Optional[Dict[str, List[str]]] = None,
+                          retry: RetryPolicy = DEFAULT_RETRY, builder: Optional[str] = None) -> List[BuildResult]:
+    """Build all the given images with one ``docker buildx bake`` invocation.
+
+    Args:
+        images: List of Image objects containing tag, id, and path
+        platform: Docker buildx platform specification (e.g., "linux/amd64")
+        local_debug: Load the images into the local store instead of pushing them
+        on_built: Called with the result of every image once the bake succeeded
+        cache: BuildKit cache settings
+        dependencies: Tags of the given images each image builds from
+        retry: How the bake is run again when it fails with a transient registry
+            error, the images it already pushed come from the builder's cache
+        builder: Buildx builder to bake with, None uses the current one
+
+    Returns:
+        The result of every image, in the given order
+    """
+    definition = bake_definition(images, platform, local_debug, cache, dependencies)
+    with tempfile.TemporaryDirectory(prefix="colmena-bake-") as bake_dir:
+        bake_file = os.path.join(bake_dir, "docker-bake.json")
+        metadata_file = os.path.join(bake_dir, "metadata.json")
+        with open(bake_file, "w") as f:
+            json.dump(definition, f, indent=2)
+        print(f"baking {len(images)} images: {', '.join(each.tag for each in images)}")
+        command = ["docker", "buildx", "bake"]
+        if builder:
+            command.extend(["--builder", builder])
+        command.extend(["-f", bake_file, "--metadata-file", metadata_file])
+        run_with_retries(command, "bake", retry=retry)
+        metadata = read_metadata(metadata_file)
+    results = []
+    for name, each in _bake_targets(images).items():
+        result = BuildResult(each, metadata.get(name, {}).get("containerimage.digest"))
+        if on_built is not None:
+            on_built(result)
+        results.append(result)
+    return results
+
+
+def publish_container_images(images: List[Image], timeout: Optional[float] = None,
+                             retry: RetryPolicy = DEFAULT_RETRY):
+    """Push already built Docker container images to the registry.
+
+    Args:
+        images: List of Image objects whose tags are pushed
+        timeout: Seconds each push may run before it is terminated, None waits forever
+        retry: How pushes failing with a transient registry error are run again
     """
+    os.environ["DOCKER_BUILDKIT"] = str(1)
     for each in images:
-        print(f"building {each.tag} with path {each.path}")
-        os.environ["DOCKER_BUILDKIT"] = str(1)
-        docker_build_command = docker_build_command_string(each, platform, local_debug)
-        subprocess.check_output(docker_build_command, shell=True)  # security issue
-
-def docker_build_command_string(image: Image, platform: str, local_debug: bool):
-    args = [
-        "docker", "buildx", "build",
-        "--no-cache",
+        print(f"pushing {each.tag}")
+        run_with_retries(["docker", "image", "push", each.tag], each.id, timeout, retry)
+
+
+def docker_build_command(image: Image, platform: str, local_debug: bool,
+                         cache: Optional[CacheConfig] = None, metadata_file: Optional[str] = None,
+                         builder: Optional[str] = None) -> List[str]:
+    args = ["docker", "buildx", "build"]
+    if builder:
+        args.extend(["--builder", builder])
+    args.extend([
         "-t", image.tag,
         "-f", f"{image.path}/Dockerfile",
-    ]
+    ])
+    if cache is not None:
+        args.extend(cache.cache_args(image))
+    if metadata_file is not None:
+        args.extend(["--metadata-file", metadata_file])
     if local_debug:
         args.append("--load")
     if not local_debug:
@@ -59,4 +534,34 @@ def docker_build_command_string(image: Image, platform: str, local_debug: bool):
         args.append("--push")
 
     args.append(image.path)
-    return " ".join(args)
+    return args
+
+
+def docker_platform_build_command(image: Image, platform: str, cache: Optional[CacheConfig] = None,
+                                  metadata_file: Optional[str] = None, builder: Optional[str] = None) -> List[str]:
+    """Build one platform of an image and push it by digest, without tagging it.
+
+    The platforms are tagged together by imagetools_create_command
+    once all of them are pushed. Each platform has its own cache entry.
+    """
+    args = ["docker", "buildx", "build"]
+    if builder:
+        args.extend(["--builder", builder])
+    args.extend(["-f", f"{image.path}/Dockerfile"])
+    if cache is not None:
+        args.extend(cache.cache_args(replace(image, id=f"{image.id}-{re.sub(r'[^A-Za-z0-9_.-]', '-', platform)}")))
+    if metadata_file is not None:
+        args.extend(["--metadata-file", metadata_file])
+    args.extend([
+        "--platform", platform,
+        "--output", f"type=image,name={image.tag},push-by-digest=true,name-canonical=true,push=true",
+        image.path,
+    ])
+    return args
+
+
+def imagetools_create_command(image: Image, digests: List[str]) -> List[str]:
+    """Tag the platforms of an image, pushed by digest, as one multi-platform manifest list."""
+    args = ["docker", "buildx", "imagetools", "create", "-t", image.tag]
+    args.extend(f"{image.tag}@{digest}" for digest in digests)
+    return args
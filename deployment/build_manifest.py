@@ -0,0 +1,155 @@
+#!/usr/bin/python
+#
+#  Copyright 2002-2025 Barcelona Supercomputing Center (www.bsc.es)
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import stat
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from .build_image import Image
+from .dockerignore import DockerIgnore
+
+MANIFEST_FILE = ".colmena_build_manifest.json"
+MANIFEST_VERSION = 1
+# seconds between two saves of the manifest while images are being pushed
+SAVE_INTERVAL = 1.0
+
+
+def context_digest(image: Image, platform: Optional[str], files: Optional[List[Tuple[str, int]]] = None) -> str:
+    """Hash the build context of an image together with the target platform.
+
+    Only the files Docker would send to the builder are hashed, so changes
+    to paths listed in the context's .dockerignore do not trigger a rebuild.
+
+    Args:
+        files: Filled with the relative path and size of every file hashed, so
+            that the context does not have to be walked again to measure it
+    """
+    digest = hashlib.sha256()
+    digest.update(f"platform={platform}\n".encode())
+    dockerignore = DockerIgnore.from_context(image.path)
+    for relative_path in dockerignore.walk(image.path):
+        full_path = os.path.join(image.path, relative_path)
+        info = os.lstat(full_path)
+        mode = info.st_mode
+        if files is not None:
+            files.append((relative_path, info.st_size))
+        digest.update(f"{relative_path}\0{stat.S_IMODE(mode) & 0o111:o}\0".encode())
+        if stat.S_ISLNK(mode):
+            digest.update(os.readlink(full_path).encode())
+        else:
+            with open(full_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+        digest.update(b"\0")
+    return f"sha256:{digest.hexdigest()}"
+
+
+class BuildManifest:
+    """Record of the build context digest of every image last pushed from a build folder.
+
+    The manifest is stored next to service_description.json and lets
+    deployments skip images whose context has not changed since their
+    last successful push.
+    """
+
+    def __init__(self, path: str, entries: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.path = path
+        self.entries = entries if entries is not None else {}
+        self._computed: Dict[str, Dict[str, Any]] = {}
+        # files of the build context of every image checked by outdated(), with their size
+        self.contexts: Dict[str, List[Tuple[str, int]]] = {}
+        self._lock = threading.Lock()
+        self._saved_at = 0.0
+        self._dirty = False
+
+    @classmethod
+    def load(cls, build_path: str) -> "BuildManifest":
+        path = os.path.join(build_path, MANIFEST_FILE)
+        try:
+            with open(path) as f:
+                content = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return cls(path)
+        if content.get("version") != MANIFEST_VERSION:
+            return cls(path)
+        return cls(path, content.get("images", {}))
+
+    def outdated(self, images: List[Image], platform: Optional[str]) -> List[Image]:
+        """Return the images whose build context changed since they were last pushed.
+
+        The digests are computed before building, so that files edited
+        while a build runs are picked up by the next deployment.
+        """
+        outdated = []
+        for each in images:
+            self.contexts[each.tag] = []
+            digest = context_digest(each, platform, self.contexts[each.tag])
+            self._computed[each.tag] = {"digest": digest, "platform": platform}
+            entry = self.entries.get(each.tag)
+            if entry is None or entry.get("digest") != digest:
+                outdated.append(each)
+        return outdated
+
+    def image_digest(self, image: Image) -> Optional[str]:
+        """Return the registry digest recorded when the image was last pushed."""
+        return self.entries.get(image.tag, {}).get("image_digest")
+
+    def record(self, image: Image, image_digest: Optional[str] = None):
+        """Store the context digest of a successfully pushed image and save the manifest.
+
+        The context digest is the one computed by outdated() before the build.
+
+        Safe to call from the build threads. The manifest is saved at most
+        every SAVE_INTERVAL seconds, so that pushing many images does not
+        rewrite it once per image; call flush() once the builds are over.
+        A later failure loses at most the images of the last interval,
+        which are built again by the next deployment.
+
+        Args:
+            image: The pushed image
+            image_digest: Registry manifest digest of the pushed image, if known
+        """
+        with self._lock:
+            entry = dict(self._computed[image.tag])
+            entry["pushed_at"] = datetime.now(timezone.utc).isoformat()
+            if image_digest:
+                entry["image_digest"] = image_digest
+            self.entries[image.tag] = entry
+            self._dirty = True
+            if time.monotonic() - self._saved_at >= SAVE_INTERVAL:
+                self._save()
+
+    def flush(self):
+        """Save the images recorded since the last save."""
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "images": self.entries}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self._saved_at = time.monotonic()
+        self._dirty = False
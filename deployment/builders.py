@@ -0,0 +1,263 @@
+#!/usr/bin/python
+#
+#  Copyright 2002-2025 Barcelona Supercomputing Center (www.bsc.es)
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+# -*- coding: utf-8 -*-
+
+"""Named, reusable buildx builders.
+
+Builders are kept between deployments: an existing, running builder is
+reused as is, a stopped one is only bootstrapped, and a missing or broken
+one is created with the configured BuildKit parallelism and cache garbage
+collection policy. QEMU emulators are only registered when a requested
+platform is not supported by the builder it is routed to.
+"""
+
+import json
+import os
+import subprocess
+import tempfile
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from .registry import normalize_platform
+
+DEFAULT_DRIVER = "docker-container"
+BINFMT_IMAGE = "tonistiigi/binfmt"
+
+
+@dataclass
+class BuilderSpec:
+    """Settings of a buildx builder managed by the tool.
+
+    Attributes:
+        name: Name of the buildx builder
+        platforms: Platforms routed to this builder, for example the native
+            platform of a remote node; the first builder of a pool builds the rest
+        endpoint: Docker endpoint of the node (e.g., "ssh://user@arm-host"),
+            the local Docker daemon by default
+        driver: Buildx driver, "docker-container" supports multi-platform builds and cache export
+        parallelism: Maximum number of build steps BuildKit runs at once
+        gc_keep_storage_mb: Build cache BuildKit keeps when garbage collecting, in MB
+    """
+    name: str
+    platforms: List[str] = field(default_factory=list)
+    endpoint: Optional[str] = None
+    driver: str = DEFAULT_DRIVER
+    parallelism: Optional[int] = None
+    gc_keep_storage_mb: Optional[int] = None
+
+    @classmethod
+    def from_dict(cls, content: Dict[str, Any]) -> "BuilderSpec":
+        return cls(name=content["name"], platforms=list(content.get("platforms", [])),
+                   endpoint=content.get("endpoint"), driver=content.get("driver", DEFAULT_DRIVER),
+                   parallelism=content.get("parallelism"), gc_keep_storage_mb=content.get("gc_keep_storage_mb"))
+
+    def buildkitd_config(self) -> str:
+        """Return the buildkitd.toml applying the parallelism and GC settings, empty if there are none."""
+        lines = []
+        if self.parallelism is not None:
+            lines.append(f"  max-parallelism = {self.parallelism}")
+        if self.gc_keep_storage_mb is not None:
+            lines.append("  gc = true")
+            lines.append(f"  gckeepstorage = {self.gc_keep_storage_mb}")
+        if not lines:
+            return ""
+        return "[worker.oci]\n" + "\n".join(lines) + "\n"
+
+
+@dataclass
+class BuilderStatus:
+    """State of an existing builder, as reported by ``docker buildx inspect``.
+
+    Attributes:
+        name: Name of the builder
+        driver: Buildx driver of the builder
+        statuses: Status of every node ("running", "inactive", "stopped", "error"...)
+        platforms: Platforms the nodes can build, natively or emulated
+    """
+    name: str
+    driver: str = ""
+    statuses: List[str] = field(default_factory=list)
+    platforms: List[str] = field(default_factory=list)
+
+    @property
+    def running(self) -> bool:
+        return bool(self.statuses) and all(status == "running" for status in self.statuses)
+
+    @property
+    def broken(self) -> bool:
+        """Whether a node is in a state bootstrapping cannot fix."""
+        return any(status not in ("running", "inactive", "stopped") for status in self.statuses)
+
+
+def _docker(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run(["docker", *args], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+
+
+def _checked(*args: str) -> str:
+    process = _docker(*args)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, ["docker", *args], process.stdout, process.stderr)
+    return process.stdout
+
+
+def inspect_builder(name: str) -> Optional[BuilderStatus]:
+    """Return the state of a builder, or None when it does not exist."""
+    process = _docker("buildx", "inspect", name)
+    if process.returncode != 0:
+        return None
+    status = BuilderStatus(name=name)
+    for line in process.stdout.splitlines():
+        key, _, value = line.partition(":")
+        key, value = key.strip(), value.strip()
+        if key == "Driver" and not status.driver:
+            status.driver = value
+        elif key == "Status":
+            status.statuses.append(value)
+        elif key == "Platforms":
+            for each in value.split(","):
+                platform = normalize_platform(each.strip().rstrip("*"))
+                if platform and platform not in status.platforms:
+                    status.platforms.append(platform)
+    return status
+
+
+def create_builder(spec: BuilderSpec):
+    """Create and bootstrap a builder from its settings."""
+    command = ["buildx", "create", "--name", spec.name, "--driver", spec.driver]
+    if spec.platforms:
+        command.extend(["--platform", ",".join(spec.platforms)])
+    config = spec.buildkitd_config()
+    with tempfile.TemporaryDirectory(prefix="colmena-builder-") as config_dir:
+        if config:
+            config_file = os.path.join(config_dir, "buildkitd.toml")
+            with open(config_file, "w") as f:
+                f.write(config)
+            command.extend(["--buildkitd-config", config_file])
+        command.append("--bootstrap")
+        if spec.endpoint:
+            command.append(spec.endpoint)
+        print(f"creating buildx builder {spec.name}")
+        _checked(*command)
+
+
+def bootstrap_builder(name: str):
+    print(f"starting buildx builder {name}")
+    _checked("buildx", "inspect", "--bootstrap", name)
+
+
+def remove_builder(name: str):
+    print(f"removing buildx builder {name}")
+    _checked("buildx", "rm", name)
+
+
+def install_emulators(platforms: List[str]) -> bool:
+    """Register the QEMU emulators of the given platforms on the local Docker host.
+
+    A failed registration, for example without privileges, only prints a
+    warning: platforms that really cannot be built then fail at build time.
+
+    Returns:
+        Whether the emulators were registered
+    """
+    architectures = sorted({platform.split("/")[1] for platform in platforms if "/" in platform})
+    print(f"registering emulators for {', '.join(architectures)}")
+    process = _docker("run", "--rm", "--privileged", BINFMT_IMAGE, "--install", ",".join(architectures))
+    if process.returncode != 0:
+        print(f"warning: could not register emulators for {', '.join(architectures)}: "
+              f"{process.stderr.strip() or process.stdout.strip()}")
+        return False
+    return True
+
+
+class BuilderPool:
+    """A set of builders, reused between deployments.
+
+    The first builder builds every platform no other builder is configured
+    for. Use ensure() before building to get the builder of each platform:
+
+        pool = BuilderPool([BuilderSpec("colmena"), BuilderSpec("arm-node", ["linux/arm64"], "ssh://arm-host")])
+        routes = pool.ensure(["linux/amd64", "linux/arm64"])
+    """
+
+    def __init__(self, specs: List[BuilderSpec], recreate: bool = False):
+        """
+        Args:
+            specs: Builders of the pool, the first one is the default builder
+            recreate: Remove and create the builders again, to apply changed settings
+        """
+        if not specs:
+            raise ValueError("a builder pool needs at least one builder")
+        self.specs = specs
+        self.recreate = recreate
+
+    @classmethod
+    def load(cls, path: str, recreate: bool = False) -> "BuilderPool":
+        """Read a pool from a JSON file holding a list of builder settings."""
+        with open(path) as f:
+            return cls([BuilderSpec.from_dict(each) for each in json.load(f)], recreate)
+
+    @property
+    def default(self) -> BuilderSpec:
+        return self.specs[0]
+
+    def route(self, platform: str) -> BuilderSpec:
+        """Return the builder a platform is built on."""
+        platform = normalize_platform(platform)
+        for spec in self.specs[1:]:
+            if platform in (normalize_platform(each) for each in spec.platforms):
+                return spec
+        return self.default
+
+    def ensure(self, platforms: List[str]) -> Dict[str, str]:
+        """Make sure the builders of the given platforms are healthy and can build them.
+
+        Only the builders some platform is routed to are checked, and each
+        one is only created or bootstrapped when needed. Emulators are
+        registered for the platforms a local builder does not support.
+
+        Returns:
+            The name of the builder of every platform
+        """
+        routes = {platform: self.route(platform) for platform in platforms}
+        used = [spec for spec in self.specs if spec is self.default or spec in routes.values()]
+        statuses = {spec.name: self._ensure(spec) for spec in used}
+
+        # remote nodes are expected to build their platforms natively
+        unsupported = [platform for platform, spec in routes.items()
+                       if spec.endpoint is None and normalize_platform(platform) not in statuses[spec.name].platforms]
+        if unsupported and install_emulators(unsupported):
+            for spec in {routes[platform].name: routes[platform] for platform in unsupported}.values():
+                # the platforms of a node are detected when it starts
+                _checked("buildx", "stop", spec.name)
+                bootstrap_builder(spec.name)
+        return {platform: spec.name for platform, spec in routes.items()}
+
+    def _ensure(self, spec: BuilderSpec) -> BuilderStatus:
+        status = inspect_builder(spec.name)
+        if status is not None and (self.recreate or status.broken):
+            remove_builder(spec.name)
+            status = None
+        if status is None:
+            create_builder(spec)
+        elif not status.running:
+            bootstrap_builder(spec.name)
+        else:
+            print(f"reusing buildx builder {spec.name}")
+            return status
+        return inspect_builder(spec.name) or BuilderStatus(name=spec.name)
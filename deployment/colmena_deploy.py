@@ -17,24 +17,46 @@
 
 # -*- coding: utf-8 -*-
 
-import json
+import glob
 import os
-from typing import Dict, Any
+import time
+from typing import Dict, Any, List, Optional, Tuple
 
-import zenoh
-from .build_image import Image, build_container_images
+from .build_context import analyze_context, warn_large_contexts, write_dockerignore
+from .build_image import CACHE_MODES, CacheConfig, Image
+from .build_manifest import BuildManifest
+from .builders import BuilderPool, BuilderSpec
+from .encoding import ENCODINGS
+from .executor import DEFAULT_RETRY, RetryPolicy
+from .history import DEFAULT_HISTORY, DeploymentHistory
+from .metrics import NO_METRICS, MetricsRecorder
+from .options import DeployOptions
+from .planner import DeploymentPlan, image_dependencies, topological_order, with_dependents
+from .publisher import ServicePublisher
+from .registry import missing_from_registry
+from .service_loader import ServiceDefinitionError, load_definition
 
 
-def deploy_service(_args, build_path: str, platform: str, user: str, skip_build: bool):
-    with open(f"{build_path}/service_description.json") as f:
-        service_definition = json.load(f)
+def load_service(build_path: str, user: str, check_files: bool = True) -> Tuple[Dict[str, Any], List[Image]]:
+    """Read the service description of a build folder and the images it needs.
+
+        Parameters:
+            - build_path: build folder containing service_description.json
+            - user: DockerHub username prefixed to every image tag
+            - check_files: also check that every role and context has a folder with a Dockerfile
+
+        Returns the service definition, with the username added to its image
+        ids, and the images of its roles and contexts. Raises a
+        ServiceDefinitionError listing every problem of an invalid description."""
+    service_definition = load_definition(build_path, check_files)
+    service_name = service_definition["id"]["value"]
 
     images = []
     for role in service_definition["dockerRoleDefinitions"]:
         tag = user + "/" + role["imageId"]
         id = role["id"]
         path =  f"{build_path}/{id}"
-        image = Image(tag=tag, id=id, path=path)
+        image = Image(tag=tag, id=id, path=path, service=service_name)
         images.append(image)
 
         # add the Dockerhub username to the service definition
@@ -44,18 +66,226 @@ def deploy_service(_args, build_path: str, platform: str, user: str, skip_build:
         tag = user + "/" + context["imageId"]
         id = context["id"]
         path = f"{build_path}/context/{id}"
-        image = Image(tag=tag, id=id, path=path)
+        image = Image(tag=tag, id=id, path=path, service=service_name)
         images.append(image)
 
         # add the Dockerhub username to the service definition
         context["imageId"] = tag
+    return service_definition, images
+
+
+def load_services(build_paths: List[str], user: str,
+                  check_files: bool = True) -> List[Tuple[Dict[str, Any], List[Image]]]:
+    """Read the service descriptions of several build folders, see load_service.
+
+        The problems of every description are reported together in one
+        ServiceDefinitionError."""
+    services = []
+    errors = []
+    for build_path in build_paths:
+        try:
+            services.append(load_service(build_path, user, check_files))
+        except ServiceDefinitionError as error:
+            errors.extend(error.errors)
+    if errors:
+        raise ServiceDefinitionError(errors)
+    return services
+
+
+def deploy_service(_args, build_path: str, platform: str, user: str, skip_build: bool,
+                   options: Optional[DeployOptions] = None, metrics: MetricsRecorder = NO_METRICS):
+    deploy_services(_args, [build_path], platform, user, skip_build, options, metrics)
+
 
-    if not skip_build:
-        build_container_images(images, platform, _args.local_debug)
-        print("Built and published images")
-    else:
-        print("Skipped building images")
-    publish_service_definition(_args, service_definition)
+def deploy_services(_args, build_paths: List[str], platform: str, user: str, skip_build: bool,
+                    options: Optional[DeployOptions] = None, metrics: MetricsRecorder = NO_METRICS,
+                    publisher: Optional[ServicePublisher] = None):
+    """Deploy the services of several build folders at once.
+
+        Every service description is parsed before anything is built, images
+        shared by several services (same tag) are built once, all the images
+        are built together under the same jobs limit and the definitions are
+        published over a single Zenoh session. How the images are built and
+        published is set by options, see DeployOptions. Timing spans of every
+        phase and image are recorded in metrics. An open publisher can be
+        given to publish with, it is left open; the publish options then
+        come from the publisher."""
+    options = options or DeployOptions()
+    with metrics.span("deploy", services=len(build_paths)):
+        plan = plan_deployment(_args, build_paths, platform, user, skip_build, force_build=options.force_build,
+                               verify_registry=options.verify_registry, metrics=metrics)
+        services = plan.services
+        results = []
+
+        if not skip_build:
+            images, owners, manifests = plan.build, plan.owners, plan.manifests
+            # the contexts were already walked to hash them
+            warn_large_contexts(images, contexts={tag: files for manifest in manifests.values()
+                                                  for tag, files in manifest.contexts.items()})
+            with metrics.span("build", images=len(images)):
+                try:
+                    results = options.build_images(
+                        images, platform, _args.local_debug,
+                        on_built=(lambda result: manifests[owners[result.image.tag]].record(
+                            result.image, result.digest)) if manifests else None,
+                        metrics=metrics, dependencies=plan.dependencies)
+                finally:
+                    for manifest in manifests.values():
+                        manifest.flush()
+            print("Built and published images")
+        else:
+            print("Skipped building images")
+        if options.build_only:
+            return
+
+        owned = publisher is None
+        if owned:
+            publisher = options.publisher()
+        try:
+            with metrics.span("zenoh_open"):
+                publisher.open()
+            with metrics.span("publish", services=len(services)) as span:
+                keys = publisher.publish_many((service_definition for service_definition, _ in services),
+                                              plan.digests(results))
+                span["published"] = sum(key is not None for key in keys)
+                visible_after = [publisher.visible_after[key] for key in keys if key in publisher.visible_after]
+                if visible_after:
+                    span["visible_after"] = max(visible_after)
+        finally:
+            if owned:
+                publisher.close()
+
+
+def plan_deployment(_args, build_paths: List[str], platform: str, user: str, skip_build: bool,
+                    force_build: bool = False, verify_registry: bool = False,
+                    metrics: MetricsRecorder = NO_METRICS) -> DeploymentPlan:
+    """Decide what deploying some build folders builds, without building or publishing anything.
+
+        Parses and validates every service description, orders the images
+        so that each one comes after the images its Dockerfile builds from,
+        and selects the images to build like deploy_services does."""
+    build_paths = list(dict.fromkeys(build_paths))
+    with metrics.span("parse", services=len(build_paths)):
+        services = load_services(build_paths, user, check_files=not skip_build)
+        images, owners = unique_images(build_paths, [service_images for _, service_images in services])
+        dependencies = image_dependencies(images)
+        images = topological_order(images, dependencies)
+    plan = DeploymentPlan(services, images, owners, dependencies)
+    if skip_build:
+        plan.reasons = {each.tag: "--skip_build" for each in images}
+        return plan
+
+    plan.build, plan.manifests = images_to_build(images, owners, platform, _args.local_debug, force_build,
+                                                 verify_registry, metrics, dependencies)
+    building = {each.tag for each in plan.build}
+    for each in images:
+        rebuilt_parents = [parent for parent in dependencies[each.tag] if parent in building]
+        if each.tag not in building:
+            plan.reasons[each.tag] = "unchanged since it was last pushed"
+        elif force_build:
+            plan.reasons[each.tag] = "--force_build"
+        elif _args.local_debug:
+            plan.reasons[each.tag] = "--local_debug images are always built"
+        elif rebuilt_parents:
+            plan.reasons[each.tag] = f"builds from {', '.join(rebuilt_parents)}"
+        else:
+            plan.reasons[each.tag] = "changed or not pushed yet"
+    return plan
+
+
+def unique_images(build_paths: List[str], service_images: List[List[Image]]) -> Tuple[List[Image], Dict[str, str]]:
+    """Merge the images of several services, keeping one image per tag.
+
+        Returns the images and, for every tag, the build folder that owns its
+        build, which is the first service using the tag."""
+    images = []
+    owners: Dict[str, str] = {}
+    for build_path, each_service in zip(build_paths, service_images):
+        for each in each_service:
+            if each.tag not in owners:
+                owners[each.tag] = build_path
+                images.append(each)
+            elif owners[each.tag] != build_path:
+                print(f"{each.tag} is shared with {owners[each.tag]}, building it only once")
+    return images, owners
+
+
+def images_to_build(images: List[Image], owners: Dict[str, str], platform: str, local_debug: bool,
+                    force_build: bool = False, verify_registry: bool = False,
+                    metrics: MetricsRecorder = NO_METRICS,
+                    dependencies: Optional[Dict[str, List[str]]] = None) -> Tuple[List[Image], Dict[str, BuildManifest]]:
+    """Drop the images that are unchanged since they were last pushed.
+
+        Returns the images to build and the build manifest of every build
+        folder, to record the images once pushed. Only pushed images are
+        tracked: with local_debug every image is built and no manifest is
+        returned. With force_build every image is built too, but the build
+        contexts are still hashed so that the forced pushes are recorded.
+        Images building from a rebuilt image (see deployment.planner) are
+        rebuilt too, even if unchanged."""
+    if local_debug:
+        return images, {}
+    with metrics.span("check_cache", images=len(images)) as span:
+        manifests = {build_path: BuildManifest.load(build_path) for build_path in dict.fromkeys(owners.values())}
+        outdated = outdated_images(images, owners, manifests, platform, verify_registry and not force_build)
+        if force_build:
+            outdated = list(images)
+        elif dependencies:
+            outdated = with_dependents(images, outdated, dependencies)
+        span.update(hits=len(images) - len(outdated), misses=len(outdated))
+    for each in images:
+        if each not in outdated:
+            print(f"skipping {each.tag}, unchanged since it was last pushed")
+            now = time.time()
+            metrics.add("build_image", now, now, tag=each.tag, id=each.id, service=each.service, cache="hit")
+    return outdated, manifests
+
+
+def outdated_images(images: List[Image], owners: Dict[str, str], manifests: Dict[str, BuildManifest],
+                    platform: str, verify_registry: bool = False) -> List[Image]:
+    """Return the images that have to be built and pushed again, in order.
+
+        An image is outdated when its build context changed since it was last
+        pushed according to the manifest of the build folder owning it or,
+        with verify_registry, when the registry no longer has the digest
+        last pushed."""
+    outdated = []
+    for build_path, manifest in manifests.items():
+        owned = [each for each in images if owners[each.tag] == build_path]
+        outdated.extend(manifest.outdated(owned, platform))
+    if verify_registry:
+        unchanged = [each for each in images if each not in outdated]
+        expected = {each.tag: manifests[owners[each.tag]].image_digest(each) for each in unchanged}
+        outdated.extend(missing_from_registry(unchanged, expected, platform))
+    return [each for each in images if each in outdated]
+
+
+def expand_build_paths(build_paths: List[str], build_paths_file: Optional[str] = None) -> List[str]:
+    """Expand the build folders given on the command line.
+
+        Parameters:
+            - build_paths: build folders or glob patterns
+            - build_paths_file: optional file listing one build folder or pattern per
+              line, relative to the file; empty lines and lines starting with # are ignored"""
+    entries = list(build_paths)
+    if build_paths_file:
+        base_dir = os.path.dirname(os.path.abspath(build_paths_file))
+        with open(build_paths_file) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    entries.append(os.path.join(base_dir, line))
+
+    expanded = []
+    for entry in entries:
+        if any(char in entry for char in "*?["):
+            matches = sorted(glob.glob(entry))
+            if not matches:
+                raise FileNotFoundError(f"no build folder matches {entry}")
+            expanded.extend(matches)
+        else:
+            expanded.append(entry)
+    return list(dict.fromkeys(os.path.normpath(each) for each in expanded))
 
 def publish_service_definition(_args, service_definition: Dict[str, Any]):
     """Publish service definition to zenoh, keyexpr: colmena_service_definitions
@@ -63,12 +293,8 @@ def publish_service_definition(_args, service_definition: Dict[str, Any]):
         Parameters:
             - _args: deployment arguments
             - service_definition: json service definition"""
-    service_name = service_definition["id"]["value"]
-    print(f"publishing service definition for {service_name} to Zenoh")
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    zenoh_config_path = os.path.join(script_dir, 'zenoh_config.json5')
-    zenoh_session = zenoh.open(zenoh.Config.from_file(zenoh_config_path))
-    zenoh_session.put(f"colmena_service_definitions/{service_name}", json.dumps(service_definition))
+    with ServicePublisher() as publisher:
+        publisher.publish(service_definition)
 
 if __name__ == "__main__":
     import argparse
@@ -79,13 +305,204 @@ if __name__ == "__main__":
         help="pretty print colmena service description",
         action="store_true",
     )
-    parser.add_argument("--build_path", required=True, help="Path to build folder")
+    parser.add_argument("--build_path", nargs="+", default=[],
+                        help="Path to build folder, several folders or glob patterns deploy many services at once")
+    parser.add_argument("--build_paths_file", help="File listing build folders to deploy, one per line")
     parser.add_argument("--platform", help="Docker buildx architectures")
     parser.add_argument("--host", help="Deployment host")
     parser.add_argument("--port", help="Deployment port")
-    parser.add_argument("--user", required=True, help="DockerHub username")
+    parser.add_argument("--user", help="DockerHub username, required unless --validate_only is given")
+    parser.add_argument("--validate_only", action="store_true",
+                        help="Only check the service descriptions and the role and context folders, "
+                             "exiting with an error if any of them is invalid")
     parser.add_argument("--skip_build", action="store_true", help="Skip building Docker images")
     parser.add_argument("--local_debug", action="store_true", help="Build and load image into local store")
+    parser.add_argument("--force_build", action="store_true",
+                        help="Rebuild and push every image, even if its build context is unchanged")
+    parser.add_argument("--cache_mode", choices=CACHE_MODES, default="builder",
+                        help="Where BuildKit imports and exports the layer cache from")
+    parser.add_argument("--cache_location",
+                        help="Cache directory (local mode, default <build_path>/.buildkit_cache) "
+                             "or repository (registry mode, default <user>/colmena-buildcache)")
+    parser.add_argument("--no_cache", action="store_true", help="Build images without any layer cache")
+    parser.add_argument("--verify_registry", action="store_true",
+                        help="Before skipping an unchanged image, check that the registry still has it")
+    parser.add_argument("--metrics_out",
+                        help="Write timing spans of every deployment phase and image to this file as JSON lines")
+    parser.add_argument("--split_platforms", action="store_true",
+                        help="Build each platform of multi-platform images separately and in parallel, "
+                             "then merge them into one manifest list")
+    parser.add_argument("--platform_builder", action="append", default=[], metavar="PLATFORM=BUILDER",
+                        help="Buildx builder for one platform with --split_platforms, e.g. linux/arm64=arm-node")
+    parser.add_argument("--builder",
+                        help="Buildx builder used for every build, created or started only when needed "
+                             "and reused by later deployments")
+    parser.add_argument("--builder_parallelism", type=int,
+                        help="Maximum number of build steps run at once by a builder created with --builder")
+    parser.add_argument("--builder_gc_keep_storage", type=int, metavar="MB",
+                        help="Build cache kept by a builder created with --builder when garbage collecting")
+    parser.add_argument("--builder_pool",
+                        help="JSON file listing builders to manage and the platforms routed to each of them")
+    parser.add_argument("--recreate_builders", action="store_true",
+                        help="Remove and create the managed builders again, to apply changed settings")
+    parser.add_argument("--watch", action="store_true",
+                        help="After deploying, keep rebuilding the images whose files change and republishing "
+                             "changed service descriptions until interrupted")
+    parser.add_argument("--watch_debounce", type=float, default=0.5,
+                        help="Seconds without new changes before rebuilding in watch mode")
+    parser.add_argument("--plan", action="store_true",
+                        help="Only print which images would be built, in which order, and which service "
+                             "definitions would be published")
+    parser.add_argument("--context_report", action="store_true",
+                        help="Only print the size of every build context and how much of it the Dockerfile uses")
+    parser.add_argument("--write_dockerignore", action="store_true",
+                        help="Write a .dockerignore sending only the COPY/ADD sources to the builder in every "
+                             "role and context folder without one, then print the context report")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Open the Zenoh session while building and publish each service as soon as "
+                             "its images are pushed")
+    parser.add_argument("--image_timeout", type=float,
+                        help="Seconds each image build may run before it is cancelled")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRY.retries,
+                        help="Times a build or push failing with a transient registry error (5xx, rate limit, "
+                             "dropped connection) is run again")
+    parser.add_argument("--retry_backoff", type=float, default=DEFAULT_RETRY.backoff, metavar="SECONDS",
+                        help="Wait before the first retry, doubled before each next one")
+    parser.add_argument("--bake", action="store_true",
+                        help="Build all images with a single docker buildx bake invocation")
+    parser.add_argument("--only_changed", action="store_true",
+                        help="Only publish service definitions that differ from the ones stored in the swarm")
+    parser.add_argument("--export", action="store_true",
+                        help="Build the images of every build folder into an OCI layout archive next to its "
+                             "service description instead of pushing them, for deployment.colmena_import")
+    parser.add_argument("--build_only", action="store_true",
+                        help="Build and push the images without publishing the service definitions")
+    parser.add_argument("--history", default=DEFAULT_HISTORY,
+                        help="SQLite file recording the published definitions, for deployment.colmena_rollback")
+    parser.add_argument("--no_history", action="store_true", help="Do not record the published definitions")
+    parser.add_argument("--wait_visible", type=float, metavar="SECONDS",
+                        help="After publishing, wait up to SECONDS for the swarm to answer queries with each "
+                             "new service definition, and fail if it does not")
+    parser.add_argument("--encoding", choices=ENCODINGS, default="json",
+                        help="Wire format of the published service definitions")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Number of images built in parallel (0 builds all images at once)")
+    parser.add_argument("--keep_going", action="store_true",
+                        help="Keep building the remaining images when one of them fails")
     args = parser.parse_args()
 
-    deploy_service(args, args.build_path, args.platform, args.user, args.skip_build)
+    build_paths = expand_build_paths(args.build_path, args.build_paths_file)
+    if not build_paths:
+        parser.error("one of --build_path or --build_paths_file is required")
+    if args.validate_only:
+        try:
+            load_services(build_paths, args.user or "", check_files=not args.skip_build)
+        except ServiceDefinitionError as error:
+            parser.exit(1, f"{error}\n")
+        parser.exit(0, f"{len(build_paths)} service description(s) are valid\n")
+    if not args.user:
+        parser.error("the following arguments are required: --user")
+    if args.plan:
+        plan = plan_deployment(args, build_paths, args.platform, args.user, args.skip_build,
+                               force_build=args.force_build, verify_registry=args.verify_registry)
+        print(plan.describe(args.local_debug, args.skip_build))
+        parser.exit(0)
+    if args.context_report or args.write_dockerignore:
+        services = load_services(build_paths, args.user)
+        images, _ = unique_images(build_paths, [service_images for _, service_images in services])
+        for each in images:
+            if args.write_dockerignore and write_dockerignore(each):
+                print(f"wrote {os.path.join(each.path, '.dockerignore')}")
+            print(analyze_context(each).describe())
+        parser.exit(0)
+    if args.pipeline and args.bake:
+        parser.error("--bake cannot be combined with --pipeline")
+    if args.watch and args.pipeline:
+        parser.error("--watch cannot be combined with --pipeline")
+    if args.export and (args.skip_build or args.local_debug or args.watch or args.pipeline or args.bake
+                        or args.split_platforms or args.platform_builder):
+        parser.error("--export cannot be combined with --skip_build, --local_debug, --watch, --pipeline, --bake, "
+                     "--split_platforms or --platform_builder")
+    if args.build_only and (args.skip_build or args.watch or args.pipeline):
+        parser.error("--build_only cannot be combined with --skip_build, --watch or --pipeline")
+    if args.split_platforms and (args.bake or args.pipeline):
+        parser.error("--split_platforms cannot be combined with --bake or --pipeline")
+    builders = {}
+    for each in args.platform_builder:
+        platform, separator, builder = each.partition("=")
+        if not separator or not platform or not builder:
+            parser.error(f"--platform_builder expects PLATFORM=BUILDER, got {each}")
+        builders[platform] = builder
+
+    cache_location = args.cache_location
+    if cache_location is None and args.cache_mode == "local":
+        cache_location = os.path.join(build_paths[0], ".buildkit_cache")
+    if cache_location is None and args.cache_mode == "registry":
+        cache_location = f"{args.user}/colmena-buildcache"
+    # only deployments publishing definitions create the history
+    history = None if args.no_history or args.export or args.build_only else DeploymentHistory(args.history)
+    options = DeployOptions(
+        jobs=args.jobs, keep_going=args.keep_going, force_build=args.force_build,
+        verify_registry=args.verify_registry,
+        cache=CacheConfig(mode=args.cache_mode, location=cache_location or "", no_cache=args.no_cache),
+        bake=args.bake, split_platforms=args.split_platforms, builders=builders, image_timeout=args.image_timeout,
+        retry=RetryPolicy(retries=max(0, args.retries), backoff=args.retry_backoff), build_only=args.build_only,
+        only_changed=args.only_changed, encoding=args.encoding, wait_timeout=args.wait_visible, history=history)
+
+    metrics = MetricsRecorder() if args.metrics_out else NO_METRICS
+    try:
+        if not args.skip_build and (args.builder or args.builder_pool):
+            specs = []
+            if args.builder:
+                specs.append(BuilderSpec(args.builder, parallelism=args.builder_parallelism,
+                                         gc_keep_storage_mb=args.builder_gc_keep_storage))
+            if args.builder_pool:
+                specs.extend(BuilderPool.load(args.builder_pool).specs)
+            pool = BuilderPool(specs, recreate=args.recreate_builders)
+            platforms = [each.strip() for each in args.platform.split(",")] if args.platform else []
+            with metrics.span("prepare_builders", builders=len(specs)):
+                routes = pool.ensure(platforms)
+            os.environ["BUILDX_BUILDER"] = pool.default.name
+            options.builders = {**routes, **options.builders}
+        if args.export:
+            from .export import export_images
+
+            build_paths = list(dict.fromkeys(build_paths))
+            # every image is exported, the build contexts are not hashed against the build manifests
+            with metrics.span("parse", services=len(build_paths)):
+                service_images = [images for _, images in load_services(build_paths, args.user)]
+                images, _ = unique_images(build_paths, service_images)
+                dependencies = image_dependencies(images)
+                # fails on circular dependencies before anything is built
+                topological_order(images, dependencies)
+            export_images(build_paths, service_images, args.platform, jobs=options.jobs,
+                          keep_going=options.keep_going, cache=options.cache, metrics=metrics,
+                          dependencies=dependencies, timeout=options.image_timeout, retry=options.retry,
+                          builder=options.builder)
+        elif args.pipeline:
+            import asyncio
+
+            from .async_deploy import deploy_services_async
+
+            asyncio.run(deploy_services_async(args, build_paths, args.platform, args.user, args.skip_build,
+                                              options, metrics))
+        else:
+            publisher = options.publisher()
+            try:
+                watcher = None
+                if args.watch:
+                    from .watch import ServiceWatcher
+
+                    # watch before deploying so that edits made meanwhile are not missed
+                    watcher = ServiceWatcher(args, build_paths, args.platform, args.user, publisher, options,
+                                             skip_build=args.skip_build, debounce=args.watch_debounce,
+                                             metrics=metrics)
+                deploy_services(args, build_paths, args.platform, args.user, args.skip_build, options, metrics,
+                                publisher=publisher)
+                if watcher is not None:
+                    watcher.watch()
+            finally:
+                publisher.close()
+    finally:
+        if args.metrics_out:
+            metrics.write(args.metrics_out)
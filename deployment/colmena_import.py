@@ -0,0 +1,119 @@
+#!/usr/bin/python
+#
+#  Copyright 2002-2025 Barcelona Supercomputing Center (www.bsc.es)
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+# -*- coding: utf-8 -*-
+
+"""Push exported images to a local registry and publish their services, at sites without internet access.
+
+The build folders are copied from a deployment made with
+``colmena_deploy --export``, which wrote the images of every service to
+colmena_images.oci.tar. Each image is pushed to the registry as
+<registry>/<user>/<image id>, and the published definitions point to it:
+
+    python3 -m deployment.colmena_import --build_path my_service --user myuser --registry localhost:5000
+
+Layers shared by several images are uploaded once and mounted for the
+others, and layers the registry already has are not uploaded at all.
+"""
+
+import os
+import tempfile
+from typing import List, Optional
+
+from .build_context import format_size
+from .colmena_deploy import expand_build_paths, load_service
+from .encoding import ENCODINGS
+from .export import EXPORT_FILE, OciLayout, RegistryClient, push_image
+from .history import DEFAULT_HISTORY, DeploymentHistory
+from .planner import normalize_reference
+from .publisher import ServicePublisher
+
+
+def import_services(build_paths: List[str], user: str, registry: str, insecure: bool = False,
+                    publisher: Optional[ServicePublisher] = None) -> List[Optional[str]]:
+    """Push the exported images of several build folders to a registry and publish their definitions.
+
+    Args:
+        build_paths: Build folders holding an exported archive
+        user: DockerHub username the images were exported with
+        registry: Registry host (and port) the images are pushed to
+        insecure: Talk to the registry over plain HTTP, always done for localhost
+        publisher: Publisher of the definitions, None only pushes the images
+
+    Returns:
+        The key every definition was published under, None for the
+        definitions left unpublished
+    """
+    build_paths = list(dict.fromkeys(build_paths))
+    client = RegistryClient(registry, insecure)
+    pushed = {}
+    digests = {}
+    services = []
+    for build_path in build_paths:
+        archive = os.path.join(build_path, EXPORT_FILE)
+        if not os.path.exists(archive):
+            raise FileNotFoundError(f"{archive} not found, export the service with colmena_deploy --export")
+        # the exported images are named after the DockerHub user, the published ones after the registry
+        _, exported = load_service(build_path, user, check_files=False)
+        service_definition, images = load_service(build_path, f"{registry}/{user}", check_files=False)
+        with tempfile.TemporaryDirectory(prefix="colmena-import-") as work:
+            layout = OciLayout.extract(archive, work)
+            for source, target in zip(exported, images):
+                repository, _, tag = normalize_reference(source.tag).rpartition(":")
+                uploaded = push_image(client, layout, source.tag, repository, tag, pushed)
+                digests[target.tag] = layout.image(source.tag)["digest"]
+                print(f"pushed {target.tag}, {format_size(uploaded)} uploaded")
+        services.append(service_definition)
+    if publisher is None:
+        return [None] * len(services)
+    return publisher.publish_many(services, digests)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Push the images exported with colmena_deploy --export to a "
+                                                 "local registry and publish the service definitions")
+    parser.add_argument("--build_path", nargs="+", default=[], help="Exported build folders or glob patterns")
+    parser.add_argument("--build_paths_file", help="File listing build folders to import, one per line")
+    parser.add_argument("--user", required=True, help="DockerHub username the images were exported with")
+    parser.add_argument("--registry", required=True, help="Registry the images are pushed to, e.g. localhost:5000")
+    parser.add_argument("--insecure_registry", action="store_true",
+                        help="Use plain HTTP for the registry (always used for localhost)")
+    parser.add_argument("--skip_publish", action="store_true", help="Only push the images")
+    parser.add_argument("--only_changed", action="store_true",
+                        help="Only publish service definitions that differ from the ones stored in the swarm")
+    parser.add_argument("--encoding", choices=ENCODINGS, default="json",
+                        help="Wire format of the published service definitions")
+    parser.add_argument("--history", default=DEFAULT_HISTORY,
+                        help="SQLite file recording the published definitions, for deployment.colmena_rollback")
+    parser.add_argument("--no_history", action="store_true", help="Do not record the published definitions")
+    parser.add_argument("--wait_visible", type=float, metavar="SECONDS",
+                        help="After publishing, wait up to SECONDS for the swarm to answer queries with each "
+                             "new service definition, and fail if it does not")
+    args = parser.parse_args()
+
+    build_paths = expand_build_paths(args.build_path, args.build_paths_file)
+    if not build_paths:
+        parser.error("one of --build_path or --build_paths_file is required")
+    if args.skip_publish:
+        import_services(build_paths, args.user, args.registry, args.insecure_registry)
+    else:
+        with ServicePublisher(only_changed=args.only_changed, encoding=args.encoding,
+                              wait_timeout=args.wait_visible,
+                              history=None if args.no_history else DeploymentHistory(args.history)) as publisher:
+            import_services(build_paths, args.user, args.registry, args.insecure_registry, publisher)
@@ -0,0 +1,119 @@
+#!/usr/bin/python
+#
+#  Copyright 2002-2025 Barcelona Supercomputing Center (www.bsc.es)
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+# -*- coding: utf-8 -*-
+
+"""Publish a previous revision of a service definition again, without rebuilding anything.
+
+Revisions are recorded by colmena_deploy and colmena_import in their
+--history file each time they publish a definition:
+
+    python3 -m deployment.colmena_rollback --service my-service --list
+    python3 -m deployment.colmena_rollback --service my-service --to 3
+
+Without --to, the revision before the latest one is restored. The images
+of the restored definition are pinned to the digests they had when it
+was published, and the rollback is recorded as a new revision.
+"""
+
+from typing import Optional
+
+from .encoding import ENCODINGS
+from .history import DEFAULT_HISTORY, DeploymentHistory, Revision, image_entries
+from .publisher import ServicePublisher
+
+
+def rollback(history: DeploymentHistory, service: str, revision: int = -1,
+             publisher: Optional[ServicePublisher] = None, pin: bool = True) -> Revision:
+    """Publish a stored revision of a service definition again.
+
+    Args:
+        history: History the revision is read from and the rollback recorded in
+        service: Id of the service
+        revision: Revision to restore, negative numbers count back from the
+            latest one (-1 is the one before it)
+        publisher: Publisher to use, by default a new one is opened and closed
+        pin: Publish the images by the digest recorded with the revision
+
+    Returns:
+        The restored revision
+
+    Raises:
+        LookupError: The history has no such revision
+    """
+    restored = history.get(service, revision)
+    if restored is None:
+        raise LookupError(f"{service} has no revision {revision} in {history.path}")
+    definition = restored.pinned() if pin else restored.definition
+    missing = [entry["imageId"] for entry in image_entries(restored.definition)
+               if entry["imageId"] not in restored.digests]
+    if pin and missing:
+        print(f"warning: no digest recorded for {', '.join(missing)}, the tag is published as is")
+    owned = publisher is None
+    if owned:
+        publisher = ServicePublisher()
+    try:
+        publisher.publish(definition)
+    finally:
+        if owned:
+            publisher.close()
+    recorded = history.record(restored.definition, restored.digests, note=f"rollback to revision {restored.revision}")
+    print(f"restored revision {restored.revision} of {service} as revision {recorded}")
+    return restored
+
+
+def format_revisions(history: DeploymentHistory, service: str, limit: Optional[int] = None) -> str:
+    lines = []
+    for each in history.revisions(service, limit):
+        images = ", ".join(f"{tag}@{digest[:19]}" for tag, digest in sorted(each.digests.items())) or "no digests"
+        note = f" ({each.note})" if each.note else ""
+        lines.append(f"{each.revision:>5}  {each.published_at}  {images}{note}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Publish a previous revision of a service definition again")
+    parser.add_argument("--service", help="Id of the service, all services are listed when omitted with --list")
+    parser.add_argument("--to", type=int, default=-1, metavar="REVISION",
+                        help="Revision to restore, negative numbers count back from the latest one "
+                             "(default: -1, the revision before the latest)")
+    parser.add_argument("--list", action="store_true", help="Only list the recorded revisions")
+    parser.add_argument("--limit", type=int, help="Number of revisions listed, newest first")
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="SQLite file the revisions are recorded in")
+    parser.add_argument("--no_pin", action="store_true",
+                        help="Publish the image tags instead of the digests recorded with the revision")
+    parser.add_argument("--encoding", choices=ENCODINGS, default="json",
+                        help="Wire format of the published service definition")
+    parser.add_argument("--wait_visible", type=float, metavar="SECONDS",
+                        help="After publishing, wait up to SECONDS for the swarm to answer queries with the "
+                             "restored service definition, and fail if it does not")
+    args = parser.parse_args()
+
+    history = DeploymentHistory(args.history)
+    if args.list:
+        for service in [args.service] if args.service else history.services():
+            print(f"{service}:\n{format_revisions(history, service, args.limit)}")
+        parser.exit(0)
+    if not args.service:
+        parser.error("the following arguments are required: --service")
+    with ServicePublisher(encoding=args.encoding, wait_timeout=args.wait_visible) as publisher:
+        try:
+            rollback(history, args.service, args.to, publisher, pin=not args.no_pin)
+        except LookupError as error:
+            parser.exit(1, f"{error}\n")
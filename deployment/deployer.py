@@ -0,0 +1,243 @@
+#!/usr/bin/python
+#
+#  Copyright 2002-2025 Barcelona Supercomputing Center (www.bsc.es)
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+# -*- coding: utf-8 -*-
+
+"""In-process deployment API for applications deploying many times, like a deploy controller.
+
+A Deployer keeps its Zenoh session and prepared builders between calls and
+returns result objects instead of only printing:
+
+    with Deployer("linux/amd64", "user", options=DeployOptions(jobs=4)) as deployer:
+        result = deployer.deploy(["services/app"])
+        for each in result.images:
+            print(each.image.tag, each.cached, each.digest, each.duration)
+
+Build output is still streamed to stdout, prefixed by the image id.
+"""
+
+import argparse
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, List, Optional
+
+from .build_image import BuildResult, Image
+from .builders import BuilderPool
+from .metrics import NO_METRICS, MetricsRecorder
+from .options import DeployOptions
+from .planner import DeploymentPlan
+from .publisher import ServicePublisher
+
+
+@dataclass
+class ImageResult:
+    """What a deployment did with one image.
+
+    Attributes:
+        image: The image
+        cached: The image was not built, because its build context is unchanged
+            since it was last pushed or because builds were skipped
+        digest: Manifest digest of the pushed image, when known
+        duration: Seconds spent building the image, None when cached or built
+            together with other images
+    """
+    image: Image
+    cached: bool
+    digest: Optional[str] = None
+    duration: Optional[float] = None
+
+
+@dataclass
+class PublishResult:
+    """Outcome of publishing one service definition.
+
+    Attributes:
+        service: Id of the service
+        key: Key expression the definition was published under, None when
+            only_changed is set and the swarm already had it
+        visible_after: Seconds until the swarm answered with the definition,
+            when waiting for it
+    """
+    service: str
+    key: Optional[str]
+    visible_after: Optional[float] = None
+
+    @property
+    def published(self) -> bool:
+        return self.key is not None
+
+
+@dataclass
+class DeployResult:
+    """Outcome of a deployment.
+
+    Attributes:
+        images: Every image of the deployment, each one after the images it builds from
+        services: Every published service definition, in the order of the build folders
+        duration: Seconds the whole deployment took
+    """
+    images: List[ImageResult] = field(default_factory=list)
+    services: List[PublishResult] = field(default_factory=list)
+    duration: float = 0.0
+
+    @property
+    def built(self) -> List[ImageResult]:
+        return [each for each in self.images if not each.cached]
+
+
+class Deployer:
+    """Builds and publishes COLMENA services, reusing its state across deployments.
+
+    The Zenoh session is opened on first publish and the builders of
+    builder_pool are prepared on first build; both are kept until close().
+    Calls are serialized, so the same Deployer can be shared by threads.
+    """
+
+    def __init__(self, platform: str, user: str, local_debug: bool = False,
+                 options: Optional[DeployOptions] = None, builder_pool: Optional[BuilderPool] = None,
+                 publisher: Optional[ServicePublisher] = None, metrics: MetricsRecorder = NO_METRICS):
+        """
+        Args:
+            platform: Docker buildx platform specification (e.g., "linux/amd64,linux/arm64")
+            user: DockerHub username the images are tagged with
+            local_debug: Load the images into the local store instead of pushing them
+            options: How the images are built and the definitions published, see
+                DeployOptions; force_build applies to every call and build_only is
+                ignored, use build() instead
+            builder_pool: Builders to create or repair before the first build, the
+                default one is used for every build and the others take the
+                platforms they are declared for
+            publisher: Publisher to use instead of one created from the options, it
+                is closed with the Deployer
+            metrics: Records timing spans of every deployment
+        """
+        self.platform = platform
+        self.user = user
+        self.local_debug = local_debug
+        # copied, the routes of builder_pool are added to its builders
+        self.options = replace(options or DeployOptions())
+        self.builder_pool = builder_pool
+        self.metrics = metrics
+        self.publisher = publisher or self.options.publisher()
+        # deploy_services and plan_deployment only read local_debug from the command line arguments
+        self._args = argparse.Namespace(local_debug=local_debug)
+        self._builders_ready = builder_pool is None
+        self._lock = threading.RLock()
+
+    def __enter__(self) -> "Deployer":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.publisher.close()
+
+    def plan(self, build_paths: List[str], force_build: bool = False, skip_build: bool = False) -> DeploymentPlan:
+        """Decide what deploying the build folders would build, see plan_deployment."""
+        # imported here, deployment/__init__.py must not import the command line module
+        from .colmena_deploy import plan_deployment
+
+        return plan_deployment(self._args, build_paths, self.platform, self.user, skip_build,
+                               force_build=force_build or self.options.force_build,
+                               verify_registry=self.options.verify_registry, metrics=self.metrics)
+
+    def build(self, build_paths: List[str], force_build: bool = False) -> List[ImageResult]:
+        """Build and push the images of the build folders whose context changed.
+
+        Raises:
+            BuildError: Some images failed to build, with keep_going
+        """
+        with self._lock:
+            return self._build(self.plan(build_paths, force_build))
+
+    def publish(self, build_paths: List[str]) -> List[PublishResult]:
+        """Publish the service definitions of the build folders, without building anything."""
+        from .colmena_deploy import load_services
+
+        with self._lock:
+            services = load_services(list(dict.fromkeys(build_paths)), self.user, check_files=False)
+            return self._publish([definition for definition, _ in services])
+
+    def deploy(self, build_paths: List[str], force_build: bool = False, skip_build: bool = False) -> DeployResult:
+        """Build the images of the build folders, then publish their service definitions.
+
+        Nothing is published when an image fails to build.
+        """
+        with self._lock:
+            started = time.perf_counter()
+            with self.metrics.span("deploy", services=len(build_paths)):
+                plan = self.plan(build_paths, force_build, skip_build)
+                images = [ImageResult(each, cached=True) for each in plan.images] if skip_build else \
+                    self._build(plan)
+                services = self._publish([definition for definition, _ in plan.services],
+                                         {each.image.tag: each.digest for each in images if each.digest})
+            return DeployResult(images, services, time.perf_counter() - started)
+
+    def _prepare_builders(self):
+        if self._builders_ready:
+            return
+        platforms = [each.strip() for each in self.platform.split(",")] if self.platform else []
+        with self.metrics.span("prepare_builders", builders=len(self.builder_pool.specs)):
+            routes = self.builder_pool.ensure(platforms)
+        # passed to every build, the environment of the host application is left alone
+        self.options.builder = self.options.builder or self.builder_pool.default.name
+        self.options.builders = {**routes, **self.options.builders}
+        self._builders_ready = True
+
+    def _build(self, plan: DeploymentPlan) -> List[ImageResult]:
+        built: Dict[str, BuildResult] = {}
+
+        def on_built(result: BuildResult):
+            built[result.image.tag] = result
+            if plan.manifests:
+                plan.manifests[plan.owners[result.image.tag]].record(result.image, result.digest)
+
+        if plan.build:
+            self._prepare_builders()
+        with self.metrics.span("build", images=len(plan.build)):
+            try:
+                self.options.build_images(plan.build, self.platform, self.local_debug, on_built=on_built,
+                                          metrics=self.metrics, dependencies=plan.dependencies)
+            finally:
+                for manifest in plan.manifests.values():
+                    manifest.flush()
+
+        results = []
+        for each in plan.images:
+            if each.tag in built:
+                result = built[each.tag]
+                results.append(ImageResult(each, cached=False, digest=result.digest, duration=result.duration))
+            else:
+                manifest = plan.manifests.get(plan.owners[each.tag])
+                results.append(ImageResult(each, cached=True,
+                                           digest=manifest.image_digest(each) if manifest else None))
+        return results
+
+    def _publish(self, service_definitions: List[Dict[str, Any]],
+                 digests: Optional[Dict[str, str]] = None) -> List[PublishResult]:
+        with self.metrics.span("zenoh_open"):
+            self.publisher.open()
+        results = []
+        with self.metrics.span("publish", services=len(service_definitions)) as span:
+            for definition in service_definitions:
+                key = self.publisher.publish(definition, digests)
+                results.append(PublishResult(definition["id"]["value"], key,
+                                             self.publisher.visible_after.get(key) if key else None))
+            span["published"] = sum(each.published for each in results)
+        return results
@@ -0,0 +1,127 @@
+#!/usr/bin/python
+#
+#  Copyright 2002-2025 Barcelona Supercomputing Center (www.bsc.es)
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+# -*- coding: utf-8 -*-
+
+import os
+import posixpath
+import re
+from typing import Iterator, List, Tuple
+
+
+def _translate(pattern: str) -> str:
+    """Translate a .dockerignore pattern into a regular expression.
+
+    Follows the Go filepath.Match rules used by Docker, plus the ``**``
+    wildcard that matches any number of directories.
+    """
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "*":
+            if pattern[i:i + 2] == "**":
+                i += 2
+                if pattern[i:i + 1] == "/":
+                    # "**/" also matches zero directories
+                    i += 1
+                    regex += "(?:.*/)?"
+                else:
+                    regex += ".*"
+                continue
+            regex += "[^/]*"
+        elif char == "?":
+            regex += "[^/]"
+        elif char == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                regex += re.escape(char)
+            else:
+                group = pattern[i + 1:end]
+                if group.startswith(("!", "^")):
+                    group = "^" + group[1:]
+                regex += f"[{group}]"
+                i = end
+        elif char == "\\" and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(char)
+        i += 1
+    return regex
+
+
+class DockerIgnore:
+    """Rules of a build context's .dockerignore file."""
+
+    def __init__(self, patterns: List[str]):
+        self.rules: List[Tuple[bool, "re.Pattern[str]"]] = []
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            negate = pattern.startswith("!")
+            if negate:
+                pattern = pattern[1:].strip()
+            pattern = posixpath.normpath(pattern.lstrip("/"))
+            self.rules.append((negate, re.compile(_translate(pattern) + r"\Z")))
+
+    @classmethod
+    def from_context(cls, context_path: str) -> "DockerIgnore":
+        """Read the .dockerignore file of a build context, if there is one."""
+        try:
+            with open(os.path.join(context_path, ".dockerignore")) as f:
+                return cls(f.read().splitlines())
+        except FileNotFoundError:
+            return cls([])
+
+    @property
+    def has_exceptions(self) -> bool:
+        return any(negate for negate, _ in self.rules)
+
+    def is_excluded(self, relative_path: str) -> bool:
+        """Whether a path relative to the context root is left out of the context.
+
+        As in Docker, a pattern matches a path or any of its parent
+        directories, and the last matching pattern wins.
+        """
+        parts = relative_path.split("/")
+        candidates = ["/".join(parts[:i]) for i in range(1, len(parts) + 1)]
+        excluded = False
+        for negate, regex in self.rules:
+            if any(regex.match(candidate) for candidate in candidates):
+                excluded = not negate
+        return excluded
+
+    def walk(self, context_path: str) -> Iterator[str]:
+        """Yield the relative paths of the files sent with the build context, in a stable order."""
+        for root, dirs, files in os.walk(context_path):
+            relative_root = os.path.relpath(root, context_path).replace(os.sep, "/")
+            prefix = "" if relative_root == "." else relative_root + "/"
+            dirs.sort()
+            if not self.has_exceptions:
+                # nothing below an excluded directory can be re-included
+                dirs[:] = [d for d in dirs if not self.is_excluded(prefix + d)]
+            # symlinked directories are not followed, they are sent as links
+            links = [d for d in dirs if os.path.islink(os.path.join(root, d))]
+            for name in sorted(files + links):
+                relative_path = prefix + name
+                if name in ("Dockerfile", ".dockerignore") and not prefix:
+                    # always sent to the builder, even when ignored
+                    yield relative_path
+                elif not self.is_excluded(relative_path):
+                    yield relative_path
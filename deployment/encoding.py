@@ -0,0 +1,118 @@
+#!/usr/bin/python
+#
+#  Copyright 2002-2025 Barcelona Supercomputing Center (www.bsc.es)
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+# -*- coding: utf-8 -*-
+
+"""Wire formats for published service definitions.
+
+"json" is the historical format, the default ``json.dumps`` output sent
+without a Zenoh encoding, which every COLMENA agent understands. The other
+formats are opt-in and set the Zenoh encoding so consumers can tell them
+apart. zstd, CBOR and MessagePack need the optional ``zstandard``, ``cbor2``
+and ``msgpack`` packages (``pip install .[encodings]``).
+"""
+
+import gzip
+import importlib
+import json
+from typing import Any, Dict, Optional, Tuple
+
+ENCODINGS = ("json", "compact", "gzip", "zstd", "cbor", "msgpack")
+
+# Zenoh encoding set on the put for each format, None keeps the payload untagged
+ZENOH_ENCODINGS: Dict[str, Optional[str]] = {
+    "json": None,
+    "compact": "application/json",
+    "gzip": "application/json;gzip",
+    "zstd": "application/json;zstd",
+    "cbor": "application/cbor",
+    "msgpack": "application/octet-stream;msgpack",
+}
+
+_OPTIONAL_MODULES = {"zstd": "zstandard", "cbor": "cbor2", "msgpack": "msgpack"}
+
+
+def _optional_module(encoding: str):
+    module = _OPTIONAL_MODULES[encoding]
+    try:
+        return importlib.import_module(module)
+    except ImportError:
+        raise ImportError(f"the {encoding} encoding needs the {module} package, "
+                          f"install it with: pip install {module}") from None
+
+
+def available_encodings() -> Tuple[str, ...]:
+    """Return the encodings whose optional dependencies are installed."""
+    available = []
+    for encoding in ENCODINGS:
+        try:
+            if encoding in _OPTIONAL_MODULES:
+                _optional_module(encoding)
+        except ImportError:
+            continue
+        available.append(encoding)
+    return tuple(available)
+
+
+def encode_definition(service_definition: Dict[str, Any], encoding: str = "json") -> Tuple[Any, Optional[str]]:
+    """Serialize a service definition for publishing.
+
+    Returns:
+        The payload and the Zenoh encoding to publish it with (None for "json")
+    """
+    if encoding not in ZENOH_ENCODINGS:
+        raise ValueError(f"unknown encoding {encoding}, expected one of {', '.join(ENCODINGS)}")
+    if encoding == "json":
+        return json.dumps(service_definition), None
+
+    compact = json.dumps(service_definition, separators=(",", ":"), ensure_ascii=False).encode()
+    if encoding == "compact":
+        payload = compact
+    elif encoding == "gzip":
+        # mtime=0 keeps the payload reproducible
+        payload = gzip.compress(compact, mtime=0)
+    elif encoding == "zstd":
+        payload = _optional_module("zstd").ZstdCompressor(level=10).compress(compact)
+    elif encoding == "cbor":
+        payload = _optional_module("cbor").dumps(service_definition)
+    else:
+        payload = _optional_module("msgpack").packb(service_definition)
+    return payload, ZENOH_ENCODINGS[encoding]
+
+
+def decode_definition(payload: bytes, zenoh_encoding: Optional[str] = None) -> Dict[str, Any]:
+    """Read back a service definition published in any of the supported formats.
+
+    Args:
+        payload: Raw bytes of the Zenoh sample
+        zenoh_encoding: Encoding of the sample, as a string
+    """
+    for encoding, expected in ZENOH_ENCODINGS.items():
+        if expected is not None and zenoh_encoding == expected:
+            break
+    else:
+        encoding = "json"
+
+    if encoding == "gzip":
+        payload = gzip.decompress(payload)
+    elif encoding == "zstd":
+        payload = _optional_module("zstd").ZstdDecompressor().decompress(payload)
+    elif encoding == "cbor":
+        return _optional_module("cbor").loads(payload)
+    elif encoding == "msgpack":
+        return _optional_module("msgpack").unpackb(payload)
+    return json.loads(payload)
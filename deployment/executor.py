@@ -0,0 +1,218 @@
+#!/usr/bin/python
+#
+#  Copyright 2002-2025 Barcelona Supercomputing Center (www.bsc.es)
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+# -*- coding: utf-8 -*-
+
+"""Execution of the docker commands a deployment runs.
+
+Commands are argument lists run without a shell, so tags and paths are
+never interpreted by one. Their output is printed line by line with a
+prefix as it arrives instead of being buffered, a timeout terminates
+commands that hang, and failures that look like a flaky registry (5xx
+answers, rate limits, dropped connections) are retried with exponential
+backoff instead of failing the deployment.
+"""
+
+import random
+import re
+import subprocess
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Iterator, List, Optional
+
+# seconds a terminated command gets to exit before it is killed
+TERMINATE_GRACE = 10.0
+# last output lines of a failed command searched for transient errors
+TAIL_LINES = 50
+# output of a failure worth retrying: registry 5xx answers, rate limits and network errors
+TRANSIENT_ERRORS = re.compile(
+    r"\b(500 Internal Server Error|502 Bad Gateway|503 Service Unavailable|504 Gateway Timeout"
+    r"|429 Too Many Requests|toomanyrequests|TLS handshake timeout|i/o timeout|connection reset by peer"
+    r"|connection refused|unexpected EOF|net/http: request canceled|no such host)",
+    re.IGNORECASE)
+
+
+@dataclass
+class RetryPolicy:
+    """How a command failing with a transient error is run again.
+
+    Attributes:
+        retries: Attempts after the first one, 0 never retries
+        backoff: Seconds waited before the first retry, doubled before each next one
+        max_backoff: Longest wait between two attempts
+    """
+    retries: int = 2
+    backoff: float = 5.0
+    max_backoff: float = 60.0
+
+    def delay(self, attempt: int) -> float:
+        """Return the seconds to wait before the given retry (starting at 1).
+
+        Up to 10% of jitter keeps images failing together from retrying
+        against the registry at the same time.
+        """
+        return min(self.max_backoff, self.backoff * 2 ** (attempt - 1)) * random.uniform(0.9, 1.1)
+
+
+# policy used unless another one is given: two retries, after about 5 and 10 seconds
+DEFAULT_RETRY = RetryPolicy()
+NO_RETRY = RetryPolicy(retries=0)
+
+_print_lock = threading.Lock()
+
+
+def log_line(prefix: str, message: str):
+    """Print a line of a command's output, or about it, with a prefix telling which command it is from."""
+    # one lock for every build thread so prefixed lines never interleave
+    with _print_lock:
+        print(f"[{prefix}] {message}", flush=True)
+
+
+def is_transient(error: Exception) -> bool:
+    """Tell whether a failed command is worth running again.
+
+    Only failed commands whose output (see run_command) mentions a registry
+    or network error qualify; timeouts and build errors do not.
+    """
+    if not isinstance(error, subprocess.CalledProcessError):
+        return False
+    return TRANSIENT_ERRORS.search(error.output or "") is not None
+
+
+def backoff_attempts(retry: RetryPolicy) -> Iterator[int]:
+    """Number the attempts of a command, from 1 to the last one retry allows.
+
+    Each attempt after a failure should first wait retry_delay() seconds
+    and stop when it returns None:
+
+        for attempt in backoff_attempts(retry):
+            try:
+                return run(command)
+            except subprocess.CalledProcessError as error:
+                delay = retry_delay(retry, attempt, error, prefix)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+    """
+    return iter(range(1, retry.retries + 2))
+
+
+def retry_delay(retry: RetryPolicy, attempt: int, error: Exception, prefix: str) -> Optional[float]:
+    """Return the seconds to wait before running a command again after the given attempt failed.
+
+    Returns:
+        The backoff delay, announced with the command's prefix, or None when
+        the error is not transient or it was the last attempt
+    """
+    if attempt > retry.retries or not is_transient(error):
+        return None
+    delay = retry.delay(attempt)
+    log_line(prefix, f"transient failure (exit code {getattr(error, 'returncode', None)}), "
+                     f"retry {attempt}/{retry.retries} in {delay:.1f}s")
+    return delay
+
+
+def run_command(command: List[str], prefix: str, timeout: Optional[float] = None,
+                register: Optional[Callable[[Optional[subprocess.Popen]], None]] = None):
+    """Run a command without a shell, printing its output line by line with a prefix.
+
+    Args:
+        command: Program and arguments to run
+        prefix: Shown in front of every output line
+        timeout: Seconds the command may run, None waits forever
+        register: Called with the process once started, and with None once it finished
+
+    Raises:
+        subprocess.CalledProcessError: The command exited with a non-zero code,
+            its output holds the last TAIL_LINES lines printed
+        TimeoutError: The command did not finish in time and was terminated
+    """
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               universal_newlines=True)
+    if register is not None:
+        register(process)
+    expired = threading.Event()
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, _expire, (process, expired))
+        timer.daemon = True
+        timer.start()
+    tail = deque(maxlen=TAIL_LINES)
+    try:
+        for line in process.stdout:
+            line = line.rstrip()
+            log_line(prefix, line)
+            tail.append(line)
+        returncode = process.wait()
+    finally:
+        if timer is not None:
+            timer.cancel()
+        if register is not None:
+            register(None)
+    if not returncode:
+        # succeeded, even if the timeout expired while it was exiting
+        return
+    if expired.is_set():
+        raise TimeoutError(f"{' '.join(command)} did not finish within {timeout} seconds")
+    raise subprocess.CalledProcessError(returncode, command, output="\n".join(tail))
+
+
+def _expire(process: subprocess.Popen, expired: threading.Event):
+    if process.poll() is not None:
+        # exited right before the timeout
+        return
+    expired.set()
+    process.terminate()
+    try:
+        process.wait(TERMINATE_GRACE)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def run_with_retries(command: List[str], prefix: str, timeout: Optional[float] = None,
+                     retry: RetryPolicy = NO_RETRY,
+                     register: Optional[Callable[[Optional[subprocess.Popen]], None]] = None,
+                     stopped: Optional[threading.Event] = None):
+    """Run a command with run_command, running it again after transient failures.
+
+    Each attempt gets the full timeout. The wait between two attempts
+    grows exponentially (see RetryPolicy); the last error is raised once
+    the retries are exhausted.
+
+    Args:
+        command: Program and arguments to run
+        prefix: Shown in front of every output line
+        timeout: Seconds each attempt may run, None waits forever
+        retry: How often and after how long transient failures are retried
+        register: Called with each attempt's process once started, and with None once it finished
+        stopped: Set to give up, the current failure is raised instead of retrying
+    """
+    for attempt in backoff_attempts(retry):
+        try:
+            run_command(command, prefix, timeout, register)
+            return
+        except subprocess.CalledProcessError as error:
+            delay = retry_delay(retry, attempt, error, prefix)
+            if delay is None or (stopped is not None and stopped.is_set()):
+                raise
+            if stopped is not None:
+                if stopped.wait(delay):
+                    raise
+            else:
+                time.sleep(delay)
@@ -0,0 +1,360 @@
+#!/usr/bin/python
+#
+#  Copyright 2002-2025 Barcelona Supercomputing Center (www.bsc.es)
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+# -*- coding: utf-8 -*-
+
+"""Offline deployment artifacts, for edge sites that cannot reach the registry.
+
+The images of every build folder are exported, instead of pushed, to one
+OCI image layout archive written next to its service description. All
+the images of the archive share its blobs, so layers common to several
+roles are stored once. At the edge, the archives are pushed to a local
+registry and the definitions published with ``deployment.colmena_import``.
+"""
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import IO, Any, Dict, List, Optional
+
+from .build_context import format_size
+from .build_image import BuildResult, CacheConfig, Image, build_container_images
+from .executor import DEFAULT_RETRY, RetryPolicy
+from .metrics import NO_METRICS, MetricsRecorder
+from .planner import parent_references
+
+EXPORT_FILE = "colmena_images.oci.tar"
+# annotation of the layout's index holding the tag every image was built with
+IMAGE_NAME_ANNOTATION = "io.containerd.image.name"
+REF_NAME_ANNOTATION = "org.opencontainers.image.ref.name"
+INDEX_MEDIA_TYPES = ("application/vnd.oci.image.index.v1+json",
+                     "application/vnd.docker.distribution.manifest.list.v2+json")
+MANIFEST_MEDIA_TYPES = ("application/vnd.oci.image.manifest.v1+json",
+                        "application/vnd.docker.distribution.manifest.v2+json")
+# seconds a registry request may take
+REGISTRY_TIMEOUT = 300
+
+
+def docker_export_command(image: Image, platform: str, dest: str, cache: Optional[CacheConfig] = None,
+                          metadata_file: Optional[str] = None,
+                          contexts: Optional[Dict[str, str]] = None, builder: Optional[str] = None) -> List[str]:
+    """Build an image into an OCI layout archive instead of pushing it.
+
+    Args:
+        contexts: Named build contexts, mapping an image the Dockerfile builds
+            from, spelled as the Dockerfile writes it, to the location it is
+            read from instead of the registry
+        builder: Buildx builder to build with, None uses the current one
+    """
+    args = ["docker", "buildx", "build"]
+    if builder:
+        args.extend(["--builder", builder])
+    args.extend(["-f", f"{image.path}/Dockerfile"])
+    if cache is not None:
+        args.extend(cache.cache_args(image))
+    if metadata_file is not None:
+        args.extend(["--metadata-file", metadata_file])
+    for name, location in sorted((contexts or {}).items()):
+        args.extend(["--build-context", f"{name}={location}"])
+    args.extend(["--platform", platform, "--output", f"type=oci,dest={dest},name={image.tag}", image.path])
+    return args
+
+
+class OciLayout:
+    """An OCI image layout directory holding several named images that share their blobs."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.manifests: List[Dict[str, Any]] = []
+        # bytes of the blobs not stored again because another image already had them
+        self.shared_size = 0
+        os.makedirs(os.path.join(path, "blobs", "sha256"), exist_ok=True)
+        index_path = os.path.join(path, "index.json")
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                self.manifests = json.load(f).get("manifests", [])
+        else:
+            with open(os.path.join(path, "oci-layout"), "w") as f:
+                json.dump({"imageLayoutVersion": "1.0.0"}, f)
+            self.save()
+
+    @classmethod
+    def extract(cls, archive: str, path: str) -> "OciLayout":
+        """Unpack an OCI layout archive into a directory."""
+        with tarfile.open(archive) as tar:
+            for member in tar.getmembers():
+                name = os.path.normpath(member.name)
+                if not member.isfile() or name.startswith("..") or os.path.isabs(name):
+                    continue
+                source = tar.extractfile(member)
+                os.makedirs(os.path.dirname(os.path.join(path, name)), exist_ok=True)
+                with open(os.path.join(path, name), "wb") as f:
+                    shutil.copyfileobj(source, f)
+        return cls(path)
+
+    def blob_path(self, digest: str) -> str:
+        algorithm, _, value = digest.partition(":")
+        return os.path.join(self.path, "blobs", algorithm, value)
+
+    def read_json(self, digest: str) -> Dict[str, Any]:
+        with open(self.blob_path(digest)) as f:
+            return json.load(f)
+
+    def image(self, name: str) -> Optional[Dict[str, Any]]:
+        """Return the descriptor of the image built with the given tag."""
+        for each in self.manifests:
+            if each.get("annotations", {}).get(IMAGE_NAME_ANNOTATION) == name:
+                return each
+        return None
+
+    def add_archive(self, archive: str, name: str) -> Dict[str, Any]:
+        """Add the image of an OCI layout archive written by buildx, storing only the blobs missing.
+
+        Returns:
+            The descriptor of the image in the layout index
+        """
+        with tarfile.open(archive) as tar:
+            index = None
+            for member in tar.getmembers():
+                parts = os.path.normpath(member.name).split(os.sep)
+                if os.path.normpath(member.name) == "index.json":
+                    index = json.load(tar.extractfile(member))
+                elif member.isfile() and len(parts) == 3 and parts[0] == "blobs":
+                    target = os.path.join(self.path, "blobs", parts[1], parts[2])
+                    if os.path.exists(target):
+                        self.shared_size += member.size
+                        continue
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    with open(f"{target}.tmp", "wb") as f:
+                        shutil.copyfileobj(tar.extractfile(member), f)
+                    os.replace(f"{target}.tmp", target)
+        if index is None or not index.get("manifests"):
+            raise ValueError(f"{archive} is not an OCI layout archive")
+        descriptor = dict(index["manifests"][0])
+        annotations = dict(descriptor.get("annotations", {}))
+        annotations[IMAGE_NAME_ANNOTATION] = name
+        annotations[REF_NAME_ANNOTATION] = name.rpartition(":")[2] if ":" in name.rsplit("/", 1)[-1] else "latest"
+        descriptor["annotations"] = annotations
+        self.manifests = [each for each in self.manifests
+                          if each.get("annotations", {}).get(IMAGE_NAME_ANNOTATION) != name] + [descriptor]
+        self.save()
+        return descriptor
+
+    def blobs(self, descriptor: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Return the descriptors of every blob an image needs, children before the manifests using them."""
+        blobs = []
+        if descriptor.get("mediaType") in INDEX_MEDIA_TYPES:
+            for child in self.read_json(descriptor["digest"]).get("manifests", []):
+                if os.path.exists(self.blob_path(child["digest"])):
+                    # attestation manifests may only be referenced
+                    blobs.extend(self.blobs(child))
+        elif descriptor.get("mediaType") in MANIFEST_MEDIA_TYPES:
+            manifest = self.read_json(descriptor["digest"])
+            blobs.extend([manifest["config"]] + manifest.get("layers", []))
+        blobs.append(descriptor)
+        return blobs
+
+    def save(self):
+        tmp_path = os.path.join(self.path, "index.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"schemaVersion": 2, "mediaType": INDEX_MEDIA_TYPES[0], "manifests": self.manifests}, f,
+                      indent=2, sort_keys=True)
+        os.replace(tmp_path, os.path.join(self.path, "index.json"))
+
+    def write_archive(self, dest: str, names: List[str]):
+        """Write the named images, and the blobs they need once, to a reproducible archive."""
+        descriptors = [self.image(name) for name in names]
+        digests = sorted({blob["digest"] for each in descriptors if each for blob in self.blobs(each)})
+        index = {"schemaVersion": 2, "mediaType": INDEX_MEDIA_TYPES[0],
+                 "manifests": [each for each in descriptors if each]}
+        tmp_path = f"{dest}.tmp"
+        with tarfile.open(tmp_path, "w", format=tarfile.PAX_FORMAT) as tar:
+            _add_bytes(tar, "oci-layout", json.dumps({"imageLayoutVersion": "1.0.0"}).encode())
+            _add_bytes(tar, "index.json", json.dumps(index, indent=2, sort_keys=True).encode())
+            for digest in digests:
+                algorithm, _, value = digest.partition(":")
+                with open(self.blob_path(digest), "rb") as f:
+                    _add_file(tar, f"blobs/{algorithm}/{value}", f, os.fstat(f.fileno()).st_size)
+        os.replace(tmp_path, dest)
+
+
+def _add_bytes(tar: tarfile.TarFile, name: str, content: bytes):
+    _add_file(tar, name, io.BytesIO(content), len(content))
+
+
+def _add_file(tar: tarfile.TarFile, name: str, content: IO[bytes], size: int):
+    # fixed metadata, so that exporting the same images gives the same archive
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mode = 0o644
+    info.mtime = 0
+    tar.addfile(info, content)
+
+
+def export_images(build_paths: List[str], service_images: List[List[Image]], platform: str,
+                  jobs: int = 1, keep_going: bool = False, cache: Optional[CacheConfig] = None,
+                  metrics: MetricsRecorder = NO_METRICS,
+                  dependencies: Optional[Dict[str, List[str]]] = None, timeout: Optional[float] = None,
+                  retry: RetryPolicy = DEFAULT_RETRY, builder: Optional[str] = None) -> Dict[str, str]:
+    """Build the images of every build folder into an OCI layout archive next to its service description.
+
+    Images are built once even if several services use them, and each
+    archive holds every image of its service. Images building from another
+    exported image (see deployment.planner) read it from the exported
+    layout instead of the registry.
+
+    Args:
+        build_paths: Build folders
+        service_images: Images of the service of every build folder
+        platform: Docker buildx platform specification (e.g., "linux/amd64,linux/arm64")
+        timeout: Seconds each image build may run before it is terminated, None waits forever
+        retry: How builds failing with a transient registry error (pulling the base
+            images) are run again
+        builder: Buildx builder to build with, None uses the current one
+
+    Returns:
+        The archive written for every build folder
+    """
+    images = list({each.tag: each for images in service_images for each in images}.values())
+    dependencies = dependencies or {}
+    archives = {}
+    with tempfile.TemporaryDirectory(prefix="colmena-export-") as work:
+        layout = OciLayout(os.path.join(work, "layout"))
+        exported: Dict[str, str] = {}
+        lock = threading.Lock()
+
+        def archive(image: Image) -> str:
+            return os.path.join(work, f"{hashlib.sha256(image.tag.encode()).hexdigest()[:16]}.tar")
+
+        def build_command(image: Image, _, metadata_file: Optional[str]) -> List[str]:
+            parents = set(dependencies.get(image.tag, []))
+            with lock:
+                digests = dict(exported)
+            # contexts only replace the images named as the Dockerfile refers to them
+            contexts = {reference: f"oci-layout://{layout.path}@{digests[parent]}"
+                        for reference, parent in parent_references(image, digests).items() if parent in parents}
+            return docker_export_command(image, platform, archive(image), cache, metadata_file, contexts, builder)
+
+        def on_built(result: BuildResult):
+            with lock:
+                exported[result.image.tag] = layout.add_archive(archive(result.image), result.image.tag)["digest"]
+            os.remove(archive(result.image))
+
+        with metrics.span("export", images=len(images)):
+            build_container_images(images, platform, False, jobs=jobs, keep_going=keep_going, on_built=on_built,
+                                   metrics=metrics, dependencies=dependencies, timeout=timeout, retry=retry,
+                                   build_command=build_command)
+        for build_path, each in zip(build_paths, service_images):
+            archives[build_path] = os.path.join(build_path, EXPORT_FILE)
+            layout.write_archive(archives[build_path], [image.tag for image in each])
+            print(f"exported {len(each)} image(s) to {archives[build_path]}")
+        if layout.shared_size:
+            print(f"{format_size(layout.shared_size)} of layers shared between images were stored once")
+    return archives
+
+
+class RegistryClient:
+    """Pushes blobs and manifests with the OCI distribution API, enough for a local edge registry.
+
+    Registries on localhost, or any with insecure, are reached over plain
+    HTTP. Authentication is not supported.
+    """
+
+    def __init__(self, registry: str, insecure: bool = False):
+        self.registry = registry
+        host = registry.split("/", 1)[0].rsplit(":", 1)[0]
+        scheme = "http" if insecure or host in ("localhost", "127.0.0.1") else "https"
+        self.base_url = f"{scheme}://{registry}"
+
+    def _request(self, method: str, url: str, data: Any = None, headers: Optional[Dict[str, str]] = None):
+        request = urllib.request.Request(urllib.parse.urljoin(self.base_url, url), data=data, method=method,
+                                         headers=headers or {})
+        return urllib.request.urlopen(request, timeout=REGISTRY_TIMEOUT)
+
+    def has_blob(self, repository: str, digest: str) -> bool:
+        try:
+            self._request("HEAD", f"/v2/{repository}/blobs/{digest}").close()
+        except urllib.error.HTTPError as error:
+            if error.code == 404:
+                return False
+            raise
+        return True
+
+    def push_blob(self, repository: str, digest: str, path: str, mount_from: Optional[str] = None) -> bool:
+        """Upload a blob unless the repository has it, or it can be mounted from another repository.
+
+        Returns:
+            Whether the blob content was uploaded
+        """
+        if self.has_blob(repository, digest):
+            return False
+        query = f"?mount={urllib.parse.quote(digest)}&from={urllib.parse.quote(mount_from)}" if mount_from else ""
+        with self._request("POST", f"/v2/{repository}/blobs/uploads/{query}", data=b"") as response:
+            if response.status == 201:
+                # mounted
+                return False
+            location = urllib.parse.urljoin(self.base_url, response.headers["Location"])
+        separator = "&" if "?" in location else "?"
+        with open(path, "rb") as f:
+            headers = {"Content-Type": "application/octet-stream", "Content-Length": str(os.fstat(f.fileno()).st_size)}
+            self._request("PUT", f"{location}{separator}digest={urllib.parse.quote(digest)}", f, headers).close()
+        return True
+
+    def push_manifest(self, repository: str, reference: str, path: str, media_type: str):
+        with open(path, "rb") as f:
+            content = f.read()
+        self._request("PUT", f"/v2/{repository}/manifests/{reference}", content,
+                      {"Content-Type": media_type}).close()
+
+
+def push_image(client: RegistryClient, layout: OciLayout, name: str, repository: str, tag: str,
+               pushed: Optional[Dict[str, str]] = None) -> int:
+    """Push an image of an OCI layout to a registry under repository:tag.
+
+    Args:
+        name: Tag the image was exported with
+        pushed: Repository every blob was already pushed to, updated as blobs
+            are pushed; those blobs are mounted instead of uploaded again
+
+    Returns:
+        Bytes uploaded
+
+    Raises:
+        KeyError: The layout has no image exported with that name
+    """
+    descriptor = layout.image(name)
+    if descriptor is None:
+        raise KeyError(f"{name} is not in the exported images")
+    pushed = {} if pushed is None else pushed
+    uploaded = 0
+    for blob in layout.blobs(descriptor):
+        path = layout.blob_path(blob["digest"])
+        if blob.get("mediaType") in INDEX_MEDIA_TYPES + MANIFEST_MEDIA_TYPES:
+            reference = tag if blob is descriptor else blob["digest"]
+            client.push_manifest(repository, reference, path, blob["mediaType"])
+        elif client.push_blob(repository, blob["digest"], path, pushed.get(blob["digest"])):
+            uploaded += blob["size"]
+        pushed.setdefault(blob["digest"], repository)
+    return uploaded
@@ -0,0 +1,169 @@
+#!/usr/bin/python
+#
+#  Copyright 2002-2025 Barcelona Supercomputing Center (www.bsc.es)
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+# -*- coding: utf-8 -*-
+
+"""Local history of the published service definitions, for rollbacks without rebuilding.
+
+Every definition the tool publishes is stored in an SQLite database with
+its revision number and the registry digest of each of its images. A
+stored revision can be published again right away with
+``deployment.colmena_rollback``; its images are then pinned to the
+digests recorded with it, so that tags pushed since do not leak in.
+"""
+
+import copy
+import json
+import os
+import sqlite3
+from contextlib import closing
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+DEFAULT_HISTORY = os.environ.get("COLMENA_HISTORY",
+                                 os.path.join(os.path.expanduser("~"), ".colmena", "history.sqlite"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS revisions (
+    service TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    published_at TEXT NOT NULL,
+    definition TEXT NOT NULL,
+    digests TEXT NOT NULL,
+    note TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (service, revision)
+)
+"""
+
+
+@dataclass
+class Revision:
+    """A published service definition.
+
+    Attributes:
+        service: Id of the service
+        revision: Number of the revision, starting at 1 for every service
+        published_at: When it was published, as an ISO 8601 UTC timestamp
+        definition: The definition as published, with unpinned image ids
+        digests: Registry digest of its images when it was published, by tag
+        note: Why it was published, for example the revision a rollback restored
+    """
+    service: str
+    revision: int
+    published_at: str
+    definition: Dict[str, Any]
+    digests: Dict[str, str] = field(default_factory=dict)
+    note: str = ""
+
+    def pinned(self) -> Dict[str, Any]:
+        """Return the definition with every image whose digest is known pinned to it."""
+        return pin_digests(self.definition, self.digests)
+
+
+def image_entries(service_definition: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Yield the role and context entries of a definition, which hold the image ids."""
+    yield from service_definition.get("dockerRoleDefinitions", [])
+    yield from service_definition.get("dockerContextDefinitions", [])
+
+
+def pin_digests(service_definition: Dict[str, Any], digests: Dict[str, str]) -> Dict[str, Any]:
+    """Return a copy of a definition whose image ids are "<tag>@<digest>" when the digest is known."""
+    pinned = copy.deepcopy(service_definition)
+    for entry in image_entries(pinned):
+        digest = digests.get(entry.get("imageId"))
+        if digest:
+            entry["imageId"] = f"{entry['imageId']}@{digest}"
+    return pinned
+
+
+class DeploymentHistory:
+    """SQLite store of the published revisions of every service.
+
+    Each call opens its own connection, so the history can be shared by the
+    threads publishing definitions.
+    """
+
+    def __init__(self, path: str = DEFAULT_HISTORY):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as db, db:
+            db.execute(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # waits for the other processes deploying with the same history
+        return sqlite3.connect(self.path, timeout=30)
+
+    def record(self, service_definition: Dict[str, Any], digests: Optional[Dict[str, str]] = None,
+               note: str = "") -> int:
+        """Store a published definition as the next revision of its service.
+
+        Args:
+            service_definition: The definition as published
+            digests: Registry digest of the images, by tag; only the images of
+                the definition are kept
+
+        Returns:
+            The revision number
+        """
+        service = service_definition["id"]["value"]
+        tags = {entry.get("imageId") for entry in image_entries(service_definition)}
+        digests = {tag: digest for tag, digest in (digests or {}).items() if tag in tags and digest}
+        with closing(self._connect()) as db, db:
+            # the write lock is taken up front, so concurrent deployments get distinct revisions
+            db.execute("BEGIN IMMEDIATE")
+            (latest,) = db.execute("SELECT COALESCE(MAX(revision), 0) FROM revisions WHERE service = ?",
+                                   (service,)).fetchone()
+            db.execute("INSERT INTO revisions (service, revision, published_at, definition, digests, note) "
+                       "VALUES (?, ?, ?, ?, ?, ?)",
+                       (service, latest + 1, datetime.now(timezone.utc).isoformat(),
+                        json.dumps(service_definition, sort_keys=True), json.dumps(digests, sort_keys=True), note))
+        return latest + 1
+
+    def revisions(self, service: str, limit: Optional[int] = None) -> List[Revision]:
+        """Return the revisions of a service, newest first."""
+        query = "SELECT * FROM revisions WHERE service = ? ORDER BY revision DESC"
+        parameters: List[Any] = [service]
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit)
+        with closing(self._connect()) as db:
+            return [_revision(row) for row in db.execute(query, parameters)]
+
+    def get(self, service: str, revision: int) -> Optional[Revision]:
+        """Return a revision of a service, None if there is no such revision.
+
+        Negative numbers count back from the latest revision, -1 being the
+        one before it.
+        """
+        if revision < 0:
+            revisions = self.revisions(service, limit=1 - revision)
+            return revisions[-1] if len(revisions) == 1 - revision else None
+        with closing(self._connect()) as db:
+            row = db.execute("SELECT * FROM revisions WHERE service = ? AND revision = ?",
+                             (service, revision)).fetchone()
+        return _revision(row) if row is not None else None
+
+    def services(self) -> List[str]:
+        with closing(self._connect()) as db:
+            return [row[0] for row in db.execute("SELECT DISTINCT service FROM revisions ORDER BY service")]
+
+
+def _revision(row: tuple) -> Revision:
+    service, revision, published_at, definition, digests, note = row
+    return Revision(service, revision, published_at, json.loads(definition), json.loads(digests), note)
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+#
+#  Copyright 2002-2025 Barcelona Supercomputing Center (www.bsc.es)
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+
+class MetricsRecorder:
+    """Collects timing spans of a deployment.
+
+    Every span has a name, wall-clock start and end (seconds since the
+    epoch), a duration measured with a monotonic clock, a status and free
+    attributes. Spans can be recorded from the build threads.
+
+        metrics = MetricsRecorder()
+        with metrics.span("publish", service="my-service") as span:
+            ...
+            span["keys"] = 1
+        metrics.write("metrics.jsonl")
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Dict[str, Any]]:
+        """Time the enclosed block.
+
+        Yields the span's attributes so the block can add to them. When the
+        block raises, the span is recorded with status "error" and, for
+        failed commands, their exit code.
+        """
+        start = time.time()
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            yield attributes
+        except BaseException as error:
+            status = "error"
+            attributes.setdefault("error", str(error))
+            if getattr(error, "returncode", None) is not None:
+                attributes.setdefault("exit_code", error.returncode)
+            raise
+        finally:
+            self.add(name, start, start + time.perf_counter() - started, status, **attributes)
+
+    def add(self, name: str, start: float, end: float, status: str = "ok", **attributes: Any):
+        """Record a span whose times were measured elsewhere."""
+        if not self.enabled:
+            return
+        span = {
+            "name": name,
+            "start": start,
+            "end": end,
+            "duration": end - start,
+            "status": status,
+            "attributes": attributes,
+        }
+        with self._lock:
+            self.spans.append(span)
+
+    def write(self, path: str):
+        """Write the spans as JSON lines, in the order they finished."""
+        with open(path, "w") as f:
+            for span in self.spans:
+                f.write(json.dumps(span, sort_keys=True, default=str) + "\n")
+
+
+# recorder used when no metrics are requested, it keeps nothing
+NO_METRICS = MetricsRecorder(enabled=False)
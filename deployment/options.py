@@ -0,0 +1,101 @@
+#!/usr/bin/python
+#
+#  Copyright 2002-2025 Barcelona Supercomputing Center (www.bsc.es)
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+# -*- coding: utf-8 -*-
+
+"""Options of a deployment, shared by every way of deploying.
+
+deploy_services, deploy_services_async, ServiceWatcher and Deployer all
+take one DeployOptions instead of a keyword argument per option:
+
+    options = DeployOptions(jobs=4, keep_going=True, only_changed=True)
+    deploy_services(args, build_paths, "linux/amd64", "user", False, options)
+"""
+
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from .build_image import BuildResult, CacheConfig, Image, build_container_images
+from .executor import RetryPolicy
+from .history import DeploymentHistory
+from .metrics import NO_METRICS, MetricsRecorder
+from .publisher import ServicePublisher
+
+
+@dataclass
+class DeployOptions:
+    """How the images of a deployment are built and its definitions published.
+
+    Attributes:
+        jobs: Maximum number of images built at the same time, 0 builds all of them at once
+        keep_going: Keep building the remaining images when one fails and raise a
+            BuildError listing every failure at the end, instead of stopping at the first one
+        force_build: Build every image, even those unchanged since they were last pushed
+        verify_registry: Only skip an unchanged image if the registry still holds the
+            digest last pushed for every requested platform
+        cache: BuildKit cache settings, by default only the builder's own cache is used
+        bake: Build all the images with a single ``docker buildx bake`` invocation
+        split_platforms: Build each platform of an image on its own and merge the
+            platforms into one manifest list
+        builder: Buildx builder of the builds, passed to every docker buildx command;
+            None uses the current one (``docker buildx use`` or BUILDX_BUILDER)
+        builders: Buildx builder of each platform, with split_platforms; the platforms
+            not listed use builder
+        image_timeout: Seconds each image build may run, None waits forever
+        retry: How builds failing with a transient registry error are run again,
+            keeping the images already pushed
+        build_only: Build the images without publishing any definition, Zenoh is not
+            even loaded
+        only_changed: Do not publish the definitions equal to the ones already stored
+            in the swarm
+        encoding: Wire format of the published definitions, see deployment.encoding
+        wait_timeout: Seconds to wait for the swarm to answer with each published
+            definition before raising a TimeoutError, None does not wait
+        history: Records every published definition with the digests of its images
+    """
+    jobs: int = 1
+    keep_going: bool = False
+    force_build: bool = False
+    verify_registry: bool = False
+    cache: Optional[CacheConfig] = None
+    bake: bool = False
+    split_platforms: bool = False
+    builder: Optional[str] = None
+    builders: Dict[str, str] = field(default_factory=dict)
+    image_timeout: Optional[float] = None
+    retry: RetryPolicy = field(default_factory=RetryPolicy)
+    build_only: bool = False
+    only_changed: bool = False
+    encoding: str = "json"
+    wait_timeout: Optional[float] = None
+    history: Optional[DeploymentHistory] = None
+
+    def build_images(self, images: List[Image], platform: str, local_debug: bool,
+                     on_built: Optional[Callable[[BuildResult], None]] = None,
+                     metrics: MetricsRecorder = NO_METRICS,
+                     dependencies: Optional[Dict[str, List[str]]] = None) -> List[BuildResult]:
+        """Build the images with these options, see build_container_images."""
+        return build_container_images(images, platform, local_debug, jobs=self.jobs, keep_going=self.keep_going,
+                                      on_built=on_built, cache=self.cache, bake=self.bake, metrics=metrics,
+                                      split_platforms=self.split_platforms, builders=self.builders,
+                                      dependencies=dependencies, timeout=self.image_timeout, retry=self.retry,
+                                      builder=self.builder)
+
+    def publisher(self) -> ServicePublisher:
+        """Return a publisher with these publish options, not opened yet."""
+        return ServicePublisher(only_changed=self.only_changed, encoding=self.encoding,
+                                wait_timeout=self.wait_timeout, history=self.history)
@@ -0,0 +1,246 @@
+#!/usr/bin/python
+#
+#  Copyright 2002-2025 Barcelona Supercomputing Center (www.bsc.es)
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+# -*- coding: utf-8 -*-
+
+"""Dependency graph of the images of a deployment.
+
+An image depends on another one of the same deployment when its
+Dockerfile uses the other image's tag in a FROM line (or COPY --from),
+within a service or across services. Dependent images are built after
+the images they use, as soon as those are pushed, and are rebuilt
+whenever those are.
+"""
+
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Tuple
+
+from .build_image import Image
+
+_VARIABLE = re.compile(r"\$(?:\{([A-Za-z_][A-Za-z0-9_]*)(?::?[-+][^}]*)?\}|([A-Za-z_][A-Za-z0-9_]*))")
+
+
+def dockerfile_instructions(dockerfile: str) -> List[Tuple[str, List[str]]]:
+    """Split a Dockerfile into instructions and their words, joining continuation lines."""
+    instructions = []
+    current = ""
+    with open(dockerfile) as f:
+        for line in f:
+            stripped = line.strip()
+            if not current and (not stripped or stripped.startswith("#")):
+                continue
+            if stripped.startswith("#"):
+                # comments inside continuation lines
+                continue
+            if stripped.endswith("\\"):
+                current += stripped[:-1] + " "
+                continue
+            current += stripped
+            words = current.split()
+            instructions.append((words[0].upper(), words[1:]))
+            current = ""
+    if current.strip():
+        words = current.split()
+        instructions.append((words[0].upper(), words[1:]))
+    return instructions
+
+
+def dockerfile_references(dockerfile: str) -> List[str]:
+    """Return the images a Dockerfile builds from, in order.
+
+    Includes the images of FROM lines and of COPY/ADD --from, with global
+    ARG defaults substituted, but not the build stages of the Dockerfile
+    itself nor "scratch". A missing Dockerfile has no references.
+    """
+    try:
+        instructions = dockerfile_instructions(dockerfile)
+    except FileNotFoundError:
+        return []
+    args: Dict[str, str] = {}
+    # stage names and indexes, which COPY --from can use too
+    stages = set()
+    stage_count = 0
+    references = []
+
+    def substitute(value: str) -> str:
+        return _VARIABLE.sub(lambda match: args.get(match.group(1) or match.group(2), ""), value)
+
+    for instruction, words in instructions:
+        if instruction == "ARG" and not stage_count:
+            for word in words:
+                name, _, default = word.partition("=")
+                args[name] = default.strip("\"'")
+        elif instruction == "FROM":
+            words = [word for word in words if not word.startswith("--")]
+            if not words:
+                continue
+            reference = substitute(words[0])
+            if reference.lower() not in stages and reference != "scratch":
+                references.append(reference)
+            if len(words) >= 3 and words[1].upper() == "AS":
+                stages.add(words[2].lower())
+            stages.add(str(stage_count))
+            stage_count += 1
+        elif instruction in ("COPY", "ADD"):
+            for word in words:
+                if word.startswith("--from="):
+                    reference = substitute(word[len("--from="):])
+                    if reference.lower() not in stages:
+                        references.append(reference)
+    return references
+
+
+def normalize_reference(reference: str) -> str:
+    """Return a reference in the form "<repository>:<tag>", dropping the default registry and tag."""
+    reference = reference.split("@", 1)[0]
+    for prefix in ("docker.io/", "index.docker.io/"):
+        if reference.startswith(prefix):
+            reference = reference[len(prefix):]
+    if reference.startswith("library/"):
+        reference = reference[len("library/"):]
+    name, _, tag = reference.rpartition(":")
+    if not name or "/" in tag:
+        name, tag = reference, "latest"
+    return f"{name}:{tag}"
+
+
+def parent_references(image: Image, tags: Iterable[str]) -> Dict[str, str]:
+    """Return the references of an image's Dockerfile to the given tags, with the tag each one resolves to.
+
+    The references are spelled as the Dockerfile writes them (for example
+    "docker.io/user/base:latest" for the tag "user/base"), which is the
+    name a build context must have to replace the image.
+    """
+    by_reference = {normalize_reference(tag): tag for tag in tags}
+    references = {}
+    for reference in dockerfile_references(os.path.join(image.path, "Dockerfile")):
+        parent = by_reference.get(normalize_reference(reference))
+        if parent is not None and parent != image.tag:
+            references[reference] = parent
+    return references
+
+
+def image_dependencies(images: List[Image]) -> Dict[str, List[str]]:
+    """Return, for every image, the tags of the given images its Dockerfile builds from."""
+    tags = [each.tag for each in images]
+    return {each.tag: list(dict.fromkeys(parent_references(each, tags).values())) for each in images}
+
+
+def topological_order(images: List[Image], dependencies: Dict[str, List[str]]) -> List[Image]:
+    """Order the images so that every image comes after the ones it builds from.
+
+    Independent images keep their given order.
+
+    Raises:
+        ValueError: The images depend on each other in a cycle
+    """
+    by_tag = {each.tag: each for each in images}
+    ordered: List[Image] = []
+    state: Dict[str, str] = {}
+
+    def visit(tag: str, path: List[str]):
+        if state.get(tag) == "done":
+            return
+        if state.get(tag) == "visiting":
+            cycle = path[path.index(tag):] + [tag]
+            raise ValueError(f"images depend on each other in a cycle: {' -> '.join(cycle)}")
+        state[tag] = "visiting"
+        for parent in dependencies.get(tag, []):
+            if parent in by_tag:
+                visit(parent, path + [tag])
+        state[tag] = "done"
+        ordered.append(by_tag[tag])
+
+    for each in images:
+        visit(each.tag, [])
+    return ordered
+
+
+def with_dependents(images: List[Image], selected: List[Image], dependencies: Dict[str, List[str]]) -> List[Image]:
+    """Add to the selected images every image built from them, directly or not.
+
+    Returns the selected images and their dependents, in the order of images.
+    """
+    chosen = {each.tag for each in selected}
+    changed = True
+    while changed:
+        changed = False
+        for each in images:
+            if each.tag not in chosen and any(parent in chosen for parent in dependencies.get(each.tag, [])):
+                chosen.add(each.tag)
+                changed = True
+    return [each for each in images if each.tag in chosen]
+
+
+@dataclass
+class DeploymentPlan:
+    """What a deployment will build and publish, computed before doing anything.
+
+    Attributes:
+        services: Service definition and images of every build folder
+        images: Every image of the deployment, each one after the images it builds from
+        owners: Build folder owning the build of every tag
+        dependencies: Tags of the deployment's images every image builds from
+        build: Images to build, in the order of images
+        reasons: Why each image is built, or not
+        manifests: Build manifest of every build folder, to record the pushed images
+    """
+    services: List[Tuple[Dict[str, Any], List[Image]]]
+    images: List[Image]
+    owners: Dict[str, str]
+    dependencies: Dict[str, List[str]]
+    build: List[Image] = field(default_factory=list)
+    reasons: Dict[str, str] = field(default_factory=dict)
+    manifests: Dict[str, Any] = field(default_factory=dict)
+
+    def digests(self, results: List[Any]) -> Dict[str, str]:
+        """Return the registry digest of every image whose digest is known.
+
+        Built images take it from their build results, the others from the
+        build manifests.
+
+        Args:
+            results: BuildResult of the built images
+        """
+        digests = {}
+        for each in self.images:
+            manifest = self.manifests.get(self.owners.get(each.tag))
+            digest = manifest.image_digest(each) if manifest is not None else None
+            if digest:
+                digests[each.tag] = digest
+        digests.update({result.image.tag: result.digest for result in results if result.digest})
+        return digests
+
+    def describe(self, local_debug: bool = False, skip_build: bool = False) -> str:
+        """Return a human readable summary of the plan, one line per image and service."""
+        building = {each.tag for each in self.build}
+        action = "build and load" if local_debug else "build and push"
+        lines = [f"deployment plan: {len(self.build)} of {len(self.images)} image(s) to build, "
+                 f"{len(self.services)} service definition(s) to publish"]
+        for each in self.images:
+            if skip_build:
+                step = "skip"
+            else:
+                step = action if each.tag in building else "cached"
+            after = self.dependencies.get(each.tag, [])
+            details = [self.reasons.get(each.tag, "")] + ([f"after {', '.join(after)}"] if after else [])
+            lines.append(f"  {step:<15} {each.tag:<40} {'; '.join(detail for detail in details if detail)}")
+        for service_definition, _ in self.services:
+            lines.append(f"  {'publish':<15} {service_definition['id']['value']}")
+        return "\n".join(lines)
@@ -0,0 +1,242 @@
+#!/usr/bin/python
+#
+#  Copyright 2002-2025 Barcelona Supercomputing Center (www.bsc.es)
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from .encoding import decode_definition, encode_definition
+from .history import DeploymentHistory
+
+SERVICE_DEFINITIONS_KEY = "colmena_service_definitions"
+DEFAULT_ZENOH_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "zenoh_config.json5")
+DEFAULT_QUERY_TIMEOUT = 5.0
+# seconds between two queries while waiting for a definition to become visible
+VISIBILITY_POLL_INTERVAL = 0.2
+
+
+def service_definition_key(service_definition: Dict[str, Any]) -> str:
+    """Return the Zenoh key expression a service definition is published under."""
+    return f"{SERVICE_DEFINITIONS_KEY}/{service_definition['id']['value']}"
+
+
+def canonical_json(value: Any) -> str:
+    """Serialize a value so that equal definitions give equal strings."""
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+def definition_diff(old: Any, new: Any, path: str = "") -> List[Dict[str, Any]]:
+    """Compare two service definitions.
+
+    Returns:
+        One entry per difference, with the operation ("added", "removed" or
+        "changed"), the JSON path and the old and/or new values
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        changes = []
+        for key in sorted(set(old) | set(new), key=str):
+            child = f"{path}.{key}" if path else str(key)
+            if key not in new:
+                changes.append({"op": "removed", "path": child, "old": old[key]})
+            elif key not in old:
+                changes.append({"op": "added", "path": child, "new": new[key]})
+            else:
+                changes.extend(definition_diff(old[key], new[key], child))
+        return changes
+    if isinstance(old, list) and isinstance(new, list):
+        changes = []
+        for i in range(max(len(old), len(new))):
+            child = f"{path}[{i}]"
+            if i >= len(new):
+                changes.append({"op": "removed", "path": child, "old": old[i]})
+            elif i >= len(old):
+                changes.append({"op": "added", "path": child, "new": new[i]})
+            else:
+                changes.extend(definition_diff(old[i], new[i], child))
+        return changes
+    if canonical_json(old) != canonical_json(new):
+        return [{"op": "changed", "path": path, "old": old, "new": new}]
+    return []
+
+
+def format_diff(changes: List[Dict[str, Any]]) -> str:
+    lines = []
+    for change in changes:
+        if change["op"] == "added":
+            lines.append(f"  + {change['path']}: {json.dumps(change['new'])}")
+        elif change["op"] == "removed":
+            lines.append(f"  - {change['path']}: {json.dumps(change['old'])}")
+        else:
+            lines.append(f"  ~ {change['path']}: {json.dumps(change['old'])} -> {json.dumps(change['new'])}")
+    return "\n".join(lines)
+
+
+class ServicePublisher:
+    """Publishes service definitions to Zenoh over a single, reusable session.
+
+    The session is opened on first use and kept until close() is called,
+    so publishing many definitions only pays session setup and peer
+    discovery once. Use it as a context manager to make sure the session
+    is closed:
+
+        with ServicePublisher() as publisher:
+            publisher.publish_many(service_definitions)
+    """
+
+    def __init__(self, config_path: Optional[str] = None, only_changed: bool = False,
+                 query_timeout: float = DEFAULT_QUERY_TIMEOUT, encoding: str = "json",
+                 wait_timeout: Optional[float] = None, history: Optional[DeploymentHistory] = None):
+        """
+        Args:
+            config_path: Zenoh configuration file, defaults to the zenoh_config.json5 shipped with the tool
+            only_changed: Query the definition currently stored in the swarm first and skip
+                the put when it is equal to the new one
+            query_timeout: Seconds to wait for the stored definition
+            encoding: Wire format of the published definitions, see deployment.encoding
+            wait_timeout: After each put, wait up to this many seconds for the swarm to answer
+                queries with the new definition, None returns right after the put
+            history: Records every published definition as a new revision of its service
+        """
+        self.config_path = config_path or DEFAULT_ZENOH_CONFIG
+        self.only_changed = only_changed
+        self.query_timeout = query_timeout
+        self.encoding = encoding
+        self.wait_timeout = wait_timeout
+        self.history = history
+        # seconds each published key took to become visible, with wait_timeout
+        self.visible_after: Dict[str, float] = {}
+        self._session = None
+
+    def __enter__(self) -> "ServicePublisher":
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def session(self):
+        """The Zenoh session, opened if needed."""
+        self.open()
+        return self._session
+
+    def open(self):
+        if self._session is None:
+            # the native extension takes a while to load, only pay for it when publishing
+            import zenoh
+
+            self._session = zenoh.open(zenoh.Config.from_file(self.config_path))
+
+    def close(self):
+        if self._session is not None:
+            session, self._session = self._session, None
+            session.close()
+
+    def current(self, service_name: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Query the definition currently stored in the swarm for a service.
+
+        Args:
+            service_name: Id of the service
+            timeout: Seconds to wait for an answer, defaults to query_timeout
+
+        Returns:
+            The stored definition, or None when no peer answered in time
+        """
+        key = f"{SERVICE_DEFINITIONS_KEY}/{service_name}"
+        for reply in self.session.get(key, timeout=self.query_timeout if timeout is None else timeout):
+            if reply.ok is None:
+                continue
+            try:
+                return decode_definition(reply.ok.payload.to_bytes(), str(reply.ok.encoding))
+            except (ValueError, OSError):
+                # not a definition this tool published, treat it as changed
+                continue
+        return None
+
+    def publish(self, service_definition: Dict[str, Any], digests: Optional[Dict[str, str]] = None) -> Optional[str]:
+        """Publish a service definition, keyexpr: colmena_service_definitions/<service id>
+
+        Args:
+            service_definition: The definition
+            digests: Registry digest of the images, by tag, stored in the history
+
+        Returns:
+            The key expression the definition was published under, or None when
+            only_changed is set and the swarm already has an equal definition
+        """
+        key = service_definition_key(service_definition)
+        service_name = service_definition["id"]["value"]
+        if self.only_changed:
+            stored = self.current(service_name)
+            if stored is not None:
+                changes = definition_diff(stored, service_definition)
+                if not changes:
+                    print(f"service definition for {service_name} is unchanged, not publishing it")
+                    return None
+                print(f"service definition for {service_name} changed:\n{format_diff(changes)}")
+        print(f"publishing service definition for {service_name} to Zenoh")
+        payload, encoding = encode_definition(service_definition, self.encoding)
+        if encoding is None:
+            self.session.put(key, payload)
+        else:
+            self.session.put(key, payload, encoding=encoding)
+        if self.wait_timeout is not None:
+            self.visible_after[key] = self.wait_until_visible(service_definition, self.wait_timeout)
+            print(f"service definition for {service_name} visible on the swarm "
+                  f"after {self.visible_after[key]:.3f}s")
+        if self.history is not None:
+            revision = self.history.record(service_definition, digests)
+            print(f"recorded revision {revision} of {service_name}")
+        return key
+
+    def wait_until_visible(self, service_definition: Dict[str, Any], timeout: float) -> float:
+        """Query the swarm until it answers with the given definition.
+
+        A put is fire-and-forget, and is lost if no peer was discovered yet.
+        Querying the key back confirms that a peer storing the definitions
+        (the same peers --only_changed relies on) received it.
+
+        Returns:
+            Seconds until the definition was visible
+
+        Raises:
+            TimeoutError: The swarm still did not have the definition after timeout seconds
+        """
+        service_name = service_definition["id"]["value"]
+        expected = canonical_json(service_definition)
+        started = time.monotonic()
+        while True:
+            remaining = timeout - (time.monotonic() - started)
+            stored = self.current(service_name, timeout=max(0.0, min(self.query_timeout, remaining)))
+            if stored is not None and canonical_json(stored) == expected:
+                return time.monotonic() - started
+            if time.monotonic() - started + VISIBILITY_POLL_INTERVAL > timeout:
+                raise TimeoutError(f"service definition for {service_name} was not visible on the swarm "
+                                   f"after {timeout} seconds")
+            time.sleep(VISIBILITY_POLL_INTERVAL)
+
+    def publish_many(self, service_definitions: Iterable[Dict[str, Any]],
+                     digests: Optional[Dict[str, str]] = None) -> List[Optional[str]]:
+        """Publish several service definitions over the same session.
+
+        Returns:
+            The result of publish() for every definition, in order
+        """
+        return [self.publish(each, digests) for each in service_definitions]
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+#
+#  Copyright 2002-2025 Barcelona Supercomputing Center (www.bsc.es)
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+# -*- coding: utf-8 -*-
+
+import json
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from .build_image import Image
+
+# registry lookups are network bound, a few of them can run at once
+INSPECT_JOBS = 8
+
+
+@dataclass
+class RemoteImage:
+    """Manifest of a tag as stored in the registry.
+
+    Attributes:
+        digest: Digest of the manifest (or manifest list) the tag points to
+        platforms: Platforms of a manifest list, empty for single-platform manifests
+    """
+    digest: str
+    platforms: List[str] = field(default_factory=list)
+
+
+def normalize_platform(platform: str) -> str:
+    """Drop the default variants so that "linux/arm64/v8" equals "linux/arm64"."""
+    platform = platform.strip()
+    for default in ("linux/arm64/v8", "linux/amd64/v1"):
+        if platform == default:
+            return platform.rsplit("/", 1)[0]
+    return platform
+
+
+def inspect_remote(tag: str) -> Optional[RemoteImage]:
+    """Ask the registry for the manifest of a tag with ``docker buildx imagetools inspect``.
+
+    Uses the docker credentials of the host, so it works with any registry
+    the images are pushed to.
+
+    Returns:
+        The remote manifest, or None when the tag does not exist (or cannot be read)
+    """
+    process = subprocess.run(
+        ["docker", "buildx", "imagetools", "inspect", tag, "--format", "{{json .Manifest}}"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode != 0:
+        return None
+    try:
+        manifest = json.loads(process.stdout)
+    except json.JSONDecodeError:
+        return None
+    platforms = []
+    for each in manifest.get("manifests") or []:
+        platform = each.get("platform") or {}
+        if platform.get("os", "unknown") == "unknown":
+            # attestation manifests
+            continue
+        parts = [platform.get("os"), platform.get("architecture"), platform.get("variant")]
+        platforms.append(normalize_platform("/".join(part for part in parts if part)))
+    return RemoteImage(digest=manifest["digest"], platforms=platforms)
+
+
+def missing_from_registry(images: List[Image], expected_digests: Dict[str, str],
+                          platform: Optional[str]) -> List[Image]:
+    """Return the images whose tag in the registry is not the one last pushed.
+
+    An image is missing when the tag does not exist, points to a different
+    digest than expected (it was overwritten or never recorded), or lacks
+    any of the requested platforms.
+
+    Args:
+        images: Images to check
+        expected_digests: Digest recorded for each tag when it was last pushed
+        platform: Docker buildx platform specification (e.g., "linux/amd64,linux/arm64")
+    """
+    if not images:
+        return []
+    requested = {normalize_platform(each) for each in platform.split(",")} if platform else set()
+    with ThreadPoolExecutor(max_workers=min(INSPECT_JOBS, len(images))) as executor:
+        remotes = list(executor.map(lambda image: inspect_remote(image.tag), images))
+
+    missing = []
+    for image, remote in zip(images, remotes):
+        if remote is None:
+            reason = "not found in the registry"
+        elif remote.digest != expected_digests.get(image.tag):
+            reason = f"registry has {remote.digest}, expected {expected_digests.get(image.tag)}"
+        elif remote.platforms and not requested.issubset(remote.platforms):
+            reason = f"registry only has {', '.join(remote.platforms)}"
+        else:
+            continue
+        print(f"rebuilding {image.tag}: {reason}")
+        missing.append(image)
+    return missing
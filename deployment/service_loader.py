@@ -0,0 +1,143 @@
+#!/usr/bin/python
+#
+#  Copyright 2002-2025 Barcelona Supercomputing Center (www.bsc.es)
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+# -*- coding: utf-8 -*-
+
+"""Loading and validation of service descriptions.
+
+The whole description is checked before anything is built, and every
+problem is reported at once: structure, duplicated role, context and
+image ids, invalid image names and, when building, missing role and
+context folders and Dockerfiles.
+"""
+
+import json
+import os
+import re
+from typing import Any, Dict, List
+
+DESCRIPTION_FILE = "service_description.json"
+
+# repository path of an image reference, as accepted by docker, with an optional tag
+_IMAGE_ID = re.compile(r"[a-z0-9]+(?:(?:[._]|__|-+)[a-z0-9]+)*(?:/[a-z0-9]+(?:(?:[._]|__|-+)[a-z0-9]+)*)*"
+                       r"(?::[A-Za-z0-9_][A-Za-z0-9_.-]{0,127})?")
+
+
+class ServiceDefinitionError(ValueError):
+    """Raised when one or more service descriptions are invalid.
+
+    Attributes:
+        errors: Every problem found, each starting with the file it was found in
+    """
+
+    def __init__(self, errors: List[str]):
+        self.errors = errors
+        super().__init__("invalid service description:\n" + "\n".join(f"  {each}" for each in errors))
+
+
+def read_definition(build_path: str) -> Dict[str, Any]:
+    """Parse the service description of a build folder, without validating it."""
+    path = os.path.join(build_path, DESCRIPTION_FILE)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise ServiceDefinitionError([f"{path}: not found"]) from None
+    except json.JSONDecodeError as error:
+        raise ServiceDefinitionError([f"{path}: invalid JSON at line {error.lineno} column {error.colno}: "
+                                      f"{error.msg}"]) from None
+
+
+def validate_definition(service_definition: Any, build_path: str, check_files: bool = True) -> List[str]:
+    """Check a service description.
+
+    Args:
+        service_definition: Parsed service_description.json
+        build_path: Build folder the description belongs to
+        check_files: Also check that the folder and Dockerfile of every role and context exist
+
+    Returns:
+        Every problem found, an empty list when the description is valid
+    """
+    source = os.path.join(build_path, DESCRIPTION_FILE)
+    errors: List[str] = []
+    if not isinstance(service_definition, dict):
+        return [f"{source}: expected an object"]
+
+    service_id = service_definition.get("id")
+    if not isinstance(service_id, dict) or not _is_name(service_id.get("value")):
+        errors.append(f"{source}: id.value: expected a non-empty string")
+
+    image_ids: Dict[str, str] = {}
+    for key, folder in (("dockerRoleDefinitions", ""), ("dockerContextDefinitions", "context")):
+        entries = service_definition.get(key)
+        if not isinstance(entries, list):
+            errors.append(f"{source}: {key}: expected a list")
+            continue
+        ids: Dict[str, int] = {}
+        for i, entry in enumerate(entries):
+            where = f"{source}: {key}[{i}]"
+            if not isinstance(entry, dict):
+                errors.append(f"{where}: expected an object")
+                continue
+            entry_id = entry.get("id")
+            if not _is_name(entry_id):
+                errors.append(f"{where}.id: expected a non-empty string")
+            elif "/" in entry_id or "\\" in entry_id or entry_id in (".", ".."):
+                errors.append(f"{where}.id: {entry_id!r} is not a folder name")
+            elif entry_id in ids:
+                errors.append(f"{where}.id: {entry_id!r} is already used by {key}[{ids[entry_id]}]")
+            else:
+                ids[entry_id] = i
+                if check_files:
+                    errors.extend(_check_folder(where, os.path.join(build_path, folder, entry_id)))
+
+            image_id = entry.get("imageId")
+            if not _is_name(image_id):
+                errors.append(f"{where}.imageId: expected a non-empty string")
+            elif not _IMAGE_ID.fullmatch(image_id):
+                errors.append(f"{where}.imageId: {image_id!r} is not a valid image name")
+            elif image_id in image_ids:
+                errors.append(f"{where}.imageId: {image_id!r} is already used by {image_ids[image_id]}")
+            else:
+                image_ids[image_id] = f"{key}[{i}]"
+    return errors
+
+
+def _is_name(value: Any) -> bool:
+    return isinstance(value, str) and bool(value.strip())
+
+
+def _check_folder(where: str, path: str) -> List[str]:
+    if not os.path.isdir(path):
+        return [f"{where}: folder {path} not found"]
+    if not os.path.isfile(os.path.join(path, "Dockerfile")):
+        return [f"{where}: {path}/Dockerfile not found"]
+    return []
+
+
+def load_definition(build_path: str, check_files: bool = True) -> Dict[str, Any]:
+    """Parse and validate the service description of a build folder.
+
+    Raises:
+        ServiceDefinitionError: The description is missing or invalid, listing every problem
+    """
+    service_definition = read_definition(build_path)
+    errors = validate_definition(service_definition, build_path, check_files)
+    if errors:
+        raise ServiceDefinitionError(errors)
+    return service_definition
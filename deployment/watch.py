@@ -0,0 +1,372 @@
+#!/usr/bin/python
+#
+#  Copyright 2002-2025 Barcelona Supercomputing Center (www.bsc.es)
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+# -*- coding: utf-8 -*-
+
+"""Watch mode: rebuild and republish services as their files change.
+
+Each build folder is watched for changes to service_description.json and
+each role and context folder for changes to its build context, with
+inotify on Linux and by polling elsewhere. Changes are debounced, only the
+images whose context changed are rebuilt and pushed, and a service
+definition is only republished when its description changed. The Zenoh
+session stays open for the whole session.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .build_image import BuildError, BuildResult, Image
+from .build_manifest import BuildManifest
+from .colmena_deploy import images_to_build, load_service, unique_images
+from .metrics import NO_METRICS, MetricsRecorder
+from .options import DeployOptions
+from .planner import image_dependencies, topological_order, with_dependents
+from .publisher import ServicePublisher, canonical_json
+from .service_loader import ServiceDefinitionError
+
+# seconds without new changes before acting on them
+DEFAULT_DEBOUNCE = 0.5
+# seconds between scans when inotify is not available
+DEFAULT_POLL_INTERVAL = 1.0
+
+_IN_MODIFY = 0x2
+_IN_ATTRIB = 0x4
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_DELETE_SELF = 0x400
+_IN_MOVE_SELF = 0x800
+_IN_Q_OVERFLOW = 0x4000
+_IN_ISDIR = 0x40000000
+_WATCH_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE
+               | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF)
+_EVENT = struct.Struct("iIII")
+
+
+class FileWatcher(ABC):
+    """Reports the files changed under a set of roots.
+
+    Each root is a directory and whether its subdirectories are watched too.
+    """
+
+    def __init__(self, roots: List[Tuple[str, bool]]):
+        self.roots = [(os.path.normpath(path), recursive) for path, recursive in roots]
+
+    def changes(self, debounce: float = DEFAULT_DEBOUNCE, timeout: Optional[float] = None) -> Set[str]:
+        """Wait for changes and return the changed paths once none happened for debounce seconds.
+
+        Returns an empty set when nothing changed within timeout (None waits forever).
+        """
+        changed = self._poll(timeout)
+        if not changed:
+            return changed
+        while True:
+            more = self._poll(debounce)
+            if not more:
+                return changed
+            changed |= more
+
+    @abstractmethod
+    def _poll(self, timeout: Optional[float]) -> Set[str]:
+        """Return the paths changed within timeout seconds, as soon as there are some."""
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(FileWatcher):
+    """FileWatcher using Linux inotify, with one watch per directory."""
+
+    def __init__(self, roots: List[Tuple[str, bool]]):
+        super().__init__(roots)
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watches: Dict[int, Tuple[str, bool]] = {}
+        for path, recursive in self.roots:
+            self._add(path, recursive)
+
+    def _add(self, path: str, recursive: bool) -> List[str]:
+        """Watch a directory (and its subdirectories if recursive), returning the files found in them."""
+        files = []
+        for directory, subdirectories, names in os.walk(path) if recursive else [(path, [], [])]:
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _WATCH_MASK)
+            if wd >= 0:
+                self._watches[wd] = (directory, recursive)
+            files.extend(os.path.join(directory, name) for name in names)
+        return files
+
+    def _poll(self, timeout: Optional[float]) -> Set[str]:
+        changed: Set[str] = set()
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return changed
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                name = os.fsdecode(data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0"))
+                offset += _EVENT.size + length
+                if mask & _IN_Q_OVERFLOW:
+                    # events were lost, anything may have changed
+                    changed.update(path for path, _ in self.roots)
+                    continue
+                if wd not in self._watches:
+                    continue
+                directory, recursive = self._watches[wd]
+                path = os.path.join(directory, name) if name else directory
+                changed.add(path)
+                if recursive and mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                    changed.update(self._add(path, True))
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatcher(FileWatcher):
+    """FileWatcher comparing the modification time and size of every file between scans."""
+
+    def __init__(self, roots: List[Tuple[str, bool]], interval: float = DEFAULT_POLL_INTERVAL):
+        super().__init__(roots)
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self) -> Dict[str, Tuple[int, int, int]]:
+        snapshot = {}
+        for root, recursive in self.roots:
+            for directory, subdirectories, names in os.walk(root):
+                for name in names:
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.lstat(path)
+                    except FileNotFoundError:
+                        continue
+                    snapshot[path] = (stat.st_mtime_ns, stat.st_size, stat.st_mode)
+                if not recursive:
+                    break
+        return snapshot
+
+    def _poll(self, timeout: Optional[float]) -> Set[str]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self._scan()
+            changed = {path for path in snapshot.keys() | self._snapshot.keys()
+                       if snapshot.get(path) != self._snapshot.get(path)}
+            self._snapshot = snapshot
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return changed
+            wait = self.interval if deadline is None else min(self.interval, max(0.0, deadline - time.monotonic()))
+            time.sleep(wait)
+
+
+def watch_files(roots: List[Tuple[str, bool]], poll_interval: float = DEFAULT_POLL_INTERVAL) -> FileWatcher:
+    """Watch the roots with inotify when the platform supports it, by polling otherwise."""
+    try:
+        return InotifyWatcher(roots)
+    except (OSError, AttributeError):
+        # no libc with inotify (not Linux) or no inotify instances left
+        return PollingWatcher(roots, poll_interval)
+
+
+def _inside(path: str, directory: str) -> bool:
+    return path == directory or path.startswith(directory + os.sep)
+
+
+class ServiceWatcher:
+    """Rebuilds and republishes the services of some build folders as their files change.
+
+    Create it before the initial deployment so that no edit made meanwhile
+    is missed, then call watch():
+
+        with ServicePublisher() as publisher:
+            watcher = ServiceWatcher(args, build_paths, platform, user, publisher)
+            deploy_services(args, build_paths, platform, user, False, publisher=publisher)
+            watcher.watch()
+    """
+
+    def __init__(self, _args, build_paths: List[str], platform: str, user: str, publisher: ServicePublisher,
+                 options: Optional[DeployOptions] = None, skip_build: bool = False,
+                 debounce: float = DEFAULT_DEBOUNCE, poll_interval: float = DEFAULT_POLL_INTERVAL,
+                 metrics: MetricsRecorder = NO_METRICS):
+        """
+        Args:
+            publisher: Open publisher the changed definitions are published with
+            options: How the changed images are built, the publish options come from
+                the publisher; force_build and verify_registry only apply to the
+                initial deployment
+            skip_build: Only watch the service descriptions and republish them, without
+                building any image nor requiring the role and context folders
+            debounce: Seconds without new changes before rebuilding
+            poll_interval: Seconds between scans when inotify is not available
+        """
+        self._args = _args
+        self.build_paths = [os.path.normpath(each) for each in dict.fromkeys(build_paths)]
+        self.platform = platform
+        self.user = user
+        self.publisher = publisher
+        self.options = options or DeployOptions()
+        self.skip_build = skip_build
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.metrics = metrics
+        # canonical published definition and images of every build folder
+        self.services: Dict[str, Tuple[str, List[Image]]] = {}
+        for build_path in self.build_paths:
+            definition, images = load_service(build_path, user, check_files=not skip_build)
+            self.services[build_path] = (canonical_json(definition), images)
+        self.files = watch_files(self._roots(), poll_interval)
+
+    def _roots(self) -> List[Tuple[str, bool]]:
+        roots = [(build_path, False) for build_path in self.build_paths]
+        if self.skip_build:
+            return roots
+        for _, images in self.services.values():
+            roots.extend((os.path.normpath(each.path), True) for each in images if os.path.isdir(each.path))
+        return list(dict.fromkeys(roots))
+
+    def watch(self):
+        """Process changes until interrupted with Ctrl+C."""
+        print(f"watching {', '.join(self.build_paths)} for changes, press Ctrl+C to stop")
+        try:
+            while True:
+                self.process(self.files.changes(self.debounce))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.files.close()
+
+    def process(self, changed: Set[str]):
+        """Rebuild the images and republish the definitions affected by the changed paths."""
+        changed = {os.path.normpath(each) for each in changed}
+        rebuild: Dict[str, Image] = {}
+        republish: List[Tuple[str, Dict[str, Any], List[Image]]] = []
+        roots = self._roots()
+        for build_path in self.build_paths:
+            published, images = self.services[build_path]
+            if os.path.join(build_path, "service_description.json") in changed or build_path in changed:
+                try:
+                    definition, new_images = load_service(build_path, self.user, check_files=not self.skip_build)
+                except ServiceDefinitionError as error:
+                    # the role and context edits are still built, with the last valid images
+                    print(f"{error}, not publishing until the next change")
+                else:
+                    known = {each.tag for each in images}
+                    for each in new_images:
+                        if each.tag not in known and not self.skip_build:
+                            rebuild.setdefault(each.tag, each)
+                    if canonical_json(definition) != published:
+                        republish.append((build_path, definition, new_images))
+                    images = new_images
+                    self.services[build_path] = (published, images)
+            for each in [] if self.skip_build else images:
+                if any(_inside(path, os.path.normpath(each.path)) for path in changed):
+                    rebuild.setdefault(each.tag, each)
+
+        failed, built = self._build(list(rebuild.values()))
+        for build_path, definition, images in republish:
+            if any(each.tag in failed for each in images):
+                print(f"not publishing {definition['id']['value']}, some of its images failed to build")
+                continue
+            self.publisher.publish(definition, self._digests(images, built))
+            self.services[build_path] = (canonical_json(definition), images)
+
+        if self._roots() != roots:
+            # roles or contexts were added or removed
+            self.files.close()
+            self.files = watch_files(self._roots(), self.poll_interval)
+
+    def _build(self, images: List[Image]) -> Tuple[Set[str], Dict[str, str]]:
+        """Build the images whose context really changed, and the images built from them.
+
+        Returns the tags that failed and the registry digest of the images built.
+        """
+        built: Dict[str, str] = {}
+        if not images:
+            return set(), built
+        # the watched services already list the changed images
+        all_images, owners = unique_images(self.build_paths, [self.services[each][1] for each in self.build_paths])
+        dependencies = image_dependencies(all_images)
+        try:
+            all_images = topological_order(all_images, dependencies)
+        except ValueError as error:
+            print(f"{error}, waiting for the next change")
+            return {each.tag for each in images}, built
+        images, manifests = images_to_build(with_dependents(all_images, images, dependencies), owners,
+                                            self.platform, self._args.local_debug, metrics=self.metrics,
+                                            dependencies=dependencies)
+        if not images:
+            return set(), built
+
+        def on_built(result: BuildResult):
+            if result.digest:
+                built[result.image.tag] = result.digest
+            if manifests:
+                manifests[owners[result.image.tag]].record(result.image, result.digest)
+
+        try:
+            self.options.build_images(images, self.platform, self._args.local_debug, on_built=on_built,
+                                      metrics=self.metrics, dependencies=dependencies)
+        except BuildError as error:
+            print(f"{error}, waiting for the next change")
+            # with split platforms the failures are "<tag> (<platform>)"
+            return {failure.split(" ", 1)[0] for failure in error.failures}, built
+        except Exception as error:
+            print(f"build failed: {error}, waiting for the next change")
+            return {each.tag for each in images}, built
+        finally:
+            for manifest in manifests.values():
+                manifest.flush()
+        print(f"rebuilt {', '.join(each.tag for each in images)}")
+        return set(), built
+
+    def _digests(self, images: List[Image], built: Dict[str, str]) -> Dict[str, str]:
+        """Return the registry digest of the images whose digest is known, as deploy_services publishes them.
+
+        Images just built take it from their build, the others from the
+        build manifest of the folder owning them.
+        """
+        if self._args.local_debug:
+            return {}
+        _, owners = unique_images(self.build_paths, [self.services[each][1] for each in self.build_paths])
+        manifests: Dict[str, BuildManifest] = {}
+        digests = {}
+        for each in images:
+            owner = owners.get(each.tag)
+            if owner is not None and owner not in manifests:
+                manifests[owner] = BuildManifest.load(owner)
+            digest = built.get(each.tag) or (manifests[owner].image_digest(each) if owner is not None else None)
+            if digest:
+                digests[each.tag] = digest
+        return digests
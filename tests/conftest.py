@@ -2,6 +2,7 @@
 
 import json
 import os
+import subprocess
 import tempfile
 from pathlib import Path
 from unittest.mock import Mock, patch
@@ -60,15 +61,19 @@ def mock_zenoh_session():
 @pytest.fixture
 def mock_subprocess():
     """Mock subprocess for testing Docker commands."""
-    with patch('deployment.build_image.subprocess') as mock_sub:
-        mock_sub.check_output.return_value = b"Success"
+    with patch('deployment.executor.subprocess') as mock_sub:
+        # the exceptions stay real so that they can be raised and caught
+        mock_sub.CalledProcessError = subprocess.CalledProcessError
+        mock_sub.TimeoutExpired = subprocess.TimeoutExpired
+        mock_sub.Popen.return_value.stdout = []
+        mock_sub.Popen.return_value.wait.return_value = 0
         yield mock_sub
 
 
 @pytest.fixture
 def mock_zenoh_open():
     """Mock zenoh.open for testing."""
-    with patch('deployment.colmena_deploy.zenoh.open') as mock_open:
+    with patch('zenoh.open') as mock_open:
         yield mock_open
 
 
@@ -77,3 +82,35 @@ def mock_os_environ():
     """Mock os.environ for testing."""
     with patch.dict('os.environ', {}, clear=True) as mock_env:
         yield mock_env
+
+
+@pytest.fixture
+def write_service():
+    """Return a function writing a build folder with a service description and a Dockerfile per role.
+
+    Each role is an image id, or a (role id, image id) pair for roles whose
+    image is named differently; the written definition is returned.
+    """
+    def write(build_path, service_id, roles):
+        roles = [(role, role) if isinstance(role, str) else role for role in roles]
+        build_path.mkdir(parents=True, exist_ok=True)
+        definition = {
+            "id": {"value": service_id},
+            "dockerRoleDefinitions": [{"id": role, "imageId": image_id} for role, image_id in roles],
+            "dockerContextDefinitions": []
+        }
+        (build_path / "service_description.json").write_text(json.dumps(definition))
+        for role, _ in roles:
+            (build_path / role).mkdir()
+            (build_path / role / "Dockerfile").write_text("FROM alpine\n")
+        return definition
+
+    return write
+
+
+@pytest.fixture
+def local_args():
+    """Command line arguments of a deployment that pushes the images."""
+    args = Mock()
+    args.local_debug = False
+    return args
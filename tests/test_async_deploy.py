@@ -0,0 +1,132 @@
+"""Tests for the async_deploy module."""
+
+import asyncio
+import subprocess
+import time
+from unittest.mock import patch
+
+import pytest
+
+from deployment.async_deploy import deploy_services_async, run_streamed_async
+from deployment.build_image import BuildError
+from deployment.executor import RetryPolicy
+from deployment.options import DeployOptions
+
+
+@pytest.fixture
+def build_commands():
+    """Replace the docker build of each image id with a shell command."""
+    commands = {}
+    with patch("deployment.async_deploy.docker_build_command",
+               side_effect=lambda image, *args: ["sh", "-c", commands[image.id]]):
+        yield commands
+
+
+class TestRunStreamedAsync:
+    """Test running build commands without blocking the event loop."""
+
+    @pytest.mark.unit
+    def test_output_is_prefixed(self, capsys):
+        """Test that every output line is printed with the prefix."""
+        asyncio.run(run_streamed_async(["sh", "-c", "echo one; echo two >&2"], "api"))
+
+        assert capsys.readouterr().out.splitlines() == ["[api] one", "[api] two"]
+
+    @pytest.mark.unit
+    def test_failure_raises(self):
+        """Test that a non-zero exit code raises CalledProcessError."""
+        with pytest.raises(subprocess.CalledProcessError) as error:
+            asyncio.run(run_streamed_async(["sh", "-c", "exit 3"], "api"))
+
+        assert error.value.returncode == 3
+
+    @pytest.mark.unit
+    def test_timeout_terminates(self):
+        """Test that a command running past its timeout is terminated."""
+        started = time.monotonic()
+        with pytest.raises(TimeoutError):
+            asyncio.run(run_streamed_async(["sleep", "30"], "api", timeout=0.2))
+
+        assert time.monotonic() - started < 5
+
+    @pytest.mark.unit
+    def test_transient_failure_is_retried(self, temp_dir, capsys):
+        """Test that a command failing with a registry error is run again."""
+        marker = temp_dir / "marker"
+        command = f"if [ -f {marker} ]; then echo pushed; else touch {marker}; echo 429 Too Many Requests; exit 1; fi"
+
+        asyncio.run(run_streamed_async(["sh", "-c", command], "api", retry=RetryPolicy(retries=1, backoff=0.01)))
+
+        assert "[api] pushed" in capsys.readouterr().out
+
+
+class TestDeployServicesAsync:
+    """Test the asynchronous deployment pipeline."""
+
+    @pytest.mark.unit
+    def test_publishes_each_service_once_its_images_are_pushed(self, temp_dir, build_commands, local_args,
+                                                               mock_zenoh_open, mock_zenoh_session, write_service):
+        """Test that a service is published while the images of another one are still building."""
+        mock_zenoh_open.return_value = mock_zenoh_session
+        published = temp_dir / "published"
+        mock_zenoh_session.put.side_effect = lambda key, payload: published.touch()
+        write_service(temp_dir / "a", "service-a", ["api"])
+        write_service(temp_dir / "b", "service-b", ["worker"])
+        build_commands["api"] = "echo built api"
+        # only finishes once service-a has been published
+        build_commands["worker"] = f"while [ ! -f {published} ]; do sleep 0.05; done"
+
+        keys = asyncio.run(deploy_services_async(local_args, [str(temp_dir / "a"), str(temp_dir / "b")],
+                                                 "linux/amd64", "testuser", False,
+                                                 DeployOptions(jobs=2, image_timeout=10)))
+
+        assert keys == ["colmena_service_definitions/service-a", "colmena_service_definitions/service-b"]
+        mock_zenoh_open.assert_called_once()
+        mock_zenoh_session.close.assert_called_once()
+
+    @pytest.mark.unit
+    def test_first_failure_cancels_other_builds(self, temp_dir, build_commands, local_args,
+                                                mock_zenoh_open, mock_zenoh_session, write_service):
+        """Test that a failed build terminates the running ones and publishes nothing."""
+        mock_zenoh_open.return_value = mock_zenoh_session
+        write_service(temp_dir / "a", "service-a", ["api", "worker"])
+        build_commands["api"] = "exit 3"
+        build_commands["worker"] = "exec sleep 30"
+        started = time.monotonic()
+
+        with pytest.raises(subprocess.CalledProcessError):
+            asyncio.run(deploy_services_async(local_args, [str(temp_dir / "a")], "linux/amd64", "testuser",
+                                              False, DeployOptions(jobs=2)))
+
+        assert time.monotonic() - started < 5
+        mock_zenoh_session.put.assert_not_called()
+        mock_zenoh_session.close.assert_called_once()
+
+    @pytest.mark.unit
+    def test_keep_going_publishes_the_other_services(self, temp_dir, build_commands, local_args,
+                                                     mock_zenoh_open, mock_zenoh_session, write_service):
+        """Test that with keep_going the services whose images built are still published."""
+        mock_zenoh_open.return_value = mock_zenoh_session
+        write_service(temp_dir / "a", "service-a", ["api"])
+        write_service(temp_dir / "b", "service-b", ["worker"])
+        build_commands["api"] = "exit 3"
+        build_commands["worker"] = "true"
+
+        with pytest.raises(BuildError) as error:
+            asyncio.run(deploy_services_async(local_args, [str(temp_dir / "a"), str(temp_dir / "b")],
+                                              "linux/amd64", "testuser", False, DeployOptions(keep_going=True)))
+
+        assert list(error.value.failures) == ["testuser/api"]
+        keys = [call[0][0] for call in mock_zenoh_session.put.call_args_list]
+        assert keys == ["colmena_service_definitions/service-b"]
+
+    @pytest.mark.unit
+    def test_rejects_options_the_pipeline_cannot_honor(self, temp_dir, local_args, mock_zenoh_open, write_service):
+        """Test that bake is refused before anything is built or published."""
+        write_service(temp_dir / "a", "service-a", ["api"])
+
+        with pytest.raises(ValueError, match="cannot bake"):
+            asyncio.run(deploy_services_async(local_args, [str(temp_dir / "a")], "linux/amd64", "testuser",
+                                              False, DeployOptions(bake=True)))
+
+        mock_zenoh_open.assert_not_called()
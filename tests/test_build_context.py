@@ -0,0 +1,118 @@
+"""Tests for the build_context module."""
+
+from unittest.mock import patch
+
+import pytest
+
+from deployment.build_context import analyze_context, copy_sources, warn_large_contexts, write_dockerignore
+from deployment.build_image import Image
+from deployment.build_manifest import BuildManifest, context_digest
+from deployment.dockerignore import DockerIgnore
+
+
+@pytest.fixture
+def role_dir(temp_dir):
+    """Create a role context with sources, a large unused directory and a Dockerfile copying the sources."""
+    role_dir = temp_dir / "worker"
+    (role_dir / "src").mkdir(parents=True)
+    (role_dir / "weights").mkdir()
+    (role_dir / "Dockerfile").write_text("FROM python:3.11-slim\n"
+                                         "COPY --chown=app requirements.txt /app/\n"
+                                         "COPY [\"src\", \"/app/src\"]\n"
+                                         "COPY --from=builder /out /out\n"
+                                         "ADD https://example.com/model.bin /models/\n")
+    (role_dir / "requirements.txt").write_text("numpy\n")
+    (role_dir / "src" / "main.py").write_text("print('hello')\n")
+    (role_dir / "weights" / "model.bin").write_bytes(b"\0" * 4096)
+    return role_dir
+
+
+class TestCopySources:
+    """Test reading the context paths a Dockerfile copies."""
+
+    @pytest.mark.unit
+    def test_sources(self, role_dir):
+        """Test that stage, URL and option arguments are not context sources."""
+        assert copy_sources(str(role_dir / "Dockerfile")) == ["requirements.txt", "src"]
+
+    @pytest.mark.unit
+    def test_whole_context(self, temp_dir):
+        """Test that copying the context root or a variable path cannot be minimized."""
+        (temp_dir / "Dockerfile").write_text("FROM alpine\nCOPY . /app\n")
+        assert copy_sources(str(temp_dir / "Dockerfile")) is None
+
+        (temp_dir / "Dockerfile").write_text("FROM alpine\nARG DIR=src\nCOPY ${DIR} /app\n")
+        assert copy_sources(str(temp_dir / "Dockerfile")) is None
+
+
+class TestContextReport:
+    """Test measuring build contexts."""
+
+    @pytest.mark.unit
+    def test_unused_files(self, role_dir):
+        """Test that files never copied are reported per top-level entry."""
+        report = analyze_context(Image(tag="user/worker", id="worker", path=str(role_dir)))
+
+        assert report.files == 4
+        assert report.unused == {"weights": 4096}
+        assert report.size == report.used_size + 4096
+        assert report.missing == []
+        assert "unused weights: 4.0 KB" in report.describe()
+
+    @pytest.mark.unit
+    def test_missing_source(self, role_dir):
+        """Test that a copied file excluded by the .dockerignore is reported."""
+        (role_dir / ".dockerignore").write_text("*.txt\n")
+
+        report = analyze_context(Image(tag="user/worker", id="worker", path=str(role_dir)))
+
+        assert report.missing == ["requirements.txt"]
+
+    @pytest.mark.unit
+    def test_warn_large_contexts(self, role_dir, capsys):
+        """Test that only contexts above the limit are reported."""
+        image = Image(tag="user/worker", id="worker", path=str(role_dir))
+
+        warn_large_contexts([image], limit=1 << 20)
+        assert capsys.readouterr().out == ""
+
+        warn_large_contexts([image], limit=1024)
+        assert "warning: large build context" in capsys.readouterr().out
+
+    @pytest.mark.unit
+    def test_reuses_the_files_hashed(self, role_dir, temp_dir):
+        """Test that the context listing collected while hashing gives the same report without a walk."""
+        image = Image(tag="user/worker", id="worker", path=str(role_dir))
+        manifest = BuildManifest(str(temp_dir / "manifest.json"))
+        manifest.outdated([image], "linux/amd64")
+
+        with patch.object(DockerIgnore, "walk", side_effect=AssertionError("walked again")):
+            report = analyze_context(image, manifest.contexts[image.tag])
+
+        assert report == analyze_context(image)
+
+
+class TestWriteDockerignore:
+    """Test generating a minimal .dockerignore."""
+
+    @pytest.mark.unit
+    def test_generated_dockerignore_only_sends_sources(self, role_dir):
+        """Test that the generated file leaves the unused files out of the context and its digest."""
+        image = Image(tag="user/worker", id="worker", path=str(role_dir))
+
+        assert write_dockerignore(image) == str(role_dir / ".dockerignore")
+
+        report = analyze_context(image)
+        assert report.unused == {}
+        assert report.files == 4
+        digest = context_digest(image, "linux/amd64")
+        (role_dir / "weights" / "model.bin").write_bytes(b"\1" * 4096)
+        assert context_digest(image, "linux/amd64") == digest
+
+    @pytest.mark.unit
+    def test_existing_dockerignore_is_kept(self, role_dir):
+        """Test that a hand-written .dockerignore is never overwritten."""
+        (role_dir / ".dockerignore").write_text("weights\n")
+
+        assert write_dockerignore(Image(tag="user/worker", id="worker", path=str(role_dir))) is None
+        assert (role_dir / ".dockerignore").read_text() == "weights\n"
@@ -1,15 +1,26 @@
 """Tests for the build_image module."""
 
+import json
 import os
+import subprocess
+import threading
+import time
 from unittest.mock import Mock, patch
 
 import pytest
 
 from deployment.build_image import (
+    BuildError,
+    CacheConfig,
     Image,
+    bake_definition,
     build_container_images,
+    docker_platform_build_command,
+    imagetools_create_command,
     publish_container_images,
 )
+from deployment.executor import RetryPolicy
+from deployment.registry import RemoteImage
 
 
 class TestImage:
@@ -33,13 +44,13 @@ class TestBuildContainerImages:
         
         build_container_images(images, "linux/amd64", False)
         
-        mock_subprocess.check_output.assert_called_once()
-        call_args = mock_subprocess.check_output.call_args[0][0]
+        mock_subprocess.Popen.assert_called_once()
+        call_args = " ".join(mock_subprocess.Popen.call_args[0][0])
         assert "docker buildx build" in call_args
         assert "--platform linux/amd64" in call_args
         assert "--load" not in call_args
         assert "-t test/image" in call_args
-        assert "--no-cache" in call_args
+        assert "--no-cache" not in call_args
         assert mock_os_environ["DOCKER_BUILDKIT"] == "1"
 
     @pytest.mark.unit
@@ -49,12 +60,12 @@ class TestBuildContainerImages:
         
         build_container_images(images, "linux/amd64", True)
         
-        mock_subprocess.check_output.assert_called_once()
-        call_args = mock_subprocess.check_output.call_args[0][0]
+        mock_subprocess.Popen.assert_called_once()
+        call_args = " ".join(mock_subprocess.Popen.call_args[0][0])
         assert "docker buildx build" in call_args
         assert "--load" in call_args
         assert "-t test/image" in call_args
-        assert "--no-cache" in call_args
+        assert "--no-cache" not in call_args
         assert "--platform linux/amd64" not in call_args
         assert mock_os_environ["DOCKER_BUILDKIT"] == "1"
 
@@ -68,17 +79,131 @@ class TestBuildContainerImages:
         
         build_container_images(images, "linux/amd64", False)
         
-        assert mock_subprocess.check_output.call_count == 2
+        assert mock_subprocess.Popen.call_count == 2
 
     @pytest.mark.unit
     def test_build_container_images_subprocess_error(self, mock_subprocess):
         """Test handling of subprocess errors during build."""
-        mock_subprocess.check_output.side_effect = Exception("Build failed")
+        mock_subprocess.Popen.side_effect = Exception("Build failed")
         images = [Image(tag="test/image", id="test", path="/test/path")]
         
         with pytest.raises(Exception, match="Build failed"):
             build_container_images(images, "linux/amd64", False)
 
+    @pytest.mark.unit
+    def test_build_container_images_streams_prefixed_output(self, mock_subprocess, capsys):
+        """Test that build output is streamed line by line with the image id as prefix."""
+        mock_subprocess.Popen.return_value.stdout = ["#1 load build definition\n", "#2 DONE\n"]
+        images = [Image(tag="test/image", id="worker", path="/test/path")]
+
+        build_container_images(images, "linux/amd64", False)
+
+        output = capsys.readouterr().out
+        assert "[worker] #1 load build definition" in output
+        assert "[worker] #2 DONE" in output
+
+    @pytest.mark.unit
+    def test_build_container_images_nonzero_exit(self, mock_os_environ):
+        """Test that a failing docker command raises CalledProcessError."""
+        images = [Image(tag="test/image", id="test", path="/test/path")]
+
+        with patch('deployment.build_image.subprocess.Popen') as mock_popen:
+            mock_popen.return_value.stdout = []
+            mock_popen.return_value.wait.return_value = 1
+
+            with pytest.raises(subprocess.CalledProcessError):
+                build_container_images(images, "linux/amd64", False)
+
+    @pytest.mark.unit
+    def test_build_container_images_fail_fast(self, mock_subprocess):
+        """Test that the first failure stops the images that have not started yet."""
+        mock_subprocess.Popen.side_effect = [Exception("Build failed"), Mock()]
+        images = [
+            Image(tag="test/image1", id="test1", path="/test/path1"),
+            Image(tag="test/image2", id="test2", path="/test/path2")
+        ]
+
+        with pytest.raises(Exception, match="Build failed"):
+            build_container_images(images, "linux/amd64", False, jobs=1)
+
+        assert mock_subprocess.Popen.call_count == 1
+
+    @pytest.mark.unit
+    def test_build_container_images_keep_going(self, mock_subprocess):
+        """Test that keep-going mode builds every image and reports all failures."""
+        process = Mock()
+        process.stdout = []
+        process.wait.return_value = 0
+        mock_subprocess.Popen.side_effect = [Exception("Build failed"), process, Exception("Push failed")]
+        images = [
+            Image(tag="test/image1", id="test1", path="/test/path1"),
+            Image(tag="test/image2", id="test2", path="/test/path2"),
+            Image(tag="test/image3", id="test3", path="/test/path3")
+        ]
+
+        with pytest.raises(BuildError) as error:
+            build_container_images(images, "linux/amd64", False, jobs=1, keep_going=True)
+
+        assert mock_subprocess.Popen.call_count == 3
+        assert set(error.value.failures) == {"test/image1", "test/image3"}
+
+    @pytest.mark.unit
+    def test_build_container_images_parallel(self, mock_subprocess):
+        """Test that images are built concurrently up to the jobs limit."""
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def wait():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.pop()
+            return 0
+
+        mock_subprocess.Popen.return_value.wait.side_effect = wait
+        images = [Image(tag=f"test/image{i}", id=f"test{i}", path=f"/test/path{i}") for i in range(4)]
+
+        build_container_images(images, "linux/amd64", False, jobs=2)
+
+        assert mock_subprocess.Popen.call_count == 4
+        assert max(peak) == 2
+
+    @pytest.mark.unit
+    def test_transient_push_failure_is_retried(self, mock_subprocess):
+        """Test that only the image whose push hit a registry error is built again."""
+        flaky = Mock()
+        flaky.stdout = ["error: failed to push test/image2: 502 Bad Gateway\n"]
+        flaky.wait.return_value = 1
+        mock_subprocess.Popen.side_effect = [mock_subprocess.Popen.return_value, flaky,
+                                             mock_subprocess.Popen.return_value]
+        built = []
+        images = [
+            Image(tag="test/image1", id="test1", path="/test/path1"),
+            Image(tag="test/image2", id="test2", path="/test/path2")
+        ]
+
+        build_container_images(images, "linux/amd64", False, on_built=built.append,
+                               retry=RetryPolicy(retries=1, backoff=0.01))
+
+        tags = [call[0][0][call[0][0].index("-t") + 1] for call in mock_subprocess.Popen.call_args_list]
+        assert tags == ["test/image1", "test/image2", "test/image2"]
+        assert [result.image for result in built] == images
+
+    @pytest.mark.unit
+    def test_build_errors_are_not_retried(self, mock_subprocess):
+        """Test that a failure without a registry error fails the build on the first attempt."""
+        mock_subprocess.Popen.return_value.stdout = ["COPY failed: file not found\n"]
+        mock_subprocess.Popen.return_value.wait.return_value = 1
+        images = [Image(tag="test/image", id="test", path="/test/path")]
+
+        with pytest.raises(subprocess.CalledProcessError):
+            build_container_images(images, "linux/amd64", False, retry=RetryPolicy(retries=3, backoff=0.01))
+
+        assert mock_subprocess.Popen.call_count == 1
+
 
 class TestPublishContainerImages:
     """Test container image publishing functionality."""
@@ -90,9 +215,9 @@ class TestPublishContainerImages:
         
         publish_container_images(images)
         
-        mock_subprocess.check_output.assert_called_once()
-        call_args = mock_subprocess.check_output.call_args[0][0]
-        assert call_args == "docker image push test/image"
+        mock_subprocess.Popen.assert_called_once()
+        call_args = mock_subprocess.Popen.call_args[0][0]
+        assert call_args == ["docker", "image", "push", "test/image"]
         assert mock_os_environ["DOCKER_BUILDKIT"] == "1"
 
     @pytest.mark.unit
@@ -105,13 +230,257 @@ class TestPublishContainerImages:
         
         publish_container_images(images)
         
-        assert mock_subprocess.check_output.call_count == 2
+        assert mock_subprocess.Popen.call_count == 2
 
     @pytest.mark.unit
     def test_publish_container_images_subprocess_error(self, mock_subprocess):
         """Test handling of subprocess errors during publish."""
-        mock_subprocess.check_output.side_effect = Exception("Push failed")
+        mock_subprocess.Popen.side_effect = Exception("Push failed")
         images = [Image(tag="test/image", id="test", path="/test/path")]
         
         with pytest.raises(Exception, match="Push failed"):
             publish_container_images(images)
+
+
+class TestCacheConfig:
+    """Test BuildKit cache arguments."""
+
+    @pytest.mark.unit
+    def test_builder_mode_has_no_arguments(self):
+        """Test that the default mode relies on the builder's own cache."""
+        image = Image(tag="test/image", id="worker", path="/test/path")
+        assert CacheConfig().cache_args(image) == []
+
+    @pytest.mark.unit
+    def test_no_cache_opt_in(self):
+        """Test that --no-cache is only passed when requested."""
+        image = Image(tag="test/image", id="worker", path="/test/path")
+        config = CacheConfig(mode="registry", location="user/cache", no_cache=True)
+        assert config.cache_args(image) == ["--no-cache"]
+
+    @pytest.mark.unit
+    def test_local_mode(self):
+        """Test local cache directories namespaced by service and image id."""
+        image = Image(tag="test/image", id="worker", path="/test/path", service="my-service")
+        config = CacheConfig(mode="local", location="/cache")
+        assert config.cache_args(image) == [
+            "--cache-from", "type=local,src=/cache/my-service/worker",
+            "--cache-to", "type=local,dest=/cache/my-service/worker,mode=max",
+        ]
+
+    @pytest.mark.unit
+    def test_registry_mode(self):
+        """Test registry cache references with a sanitized tag."""
+        image = Image(tag="test/image", id="worker/1", path="/test/path", service="other")
+        config = CacheConfig(mode="registry", location="user/cache", namespace="svc")
+        assert config.cache_args(image) == [
+            "--cache-from", "type=registry,ref=user/cache:svc-worker-1",
+            "--cache-to", "type=registry,ref=user/cache:svc-worker-1,mode=max",
+        ]
+
+    @pytest.mark.unit
+    def test_cache_arguments_in_build_command(self, mock_subprocess):
+        """Test that cache arguments reach the docker build command."""
+        images = [Image(tag="test/image", id="worker", path="/test/path")]
+
+        build_container_images(images, "linux/arm64", False,
+                               cache=CacheConfig(mode="local", location="/cache", namespace="svc"))
+
+        call_args = " ".join(mock_subprocess.Popen.call_args[0][0])
+        assert "--cache-from type=local,src=/cache/svc/worker" in call_args
+        assert "--no-cache" not in call_args
+
+
+class TestBake:
+    """Test building all images with docker buildx bake."""
+
+    @pytest.mark.unit
+    def test_bake_definition(self):
+        """Test one bake target per image with platforms, push output and cache."""
+        images = [
+            Image(tag="user/worker", id="worker", path="/build/worker"),
+            Image(tag="user/ctx", id="shared.context", path="/build/context/shared.context")
+        ]
+        cache = CacheConfig(mode="local", location="/cache", namespace="svc")
+
+        definition = bake_definition(images, "linux/amd64,linux/arm64", False, cache)
+
+        assert definition["group"]["default"]["targets"] == ["worker", "shared_context"]
+        worker = definition["target"]["worker"]
+        assert worker["context"] == "/build/worker"
+        assert worker["tags"] == ["user/worker"]
+        assert worker["platforms"] == ["linux/amd64", "linux/arm64"]
+        assert worker["output"] == ["type=registry"]
+        assert worker["cache-from"] == ["type=local,src=/cache/svc/worker"]
+        assert "no-cache" not in worker
+
+    @pytest.mark.unit
+    def test_bake_definition_local_debug_no_cache(self):
+        """Test that local debug loads the images and no_cache is forwarded."""
+        images = [Image(tag="user/worker", id="worker", path="/build/worker")]
+
+        target = bake_definition(images, "linux/amd64", True, CacheConfig(no_cache=True))["target"]["worker"]
+
+        assert target["output"] == ["type=docker"]
+        assert target["no-cache"] is True
+        assert "platforms" not in target
+
+    @pytest.mark.unit
+    def test_build_container_images_bake(self, mock_subprocess, mock_os_environ):
+        """Test that bake mode runs a single docker buildx bake for every image."""
+        definitions = []
+
+        def popen(command, **kwargs):
+            with open(command[command.index("-f") + 1]) as f:
+                definitions.append(json.load(f))
+            return mock_subprocess.Popen.return_value
+
+        mock_subprocess.Popen.side_effect = popen
+        built = []
+        images = [
+            Image(tag="test/image1", id="test1", path="/test/path1"),
+            Image(tag="test/image2", id="test2", path="/test/path2")
+        ]
+
+        build_container_images(images, "linux/amd64", False, on_built=built.append, bake=True)
+
+        assert mock_subprocess.Popen.call_count == 1
+        assert mock_subprocess.Popen.call_args[0][0][:4] == ["docker", "buildx", "bake", "-f"]
+        assert set(definitions[0]["target"]) == {"test1", "test2"}
+        assert [result.image for result in built] == images
+
+    @pytest.mark.unit
+    def test_builder_is_passed_explicitly(self, mock_subprocess, mock_os_environ):
+        """Test that the builder is given to bake and build instead of being read from the environment."""
+        images = [Image(tag="test/image1", id="test1", path="/test/path1")]
+
+        build_container_images(images, "linux/amd64", False, bake=True, builder="pool")
+        build_container_images(images, "linux/amd64", False, builder="pool")
+
+        bake, build = [call[0][0] for call in mock_subprocess.Popen.call_args_list]
+        assert bake[:5] == ["docker", "buildx", "bake", "--builder", "pool"]
+        assert build[:5] == ["docker", "buildx", "build", "--builder", "pool"]
+        assert "BUILDX_BUILDER" not in mock_os_environ
+
+
+class TestDependencies:
+    """Test building images after the images they build from."""
+
+    @pytest.mark.unit
+    def test_child_starts_after_parent(self, mock_subprocess):
+        """Test that an image is only built once its parent is pushed, even with free jobs."""
+        started = []
+
+        def popen(command, **kwargs):
+            started.append(command[command.index("-t") + 1])
+            return mock_subprocess.Popen.return_value
+
+        mock_subprocess.Popen.side_effect = popen
+        images = [Image(tag="test/app", id="app", path="/test/app"),
+                  Image(tag="test/base", id="base", path="/test/base")]
+
+        build_container_images(images, "linux/amd64", False, jobs=4,
+                               dependencies={"test/app": ["test/base"], "test/base": []})
+
+        assert started == ["test/base", "test/app"]
+
+    @pytest.mark.unit
+    def test_child_not_built_when_parent_fails(self, mock_subprocess):
+        """Test that keep-going mode reports the images of a failed parent without building them."""
+        mock_subprocess.Popen.side_effect = [Exception("Build failed"), mock_subprocess.Popen.return_value]
+        images = [Image(tag="test/base", id="base", path="/test/base"),
+                  Image(tag="test/app", id="app", path="/test/app"),
+                  Image(tag="test/other", id="other", path="/test/other")]
+
+        with pytest.raises(BuildError) as error:
+            build_container_images(images, "linux/amd64", False, keep_going=True,
+                                   dependencies={"test/app": ["test/base"]})
+
+        assert mock_subprocess.Popen.call_count == 2
+        assert set(error.value.failures) == {"test/base", "test/app"}
+        assert "test/base failed to build" in str(error.value.failures["test/app"])
+
+    @pytest.mark.unit
+    def test_bake_definition_contexts(self, temp_dir):
+        """Test that bake resolves the parent image, as the Dockerfile spells it, to its own target."""
+        for name, dockerfile in (("base", "FROM alpine\n"), ("app", "FROM docker.io/user/base:latest\n")):
+            (temp_dir / name).mkdir()
+            (temp_dir / name / "Dockerfile").write_text(dockerfile)
+        images = [Image(tag="user/base", id="base", path=str(temp_dir / "base")),
+                  Image(tag="user/app", id="app", path=str(temp_dir / "app"))]
+
+        definition = bake_definition(images, "linux/amd64", False, dependencies={"user/app": ["user/base"]})
+
+        assert definition["target"]["app"]["contexts"] == {"docker.io/user/base:latest": "target:base"}
+        assert "contexts" not in definition["target"]["base"]
+
+
+class TestSplitPlatforms:
+    """Test building each platform of an image separately."""
+
+    @pytest.mark.unit
+    def test_platform_build_command_pushes_by_digest(self):
+        """Test that a platform build is routed to its builder, pushed untagged and cached apart."""
+        image = Image(tag="test/image", id="test", path="/test/path", service="svc")
+        cache = CacheConfig(mode="registry", location="test/cache")
+
+        command = docker_platform_build_command(image, "linux/arm64", cache, "/tmp/meta.json", "arm-node")
+
+        assert command[:7] == ["docker", "buildx", "build", "--builder", "arm-node", "-f", "/test/path/Dockerfile"]
+        assert command[command.index("--cache-from") + 1] == "type=registry,ref=test/cache:svc-test-linux-arm64"
+        assert command[command.index("--platform") + 1] == "linux/arm64"
+        assert command[command.index("--output") + 1] == (
+            "type=image,name=test/image,push-by-digest=true,name-canonical=true,push=true")
+        assert "-t" not in command
+        assert command[-1] == "/test/path"
+
+    @pytest.mark.unit
+    def test_imagetools_create_command(self):
+        """Test that the pushed platforms are tagged as one manifest list."""
+        image = Image(tag="test/image", id="test", path="/test/path")
+
+        command = imagetools_create_command(image, ["sha256:aaa", "sha256:bbb"])
+
+        assert command == ["docker", "buildx", "imagetools", "create", "-t", "test/image",
+                           "test/image@sha256:aaa", "test/image@sha256:bbb"]
+
+    @pytest.mark.unit
+    def test_build_container_images_split_platforms(self, mock_subprocess, mock_os_environ):
+        """Test that every platform is built on its own and merged once all are pushed."""
+        commands = []
+
+        def popen(command, **kwargs):
+            commands.append(command)
+            if "--metadata-file" in command:
+                metadata_file = command[command.index("--metadata-file") + 1]
+                platform = command[command.index("--platform") + 1]
+                with open(metadata_file, "w") as f:
+                    json.dump({"containerimage.digest": f"sha256:{platform.replace('/', '-')}"}, f)
+            return mock_subprocess.Popen.return_value
+
+        mock_subprocess.Popen.side_effect = popen
+        built = []
+        image = Image(tag="test/image", id="test", path="/test/path")
+
+        with patch("deployment.registry.inspect_remote", return_value=RemoteImage("sha256:list")):
+            results = build_container_images([image], "linux/amd64,linux/arm64", False, jobs=2,
+                                             on_built=built.append, split_platforms=True,
+                                             builders={"linux/arm64": "arm-node"})
+
+        builds = [" ".join(command) for command in commands if command[:3] == ["docker", "buildx", "build"]]
+        assert len(builds) == 2
+        assert any("--builder arm-node" in command and "--platform linux/arm64" in command for command in builds)
+        assert commands[-1] == ["docker", "buildx", "imagetools", "create", "-t", "test/image",
+                                "test/image@sha256:linux-amd64", "test/image@sha256:linux-arm64"]
+        assert results[0].digest == "sha256:list"
+        assert built == results
+
+    @pytest.mark.unit
+    def test_build_container_images_split_platforms_missing_digest(self, mock_subprocess):
+        """Test that platforms cannot be merged when buildx did not report their digest."""
+        image = Image(tag="test/image", id="test", path="/test/path")
+
+        with pytest.raises(RuntimeError):
+            build_container_images([image], "linux/amd64,linux/arm64", False, split_platforms=True)
+
+        assert mock_subprocess.Popen.call_count == 2
@@ -0,0 +1,122 @@
+"""Tests for the build_manifest and dockerignore modules."""
+
+import json
+
+import pytest
+
+from deployment.build_image import Image
+from deployment.build_manifest import MANIFEST_FILE, BuildManifest, context_digest
+from deployment.dockerignore import DockerIgnore
+
+
+@pytest.fixture
+def image_dir(temp_dir):
+    """Create a small role build context."""
+    role_dir = temp_dir / "worker"
+    role_dir.mkdir()
+    (role_dir / "Dockerfile").write_text("FROM python:3.11-slim\nCOPY . /app\n")
+    (role_dir / "main.py").write_text("print('hello')\n")
+    return role_dir
+
+
+class TestDockerIgnore:
+    """Test .dockerignore pattern matching."""
+
+    @pytest.mark.unit
+    def test_simple_patterns(self):
+        """Test wildcard patterns and parent directory matching."""
+        dockerignore = DockerIgnore(["*.pyc", "venv", "# comment", ""])
+        assert dockerignore.is_excluded("module.pyc")
+        assert not dockerignore.is_excluded("src/module.pyc")
+        assert dockerignore.is_excluded("venv/lib/site.py")
+        assert not dockerignore.is_excluded("main.py")
+
+    @pytest.mark.unit
+    def test_double_star_and_exceptions(self):
+        """Test ** patterns and ! exceptions, where the last match wins."""
+        dockerignore = DockerIgnore(["**/*.bin", "!models/keep.bin", "/data"])
+        assert dockerignore.is_excluded("weights.bin")
+        assert dockerignore.is_excluded("models/large.bin")
+        assert not dockerignore.is_excluded("models/keep.bin")
+        assert dockerignore.is_excluded("data/train.csv")
+
+    @pytest.mark.unit
+    def test_walk_skips_ignored_files(self, image_dir):
+        """Test that walk only yields the files sent to the builder."""
+        (image_dir / ".dockerignore").write_text("Dockerfile\nweights\n")
+        (image_dir / "weights").mkdir()
+        (image_dir / "weights" / "model.bin").write_bytes(b"\0" * 16)
+
+        files = list(DockerIgnore.from_context(str(image_dir)).walk(str(image_dir)))
+
+        assert files == [".dockerignore", "Dockerfile", "main.py"]
+
+
+class TestContextDigest:
+    """Test build context hashing."""
+
+    @pytest.mark.unit
+    def test_digest_changes_with_content_and_platform(self, image_dir):
+        """Test that the digest depends on file contents and platform."""
+        image = Image(tag="user/worker", id="worker", path=str(image_dir))
+        digest = context_digest(image, "linux/amd64")
+
+        assert digest.startswith("sha256:")
+        assert context_digest(image, "linux/amd64") == digest
+        assert context_digest(image, "linux/arm64") != digest
+
+        (image_dir / "main.py").write_text("print('bye')\n")
+        assert context_digest(image, "linux/amd64") != digest
+
+    @pytest.mark.unit
+    def test_digest_ignores_dockerignored_files(self, image_dir):
+        """Test that changes to ignored files keep the digest."""
+        (image_dir / ".dockerignore").write_text("*.log\n")
+        image = Image(tag="user/worker", id="worker", path=str(image_dir))
+        digest = context_digest(image, "linux/amd64")
+
+        (image_dir / "debug.log").write_text("noise")
+
+        assert context_digest(image, "linux/amd64") == digest
+
+
+class TestBuildManifest:
+    """Test the incremental build manifest."""
+
+    @pytest.mark.unit
+    def test_outdated_until_recorded(self, temp_dir, image_dir):
+        """Test that an image is skipped once it was recorded as pushed."""
+        image = Image(tag="user/worker", id="worker", path=str(image_dir))
+        manifest = BuildManifest.load(str(temp_dir))
+
+        assert manifest.outdated([image], "linux/amd64") == [image]
+        manifest.record(image)
+
+        reloaded = BuildManifest.load(str(temp_dir))
+        assert reloaded.outdated([image], "linux/amd64") == []
+        assert reloaded.outdated([image], "linux/arm64") == [image]
+
+        stored = json.loads((temp_dir / MANIFEST_FILE).read_text())
+        assert stored["images"]["user/worker"]["platform"] == "linux/amd64"
+
+    @pytest.mark.unit
+    def test_corrupt_manifest_is_ignored(self, temp_dir, image_dir):
+        """Test that an unreadable manifest rebuilds everything."""
+        (temp_dir / MANIFEST_FILE).write_text("not json")
+        image = Image(tag="user/worker", id="worker", path=str(image_dir))
+
+        assert BuildManifest.load(str(temp_dir)).outdated([image], "linux/amd64") == [image]
+
+    @pytest.mark.unit
+    def test_saves_are_coalesced(self, temp_dir, image_dir):
+        """Test that images recorded in quick succession are saved together on flush."""
+        images = [Image(tag=f"user/worker{i}", id=f"worker{i}", path=str(image_dir)) for i in range(3)]
+        manifest = BuildManifest.load(str(temp_dir))
+        manifest.outdated(images, "linux/amd64")
+
+        for each in images:
+            manifest.record(each)
+        assert list(json.loads((temp_dir / MANIFEST_FILE).read_text())["images"]) == ["user/worker0"]
+
+        manifest.flush()
+        assert len(json.loads((temp_dir / MANIFEST_FILE).read_text())["images"]) == 3
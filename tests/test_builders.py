@@ -0,0 +1,185 @@
+"""Tests for the builders module."""
+
+from unittest.mock import Mock, patch
+
+import pytest
+
+from deployment.builders import BuilderPool, BuilderSpec, inspect_builder
+
+INSPECT_OUTPUT = """Name:          {name}
+Driver:        docker-container
+Last Activity: 2025-01-01 10:00:00 +0000 UTC
+
+Nodes:
+Name:                  {name}0
+Endpoint:              unix:///var/run/docker.sock
+Status:                {status}
+BuildKit version:      v0.18.2
+Platforms:             {platforms}
+"""
+
+
+@pytest.fixture
+def stand_in_buildx():
+    """Stand-in docker CLI keeping the builders in a dict of name to (status, platforms)."""
+    builders = {}
+
+    def run(command, **kwargs):
+        args = command[1:]
+        if args[:2] == ["buildx", "inspect"] and args[2] != "--bootstrap":
+            if args[2] not in builders:
+                return Mock(returncode=1, stdout="", stderr=f"ERROR: no builder {args[2]} found")
+            status, platforms = builders[args[2]]
+            return Mock(returncode=0, stdout=INSPECT_OUTPUT.format(name=args[2], status=status, platforms=platforms),
+                        stderr="")
+        if args[:2] == ["buildx", "create"]:
+            builders[args[args.index("--name") + 1]] = ("running", "linux/amd64, linux/amd64/v2")
+        elif args[:3] == ["buildx", "inspect", "--bootstrap"]:
+            status, platforms = builders[args[3]]
+            builders[args[3]] = ("running", platforms)
+        elif args[:2] == ["buildx", "rm"]:
+            del builders[args[2]]
+        elif args[:2] == ["buildx", "stop"]:
+            builders[args[2]] = ("inactive", builders[args[2]][1])
+        elif args[0] == "run":
+            # emulators registered, builders started afterwards detect the platforms
+            for name, (status, platforms) in builders.items():
+                builders[name] = (status, platforms + ", linux/arm64")
+        return Mock(returncode=0, stdout="", stderr="")
+
+    with patch("deployment.builders.subprocess.run", side_effect=run) as mock_run:
+        mock_run.builders = builders
+        yield mock_run
+
+
+def _commands(mock_run):
+    return [" ".join(call[0][0][1:]) for call in mock_run.call_args_list]
+
+
+class TestInspectBuilder:
+    """Test reading the state of a builder."""
+
+    @pytest.mark.unit
+    def test_inspect_builder(self, stand_in_buildx):
+        """Test that the status and platforms of every node are read."""
+        stand_in_buildx.builders["colmena"] = ("running", "linux/amd64, linux/arm64/v8*, linux/arm/v7")
+
+        status = inspect_builder("colmena")
+
+        assert status.driver == "docker-container"
+        assert status.running
+        assert status.platforms == ["linux/amd64", "linux/arm64", "linux/arm/v7"]
+
+    @pytest.mark.unit
+    def test_inspect_missing_builder(self, stand_in_buildx):
+        """Test that unknown builders return None."""
+        assert inspect_builder("missing") is None
+
+
+class TestBuilderPool:
+    """Test creating, reusing and routing builders."""
+
+    @pytest.mark.unit
+    def test_buildkitd_config(self):
+        """Test that parallelism and GC policy are written to the BuildKit configuration."""
+        spec = BuilderSpec("colmena", parallelism=4, gc_keep_storage_mb=20000)
+
+        assert spec.buildkitd_config() == ("[worker.oci]\n  max-parallelism = 4\n"
+                                           "  gc = true\n  gckeepstorage = 20000\n")
+        assert BuilderSpec("colmena").buildkitd_config() == ""
+
+    @pytest.mark.unit
+    def test_creates_missing_builder(self, stand_in_buildx):
+        """Test that a missing builder is created with its configuration."""
+        BuilderPool([BuilderSpec("colmena", parallelism=4)]).ensure(["linux/amd64"])
+
+        [create] = [command for command in _commands(stand_in_buildx) if command.startswith("buildx create")]
+        assert "--name colmena --driver docker-container --buildkitd-config" in create
+        assert create.endswith("--bootstrap")
+
+    @pytest.mark.unit
+    def test_reuses_running_builder(self, stand_in_buildx):
+        """Test that a healthy builder is used as is."""
+        stand_in_buildx.builders["colmena"] = ("running", "linux/amd64")
+
+        routes = BuilderPool([BuilderSpec("colmena")]).ensure(["linux/amd64"])
+
+        assert routes == {"linux/amd64": "colmena"}
+        assert _commands(stand_in_buildx) == ["buildx inspect colmena"]
+
+    @pytest.mark.unit
+    def test_bootstraps_stopped_builder(self, stand_in_buildx):
+        """Test that a stopped builder is started instead of created again."""
+        stand_in_buildx.builders["colmena"] = ("inactive", "linux/amd64")
+
+        BuilderPool([BuilderSpec("colmena")]).ensure(["linux/amd64"])
+
+        commands = _commands(stand_in_buildx)
+        assert "buildx inspect --bootstrap colmena" in commands
+        assert not any(command.startswith("buildx create") for command in commands)
+
+    @pytest.mark.unit
+    def test_recreates_broken_builder(self, stand_in_buildx):
+        """Test that a builder in error is removed and created again."""
+        stand_in_buildx.builders["colmena"] = ("error", "")
+
+        BuilderPool([BuilderSpec("colmena")]).ensure(["linux/amd64"])
+
+        commands = _commands(stand_in_buildx)
+        assert commands.index("buildx rm colmena") < [command.startswith("buildx create")
+                                                       for command in commands].index(True)
+
+    @pytest.mark.unit
+    def test_emulators_only_when_needed(self, stand_in_buildx):
+        """Test that emulators are registered for platforms the builder cannot build."""
+        stand_in_buildx.builders["colmena"] = ("running", "linux/amd64")
+
+        BuilderPool([BuilderSpec("colmena")]).ensure(["linux/amd64", "linux/arm64"])
+
+        commands = _commands(stand_in_buildx)
+        assert "run --rm --privileged tonistiigi/binfmt --install arm64" in commands
+        assert commands[-2:] == ["buildx stop colmena", "buildx inspect --bootstrap colmena"]
+
+    @pytest.mark.unit
+    def test_emulator_failure_is_not_fatal(self, stand_in_buildx, capsys):
+        """Test that a failed emulator registration only warns and leaves the builder alone."""
+        stand_in_buildx.builders["colmena"] = ("running", "linux/amd64")
+        run = stand_in_buildx.side_effect
+
+        def unprivileged(command, **kwargs):
+            if command[1] == "run":
+                return Mock(returncode=1, stdout="", stderr="permission denied")
+            return run(command, **kwargs)
+
+        stand_in_buildx.side_effect = unprivileged
+
+        routes = BuilderPool([BuilderSpec("colmena")]).ensure(["linux/amd64", "linux/arm64"])
+
+        assert routes == {"linux/amd64": "colmena", "linux/arm64": "colmena"}
+        assert "warning: could not register emulators for arm64: permission denied" in capsys.readouterr().out
+        assert "buildx stop colmena" not in _commands(stand_in_buildx)
+
+    @pytest.mark.unit
+    def test_routes_platforms_to_native_nodes(self, stand_in_buildx):
+        """Test that a platform goes to the builder configured for it, the rest to the default one."""
+        stand_in_buildx.builders["colmena"] = ("running", "linux/amd64")
+        stand_in_buildx.builders["arm-node"] = ("running", "linux/arm64")
+        pool = BuilderPool([BuilderSpec("colmena"),
+                            BuilderSpec("arm-node", ["linux/arm64/v8"], endpoint="ssh://arm-host")])
+
+        routes = pool.ensure(["linux/amd64", "linux/arm64"])
+
+        assert routes == {"linux/amd64": "colmena", "linux/arm64": "arm-node"}
+        assert not any(command.startswith("run ") for command in _commands(stand_in_buildx))
+
+    @pytest.mark.unit
+    def test_load_pool(self, temp_dir):
+        """Test reading a pool from a JSON file."""
+        pool_file = temp_dir / "builders.json"
+        pool_file.write_text('[{"name": "colmena", "parallelism": 2},'
+                             ' {"name": "arm-node", "platforms": ["linux/arm64"], "endpoint": "ssh://arm-host"}]')
+
+        pool = BuilderPool.load(str(pool_file))
+
+        assert pool.default == BuilderSpec("colmena", parallelism=2)
+        assert pool.specs[1].endpoint == "ssh://arm-host"
@@ -2,6 +2,8 @@
 
 import json
 import os
+import subprocess
+import sys
 from pathlib import Path
 from unittest.mock import Mock, patch
 
@@ -9,9 +11,15 @@ import pytest
 
 from deployment.colmena_deploy import (
     deploy_service,
+    deploy_services,
+    expand_build_paths,
+    plan_deployment,
     publish_service_definition,
 )
 from deployment.build_image import Image
+from deployment.metrics import MetricsRecorder
+from deployment.options import DeployOptions
+from deployment.service_loader import ServiceDefinitionError
 
 
 class TestPublishServiceDefinition:
@@ -53,10 +61,9 @@ class TestDeployService:
         mock_zenoh_open.return_value = mock_zenoh_session
         
         # Create required directories
-        (temp_dir / "worker").mkdir()
-        (temp_dir / "manager").mkdir()
-        (temp_dir / "context").mkdir()
-        (temp_dir / "context" / "shared-context").mkdir()
+        for path in ("worker", "manager", "context/shared-context"):
+            (temp_dir / path).mkdir(parents=True)
+            (temp_dir / path / "Dockerfile").write_text("FROM alpine\n")
         
         args = Mock()
         args.local_debug = False
@@ -64,9 +71,53 @@ class TestDeployService:
         deploy_service(args, str(temp_dir), "linux/amd64", "testuser", False)
         
         # Verify images were built and published
-        assert mock_subprocess.check_output.call_count >= 3  # At least 3 images
+        assert mock_subprocess.Popen.call_count >= 3  # At least 3 images
         mock_zenoh_session.put.assert_called_once()
 
+    @pytest.mark.unit
+    def test_deploy_service_skips_unchanged_images(self, temp_dir, sample_service_json_file,
+                                                   mock_subprocess, mock_zenoh_open, mock_zenoh_session):
+        """Test that a second deployment only rebuilds images whose context changed."""
+        mock_zenoh_open.return_value = mock_zenoh_session
+        for path in ("worker", "manager", "context/shared-context"):
+            (temp_dir / path).mkdir(parents=True)
+            (temp_dir / path / "Dockerfile").write_text("FROM alpine\n")
+
+        args = Mock()
+        args.local_debug = False
+
+        deploy_service(args, str(temp_dir), "linux/amd64", "testuser", False)
+        assert mock_subprocess.Popen.call_count == 3
+
+        (temp_dir / "worker" / "Dockerfile").write_text("FROM alpine:3.20\n")
+        deploy_service(args, str(temp_dir), "linux/amd64", "testuser", False)
+        assert mock_subprocess.Popen.call_count == 4
+        assert "-t testuser/worker-image" in " ".join(mock_subprocess.Popen.call_args[0][0])
+
+        deploy_service(args, str(temp_dir), "linux/amd64", "testuser", False, DeployOptions(force_build=True))
+        assert mock_subprocess.Popen.call_count == 7
+
+    @pytest.mark.unit
+    def test_deploy_service_records_forced_builds(self, temp_dir, sample_service_json_file,
+                                                  mock_subprocess, mock_zenoh_open, mock_zenoh_session):
+        """Test that a context reverted after a forced build is built again."""
+        mock_zenoh_open.return_value = mock_zenoh_session
+        for path in ("worker", "manager", "context/shared-context"):
+            (temp_dir / path).mkdir(parents=True)
+            (temp_dir / path / "Dockerfile").write_text("FROM alpine\n")
+        args = Mock()
+        args.local_debug = False
+
+        deploy_service(args, str(temp_dir), "linux/amd64", "testuser", False)
+        (temp_dir / "worker" / "Dockerfile").write_text("FROM alpine:3.20\n")
+        deploy_service(args, str(temp_dir), "linux/amd64", "testuser", False, DeployOptions(force_build=True))
+        assert mock_subprocess.Popen.call_count == 6
+
+        (temp_dir / "worker" / "Dockerfile").write_text("FROM alpine\n")
+        deploy_service(args, str(temp_dir), "linux/amd64", "testuser", False)
+        assert mock_subprocess.Popen.call_count == 7
+        assert "-t testuser/worker-image" in " ".join(mock_subprocess.Popen.call_args[0][0])
+
     @pytest.mark.unit
     def test_deploy_service_skip_build(self, temp_dir, sample_service_json_file,
                                      mock_zenoh_open, mock_zenoh_session):
@@ -87,7 +138,7 @@ class TestDeployService:
         args = Mock()
         args.local_debug = False
         
-        with pytest.raises(FileNotFoundError):
+        with pytest.raises(ServiceDefinitionError, match="service_description.json: not found"):
             deploy_service(args, str(temp_dir), "linux/amd64", "testuser", False)
 
     @pytest.mark.unit
@@ -99,7 +150,7 @@ class TestDeployService:
         args = Mock()
         args.local_debug = False
         
-        with pytest.raises(json.JSONDecodeError):
+        with pytest.raises(ServiceDefinitionError, match="invalid JSON at line 1 column 1"):
             deploy_service(args, str(temp_dir), "linux/amd64", "testuser", False)
 
     @pytest.mark.unit
@@ -123,3 +174,157 @@ class TestDeployService:
         
         for context in published_definition["dockerContextDefinitions"]:
             assert context["imageId"].startswith("testuser/")
+
+
+class TestDeployServices:
+    """Test deploying several services at once."""
+
+    @pytest.mark.unit
+    def test_deploy_services_shares_images_and_session(self, temp_dir, mock_subprocess,
+                                                       mock_zenoh_open, mock_zenoh_session, write_service):
+        """Test that shared images are built once and all services use one session."""
+        mock_zenoh_open.return_value = mock_zenoh_session
+        write_service(temp_dir / "a", "service-a", [("api", "api"), ("base", "common-base")])
+        write_service(temp_dir / "b", "service-b", [("worker", "worker"), ("base", "common-base")])
+        args = Mock()
+        args.local_debug = False
+
+        deploy_services(args, [str(temp_dir / "a"), str(temp_dir / "b")], "linux/amd64", "testuser",
+                        False, DeployOptions(jobs=2))
+
+        commands = [" ".join(call[0][0]) for call in mock_subprocess.Popen.call_args_list]
+        assert len(commands) == 3
+        assert sum("-t testuser/common-base" in command for command in commands) == 1
+        mock_zenoh_open.assert_called_once()
+        keys = [call[0][0] for call in mock_zenoh_session.put.call_args_list]
+        assert keys == ["colmena_service_definitions/service-a", "colmena_service_definitions/service-b"]
+
+    @pytest.mark.unit
+    def test_deploy_services_parses_everything_before_building(self, temp_dir, mock_subprocess, write_service):
+        """Test that a broken description fails before any image is built."""
+        write_service(temp_dir / "a", "service-a", [("api", "api")])
+        (temp_dir / "b").mkdir()
+        (temp_dir / "b" / "service_description.json").write_text("invalid json")
+        args = Mock()
+        args.local_debug = False
+
+        with pytest.raises(ServiceDefinitionError):
+            deploy_services(args, [str(temp_dir / "a"), str(temp_dir / "b")], "linux/amd64", "testuser", False)
+
+        mock_subprocess.Popen.assert_not_called()
+
+    @pytest.mark.unit
+    def test_deploy_services_records_metrics(self, temp_dir, mock_subprocess,
+                                             mock_zenoh_open, mock_zenoh_session, write_service):
+        """Test that every phase and image is timed."""
+        mock_zenoh_open.return_value = mock_zenoh_session
+        write_service(temp_dir / "a", "service-a", [("api", "api"), ("worker", "worker")])
+        args = Mock()
+        args.local_debug = False
+        metrics = MetricsRecorder()
+
+        deploy_services(args, [str(temp_dir / "a")], "linux/amd64", "testuser", False, metrics=metrics)
+
+        names = [span["name"] for span in metrics.spans]
+        for phase in ("parse", "check_cache", "build", "zenoh_open", "publish", "deploy"):
+            assert phase in names
+        assert names[-1] == "deploy"
+        images = [span for span in metrics.spans if span["name"] == "build_image"]
+        assert sorted(span["attributes"]["tag"] for span in images) == ["testuser/api", "testuser/worker"]
+        assert all(span["attributes"]["cache"] == "miss" for span in images)
+        assert all(span["status"] == "ok" for span in metrics.spans)
+
+    @pytest.mark.unit
+    def test_deploy_services_rebuilds_images_built_from_a_changed_image(self, temp_dir, mock_subprocess,
+                                                                        mock_zenoh_open, mock_zenoh_session,
+                                                                        write_service):
+        """Test that images are built after their parent and rebuilt when only the parent changed."""
+        mock_zenoh_open.return_value = mock_zenoh_session
+        write_service(temp_dir / "a", "service-a", [("api", "api"), ("base", "base"), ("other", "other")])
+        (temp_dir / "a" / "api" / "Dockerfile").write_text("FROM testuser/base\n")
+        args = Mock()
+        args.local_debug = False
+
+        deploy_services(args, [str(temp_dir / "a")], "linux/amd64", "testuser", False)
+        commands = [call[0][0] for call in mock_subprocess.Popen.call_args_list]
+        tags = [command[command.index("-t") + 1] for command in commands]
+        assert tags.index("testuser/base") < tags.index("testuser/api")
+
+        (temp_dir / "a" / "base" / "Dockerfile").write_text("FROM alpine:3.20\n")
+        deploy_services(args, [str(temp_dir / "a")], "linux/amd64", "testuser", False)
+        commands = [call[0][0] for call in mock_subprocess.Popen.call_args_list[3:]]
+        assert [command[command.index("-t") + 1] for command in commands] == ["testuser/base", "testuser/api"]
+
+    @pytest.mark.unit
+    def test_deploy_services_build_only(self, temp_dir, mock_subprocess, mock_zenoh_open, write_service):
+        """Test that build-only deployments build the images without opening a Zenoh session."""
+        write_service(temp_dir / "a", "service-a", [("api", "api")])
+        args = Mock()
+        args.local_debug = False
+
+        deploy_services(args, [str(temp_dir / "a")], "linux/amd64", "testuser", False, DeployOptions(build_only=True))
+
+        mock_subprocess.Popen.assert_called_once()
+        mock_zenoh_open.assert_not_called()
+
+    @pytest.mark.unit
+    def test_plan_deployment(self, temp_dir, write_service):
+        """Test that planning reports what would be built without building anything."""
+        write_service(temp_dir / "a", "service-a", [("api", "api"), ("base", "base")])
+        (temp_dir / "a" / "api" / "Dockerfile").write_text("FROM testuser/base\n")
+        args = Mock()
+        args.local_debug = False
+
+        plan = plan_deployment(args, [str(temp_dir / "a")], "linux/amd64", "testuser", False)
+
+        assert [each.tag for each in plan.images] == ["testuser/base", "testuser/api"]
+        assert plan.build == plan.images
+        assert plan.reasons["testuser/api"] == "builds from testuser/base"
+        assert not (temp_dir / "a" / ".colmena_build_manifest.json").exists()
+
+    @pytest.mark.unit
+    def test_expand_build_paths(self, temp_dir):
+        """Test glob patterns and build path files."""
+        for name in ("svc1", "svc2", "other"):
+            (temp_dir / name).mkdir()
+        paths_file = temp_dir / "services.txt"
+        paths_file.write_text("# services to deploy\nother\n\nsvc1\n")
+
+        paths = expand_build_paths([str(temp_dir / "svc*")], str(paths_file))
+
+        assert paths == [str(temp_dir / "svc1"), str(temp_dir / "svc2"), str(temp_dir / "other")]
+
+    @pytest.mark.unit
+    def test_expand_build_paths_no_match(self, temp_dir):
+        """Test that a pattern without matches is reported."""
+        with pytest.raises(FileNotFoundError):
+            expand_build_paths([str(temp_dir / "missing*")])
+
+
+class TestStartup:
+    """Test the start-up cost of the command line tool, which runs once per pipeline step."""
+
+    # seconds the command line module may take to import, zenoh excluded
+    IMPORT_BUDGET = 0.5
+
+    @staticmethod
+    def _run(code):
+        root = Path(__file__).resolve().parent.parent
+        return subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=str(root),
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+    @pytest.mark.unit
+    def test_zenoh_not_imported(self):
+        """Test that zenoh is only loaded when a definition is published."""
+        process = self._run("import sys, deployment.colmena_deploy; print('zenoh' in sys.modules)")
+
+        assert process.stdout.strip() == "False"
+
+    @pytest.mark.unit
+    def test_import_time_budget(self):
+        """Test that importing the command line module stays within its budget."""
+        process = self._run("import deployment.colmena_deploy")
+
+        cumulative = [int(line.split("|")[1]) for line in process.stderr.splitlines()
+                      if line.startswith("import time:") and line.rstrip().endswith(" deployment.colmena_deploy")]
+        assert cumulative[0] / 1e6 < self.IMPORT_BUDGET
@@ -0,0 +1,70 @@
+"""Tests for the deployer module."""
+
+from unittest.mock import Mock
+
+import pytest
+
+from deployment import Deployer, DeployOptions
+from deployment.build_image import BuildError
+
+
+@pytest.fixture
+def build_path(temp_dir, write_service):
+    """Create a service with two roles."""
+    write_service(temp_dir, "service-a", ["api", "worker"])
+    return str(temp_dir)
+
+
+class TestDeployer:
+    """Test the in-process deployment API."""
+
+    @pytest.mark.unit
+    def test_deploy_returns_results_and_reuses_the_session(self, build_path, mock_subprocess,
+                                                           mock_zenoh_open, mock_zenoh_session):
+        """Test that repeated deployments share one session and report the cached images."""
+        mock_zenoh_open.return_value = mock_zenoh_session
+
+        with Deployer("linux/amd64", "testuser") as deployer:
+            first = deployer.deploy([build_path])
+            second = deployer.deploy([build_path])
+
+        assert [each.image.tag for each in first.built] == ["testuser/api", "testuser/worker"]
+        assert all(each.duration is not None for each in first.built)
+        assert second.built == []
+        assert [each.image.tag for each in second.images if each.cached] == ["testuser/api", "testuser/worker"]
+        assert [(each.service, each.key) for each in second.services] == \
+            [("service-a", "colmena_service_definitions/service-a")]
+        assert mock_subprocess.Popen.call_count == 2
+        mock_zenoh_open.assert_called_once()
+        mock_zenoh_session.close.assert_called_once()
+
+    @pytest.mark.unit
+    def test_builder_pool_prepared_once(self, build_path, mock_subprocess, mock_zenoh_open,
+                                        mock_zenoh_session, mock_os_environ):
+        """Test that the builders are only prepared before the first build."""
+        mock_zenoh_open.return_value = mock_zenoh_session
+        pool = Mock()
+        pool.ensure.return_value = {}
+        pool.specs = []
+        pool.default.name = "colmena"
+
+        with Deployer("linux/amd64", "testuser", builder_pool=pool) as deployer:
+            deployer.deploy([build_path])
+            deployer.deploy([build_path], force_build=True)
+
+        pool.ensure.assert_called_once_with(["linux/amd64"])
+        assert "BUILDX_BUILDER" not in mock_os_environ
+        assert mock_subprocess.Popen.call_count == 4
+        command = mock_subprocess.Popen.call_args[0][0]
+        assert command[command.index("--builder") + 1] == "colmena"
+
+    @pytest.mark.unit
+    def test_failed_build_publishes_nothing(self, build_path, mock_subprocess, mock_zenoh_open):
+        """Test that a failed image stops the deployment before publishing."""
+        mock_subprocess.Popen.return_value.wait.return_value = 1
+
+        with Deployer("linux/amd64", "testuser", options=DeployOptions(keep_going=True)) as deployer:
+            with pytest.raises(BuildError):
+                deployer.deploy([build_path])
+
+        mock_zenoh_open.assert_not_called()
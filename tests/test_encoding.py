@@ -0,0 +1,61 @@
+"""Tests for the encoding module."""
+
+import json
+from unittest.mock import patch
+
+import pytest
+
+from deployment.encoding import (
+    ENCODINGS,
+    ZENOH_ENCODINGS,
+    available_encodings,
+    decode_definition,
+    encode_definition,
+)
+
+
+class TestEncoding:
+    """Test the wire formats of published service definitions."""
+
+    @pytest.mark.unit
+    def test_json_is_unchanged_default(self, sample_service_definition):
+        """Test that the default format is plain json.dumps without encoding."""
+        payload, encoding = encode_definition(sample_service_definition)
+        assert payload == json.dumps(sample_service_definition)
+        assert encoding is None
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("encoding", ENCODINGS)
+    def test_round_trip(self, encoding, sample_service_definition):
+        """Test that every available format decodes back to the definition."""
+        if encoding not in available_encodings():
+            pytest.skip(f"{encoding} dependencies are not installed")
+        payload, zenoh_encoding = encode_definition(sample_service_definition, encoding)
+        assert zenoh_encoding == ZENOH_ENCODINGS[encoding]
+        if isinstance(payload, str):
+            payload = payload.encode()
+        assert decode_definition(payload, zenoh_encoding) == sample_service_definition
+
+    @pytest.mark.unit
+    def test_compressed_payload_is_smaller(self, sample_service_definition):
+        """Test that compression pays off on larger definitions."""
+        definition = dict(sample_service_definition)
+        definition["dockerRoleDefinitions"] = sample_service_definition["dockerRoleDefinitions"] * 50
+        plain, _ = encode_definition(definition)
+        compact, _ = encode_definition(definition, "compact")
+        compressed, _ = encode_definition(definition, "gzip")
+        assert len(compressed) < len(compact) < len(plain)
+
+    @pytest.mark.unit
+    def test_unknown_encoding(self, sample_service_definition):
+        """Test that unknown formats are rejected."""
+        with pytest.raises(ValueError):
+            encode_definition(sample_service_definition, "xml")
+
+    @pytest.mark.unit
+    def test_missing_optional_dependency(self, sample_service_definition):
+        """Test the error raised when an optional codec is not installed."""
+        with patch("deployment.encoding.importlib.import_module", side_effect=ImportError):
+            with pytest.raises(ImportError, match="pip install cbor2"):
+                encode_definition(sample_service_definition, "cbor")
+            assert "cbor" not in available_encodings()
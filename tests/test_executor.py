@@ -0,0 +1,161 @@
+"""Tests for the executor module."""
+
+import subprocess
+import sys
+import threading
+import time
+from unittest.mock import Mock, patch
+
+import pytest
+
+from deployment.executor import (NO_RETRY, RetryPolicy, _expire, backoff_attempts, is_transient, retry_delay,
+                                 run_command, run_with_retries)
+
+
+def _python(code):
+    return [sys.executable, "-c", code]
+
+
+# fails with a registry error the first time it runs, then succeeds
+FLAKY_PUSH = """
+import os, sys
+marker = sys.argv[1]
+if not os.path.exists(marker):
+    open(marker, "w").close()
+    print("error: failed to push: 503 Service Unavailable")
+    sys.exit(1)
+print("pushed")
+"""
+
+
+class TestRunCommand:
+    """Test running commands without a shell."""
+
+    @pytest.mark.unit
+    def test_output_is_streamed_with_prefix(self, capsys):
+        """Test that stdout and stderr lines are printed with the prefix."""
+        run_command(_python("import sys; print('one', flush=True); print('two', file=sys.stderr)"), "api")
+
+        assert capsys.readouterr().out.splitlines() == ["[api] one", "[api] two"]
+
+    @pytest.mark.unit
+    def test_arguments_are_not_interpreted_by_a_shell(self, capsys):
+        """Test that shell syntax in an argument reaches the program unchanged."""
+        run_command(_python("import sys; print(sys.argv[1])") + ["x; echo injected"], "api")
+
+        assert capsys.readouterr().out.splitlines() == ["[api] x; echo injected"]
+
+    @pytest.mark.unit
+    def test_failure_keeps_the_last_output_lines(self):
+        """Test that a non-zero exit code raises CalledProcessError with the output tail."""
+        with pytest.raises(subprocess.CalledProcessError) as error:
+            run_command(_python("print('denied'); raise SystemExit(3)"), "api")
+
+        assert error.value.returncode == 3
+        assert error.value.output == "denied"
+
+    @pytest.mark.unit
+    def test_timeout_terminates(self):
+        """Test that a command running past its timeout is terminated."""
+        started = time.monotonic()
+        with pytest.raises(TimeoutError):
+            run_command(_python("import time; time.sleep(30)"), "api", timeout=0.2)
+
+        assert time.monotonic() - started < 5
+
+    @pytest.mark.unit
+    def test_success_wins_over_a_late_timeout(self, mock_subprocess):
+        """Test that a command exiting successfully as its timeout fires is not reported as timed out."""
+
+        class LateTimer:
+            """Fires only when cancelled, after the command exited."""
+
+            def __init__(self, interval, function, args):
+                self.function, self.args = function, args
+
+            def start(self):
+                pass
+
+            def cancel(self):
+                self.function(*self.args)
+
+        mock_subprocess.Popen.return_value.poll.return_value = None
+        with patch("deployment.executor.threading.Timer", LateTimer):
+            run_command(["docker", "image", "push", "test/image"], "api", timeout=1)
+
+        mock_subprocess.Popen.return_value.terminate.assert_called_once()
+
+    @pytest.mark.unit
+    def test_timer_ignores_exited_process(self):
+        """Test that a timeout firing after the process exited does not terminate it."""
+        process = Mock()
+        process.poll.return_value = 0
+        expired = threading.Event()
+
+        _expire(process, expired)
+
+        assert not expired.is_set()
+        process.terminate.assert_not_called()
+
+
+class TestRetries:
+    """Test running commands again after transient failures."""
+
+    @pytest.mark.unit
+    def test_transient_errors(self):
+        """Test that registry and network errors are told apart from build errors."""
+        assert is_transient(subprocess.CalledProcessError(1, [], "failed to push: 503 Service Unavailable"))
+        assert is_transient(subprocess.CalledProcessError(1, [], "toomanyrequests: rate limit exceeded"))
+        assert is_transient(subprocess.CalledProcessError(1, [], "read tcp: connection reset by peer"))
+        assert not is_transient(subprocess.CalledProcessError(1, [], "COPY failed: file not found"))
+        assert not is_transient(TimeoutError("did not finish"))
+
+    @pytest.mark.unit
+    def test_backoff_doubles_up_to_the_maximum(self):
+        """Test that the wait doubles after every retry, with a little jitter."""
+        policy = RetryPolicy(retries=5, backoff=2.0, max_backoff=5.0)
+
+        assert 1.8 <= policy.delay(1) <= 2.2
+        assert 3.6 <= policy.delay(2) <= 4.4
+        assert 4.5 <= policy.delay(3) <= 5.5
+
+    @pytest.mark.unit
+    def test_retry_delay(self, capsys):
+        """Test that only transient failures of the attempts retry allows get a delay."""
+        policy = RetryPolicy(retries=1, backoff=1.0)
+        transient = subprocess.CalledProcessError(1, [], "429 Too Many Requests")
+
+        assert list(backoff_attempts(policy)) == [1, 2]
+        assert 0.9 <= retry_delay(policy, 1, transient, "api") <= 1.1
+        assert retry_delay(policy, 2, transient, "api") is None
+        assert retry_delay(policy, 1, subprocess.CalledProcessError(1, [], "COPY failed"), "api") is None
+        assert capsys.readouterr().out.startswith("[api] transient failure (exit code 1), retry 1/1 in ")
+
+    @pytest.mark.unit
+    def test_transient_failure_is_retried(self, temp_dir, capsys):
+        """Test that a push failing with a 503 succeeds on the next attempt."""
+        with patch("deployment.executor.time.sleep") as sleep:
+            run_with_retries(_python(FLAKY_PUSH) + [str(temp_dir / "marker")], "api",
+                             retry=RetryPolicy(retries=2, backoff=1.0))
+
+        sleep.assert_called_once()
+        output = capsys.readouterr().out
+        assert "retry 1/2" in output
+        assert "[api] pushed" in output
+
+    @pytest.mark.unit
+    def test_build_errors_are_not_retried(self):
+        """Test that a failure without a transient error is raised right away."""
+        with patch("deployment.executor.time.sleep") as sleep:
+            with pytest.raises(subprocess.CalledProcessError):
+                run_with_retries(_python("print('COPY failed'); raise SystemExit(1)"), "api",
+                                 retry=RetryPolicy(retries=2))
+
+        sleep.assert_not_called()
+
+    @pytest.mark.unit
+    def test_last_failure_raised_once_retries_are_exhausted(self, temp_dir):
+        """Test that the error is raised when every attempt failed."""
+        with patch("deployment.executor.time.sleep"):
+            with pytest.raises(subprocess.CalledProcessError):
+                run_with_retries(_python(FLAKY_PUSH) + [str(temp_dir / "marker")], "api", retry=NO_RETRY)
@@ -0,0 +1,193 @@
+"""Tests for the export and colmena_import modules."""
+
+import hashlib
+import io
+import json
+import re
+import tarfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from deployment.build_image import Image
+from deployment.colmena_import import import_services
+from deployment.export import EXPORT_FILE, OciLayout, export_images
+from deployment.publisher import ServicePublisher
+
+MANIFEST = "application/vnd.oci.image.manifest.v1+json"
+
+
+def _digest(content):
+    return f"sha256:{hashlib.sha256(content).hexdigest()}"
+
+
+def write_oci_archive(path, layers):
+    """Write an OCI layout archive like buildx does, with one single-platform image."""
+    config = json.dumps({"architecture": "amd64", "os": "linux"}).encode()
+    blobs = [config] + list(layers)
+    manifest = json.dumps({
+        "schemaVersion": 2,
+        "mediaType": MANIFEST,
+        "config": {"mediaType": "application/vnd.oci.image.config.v1+json", "digest": _digest(config),
+                   "size": len(config)},
+        "layers": [{"mediaType": "application/vnd.oci.image.layer.v1.tar+gzip", "digest": _digest(layer),
+                    "size": len(layer)} for layer in layers],
+    }).encode()
+    blobs.append(manifest)
+    index = {"schemaVersion": 2, "manifests": [{"mediaType": MANIFEST, "digest": _digest(manifest),
+                                                 "size": len(manifest)}]}
+    with tarfile.open(path, "w") as tar:
+        for name, content in [("oci-layout", b'{"imageLayoutVersion": "1.0.0"}'),
+                              ("index.json", json.dumps(index).encode())] + \
+                [(f"blobs/sha256/{_digest(blob)[7:]}", blob) for blob in blobs]:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+
+
+class _Registry(BaseHTTPRequestHandler):
+    """In-memory registry implementing the few distribution API calls used to push."""
+
+    blobs = {}
+    manifests = {}
+    uploads = []
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_HEAD(self):
+        repository, digest = re.match(r"/v2/(.+)/blobs/(.+)", self.path).groups()
+        self._reply(200 if (repository, digest) in self.blobs else 404)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        repository = re.match(r"/v2/(.+)/blobs/uploads/", self.path).group(1)
+        mount = re.search(r"mount=([^&]+)&from=(.+)", self.path)
+        if mount:
+            digest, source = (value.replace("%3A", ":").replace("%2F", "/") for value in mount.groups())
+            if (source, digest) in self.blobs:
+                self.blobs[(repository, digest)] = self.blobs[(source, digest)]
+                self._reply(201)
+                return
+        self._reply(202, {"Location": f"/v2/{repository}/blobs/uploads/1"})
+
+    def do_PUT(self):
+        content = self.rfile.read(int(self.headers["Content-Length"]))
+        blob = re.match(r"/v2/(.+)/blobs/uploads/1\?digest=(.+)", self.path)
+        if blob:
+            repository, digest = blob.group(1), blob.group(2).replace("%3A", ":")
+            assert _digest(content) == digest
+            self.blobs[(repository, digest)] = content
+            self.uploads.append(digest)
+        else:
+            repository, reference = re.match(r"/v2/(.+)/manifests/(.+)", self.path).groups()
+            self.manifests[(repository, reference)] = (self.headers["Content-Type"], content)
+        self._reply(201)
+
+
+@pytest.fixture
+def registry():
+    """Run an in-memory registry on localhost."""
+    _Registry.blobs, _Registry.manifests, _Registry.uploads = {}, {}, []
+    server = HTTPServer(("127.0.0.1", 0), _Registry)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+class TestOciLayout:
+    """Test storing several exported images in one layout."""
+
+    @pytest.mark.unit
+    def test_shared_blobs_are_stored_once(self, temp_dir):
+        """Test that a layer common to two images is stored and archived once, reproducibly."""
+        write_oci_archive(str(temp_dir / "a.tar"), [b"base layer", b"api layer"])
+        write_oci_archive(str(temp_dir / "b.tar"), [b"base layer", b"worker layer"])
+        layout = OciLayout(str(temp_dir / "layout"))
+
+        layout.add_archive(str(temp_dir / "a.tar"), "user/api")
+        layout.add_archive(str(temp_dir / "b.tar"), "user/worker")
+        layout.write_archive(str(temp_dir / "out.tar"), ["user/api", "user/worker"])
+        first = (temp_dir / "out.tar").read_bytes()
+        layout.write_archive(str(temp_dir / "out.tar"), ["user/api", "user/worker"])
+
+        # the base layer and the image configuration are the same
+        config = json.dumps({"architecture": "amd64", "os": "linux"}).encode()
+        assert layout.shared_size == len(b"base layer") + len(config)
+        with tarfile.open(str(temp_dir / "out.tar")) as tar:
+            names = tar.getnames()
+            index = json.load(tar.extractfile("index.json"))
+        assert names.count(f"blobs/sha256/{_digest(b'base layer')[7:]}") == 1
+        assert len([name for name in names if name.startswith("blobs/")]) == 6
+        assert [each["annotations"]["io.containerd.image.name"] for each in index["manifests"]] == \
+            ["user/api", "user/worker"]
+        assert (temp_dir / "out.tar").read_bytes() == first
+
+
+class TestExport:
+    """Test exporting the images of build folders."""
+
+    @pytest.mark.unit
+    def test_export_images(self, temp_dir, mock_subprocess, write_service):
+        """Test that each build folder gets an archive and children read their parent from the layout."""
+        commands = []
+
+        def popen(command, **kwargs):
+            commands.append(command)
+            dest = re.search(r"type=oci,dest=(\S+),name=(\S+)", command[command.index("--output") + 1])
+            write_oci_archive(dest.group(1), [b"base layer", dest.group(2).encode()])
+            return mock_subprocess.Popen.return_value
+
+        mock_subprocess.Popen.side_effect = popen
+        write_service(temp_dir / "svc", "svc", ["api", "base"])
+        (temp_dir / "svc" / "api" / "Dockerfile").write_text("FROM docker.io/user/base:latest\n")
+        images = [Image(tag="user/api", id="api", path=str(temp_dir / "svc" / "api")),
+                  Image(tag="user/base", id="base", path=str(temp_dir / "svc" / "base"))]
+
+        archives = export_images([str(temp_dir / "svc")], [images], "linux/amd64",
+                                 dependencies={"user/api": ["user/base"]})
+
+        assert archives == {str(temp_dir / "svc"): str(temp_dir / "svc" / EXPORT_FILE)}
+        assert "--push" not in commands[0] and "-t" not in commands[0]
+        assert "--build-context" not in commands[0]
+        assert re.fullmatch(r"docker.io/user/base:latest=oci-layout://\S+@sha256:[0-9a-f]{64}",
+                            commands[1][commands[1].index("--build-context") + 1])
+        with tarfile.open(archives[str(temp_dir / "svc")]) as tar:
+            index = json.load(tar.extractfile("index.json"))
+        assert len(index["manifests"]) == 2
+
+
+class TestImport:
+    """Test pushing exported images to a local registry and publishing the services."""
+
+    @pytest.mark.unit
+    def test_import_services(self, temp_dir, registry, mock_zenoh_open, mock_zenoh_session, write_service):
+        """Test that shared layers are uploaded once and the definitions point to the local registry."""
+        mock_zenoh_open.return_value = mock_zenoh_session
+        write_service(temp_dir / "svc", "svc", ["api", "worker"])
+        layout = OciLayout(str(temp_dir / "layout"))
+        for role in ("api", "worker"):
+            write_oci_archive(str(temp_dir / f"{role}.tar"), [b"base layer", role.encode()])
+            layout.add_archive(str(temp_dir / f"{role}.tar"), f"user/{role}")
+        layout.write_archive(str(temp_dir / "svc" / EXPORT_FILE), ["user/api", "user/worker"])
+
+        with ServicePublisher() as publisher:
+            keys = import_services([str(temp_dir / "svc")], "user", registry, publisher=publisher)
+
+        assert keys == ["colmena_service_definitions/svc"]
+        assert _Registry.uploads.count(_digest(b"base layer")) == 1
+        assert ("user/worker", _digest(b"base layer")) in _Registry.blobs
+        assert set(_Registry.manifests) == {("user/api", "latest"), ("user/worker", "latest")}
+        assert _Registry.manifests[("user/api", "latest")][0] == MANIFEST
+        published = json.loads(mock_zenoh_session.put.call_args[0][1])
+        assert published["dockerRoleDefinitions"][0]["imageId"] == f"{registry}/user/api"
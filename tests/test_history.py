@@ -0,0 +1,102 @@
+"""Tests for the history and colmena_rollback modules."""
+
+import json
+from unittest.mock import Mock
+
+import pytest
+
+from deployment.colmena_deploy import deploy_services
+from deployment.colmena_rollback import rollback
+from deployment.history import DeploymentHistory, pin_digests
+from deployment.publisher import ServicePublisher
+
+
+@pytest.fixture
+def history(temp_dir):
+    """Create an empty history."""
+    return DeploymentHistory(str(temp_dir / "state" / "history.sqlite"))
+
+
+def _definition(image_id):
+    return {"id": {"value": "svc"}, "dockerRoleDefinitions": [{"id": "api", "imageId": image_id}],
+            "dockerContextDefinitions": []}
+
+
+class TestDeploymentHistory:
+    """Test storing published revisions."""
+
+    @pytest.mark.unit
+    def test_revisions_are_numbered_per_service(self, history):
+        """Test that each service counts its own revisions and only the digests of its images are kept."""
+        assert history.record(_definition("user/api"), {"user/api": "sha256:1", "user/other": "sha256:9"}) == 1
+        assert history.record(_definition("user/api"), {"user/api": "sha256:2"}) == 2
+        assert history.record({**_definition("user/api"), "id": {"value": "other"}}) == 1
+
+        assert [each.revision for each in history.revisions("svc")] == [2, 1]
+        assert history.get("svc", 1).digests == {"user/api": "sha256:1"}
+        assert history.get("svc", -1).revision == 1
+        assert history.get("svc", 3) is None
+        assert history.get("svc", -2) is None
+        assert history.services() == ["other", "svc"]
+
+    @pytest.mark.unit
+    def test_pin_digests(self):
+        """Test that images with a known digest are published by digest."""
+        definition = _definition("user/api")
+
+        pinned = pin_digests(definition, {"user/api": "sha256:abc"})
+
+        assert pinned["dockerRoleDefinitions"][0]["imageId"] == "user/api@sha256:abc"
+        assert definition["dockerRoleDefinitions"][0]["imageId"] == "user/api"
+
+
+class TestRollback:
+    """Test republishing a stored revision."""
+
+    @pytest.mark.unit
+    def test_rollback_publishes_pinned_revision(self, history, mock_zenoh_open, mock_zenoh_session):
+        """Test that the previous revision is published by digest and recorded as a new revision."""
+        mock_zenoh_open.return_value = mock_zenoh_session
+        history.record(_definition("user/api"), {"user/api": "sha256:1"})
+        history.record(_definition("user/api"), {"user/api": "sha256:2"})
+
+        restored = rollback(history, "svc")
+
+        assert restored.revision == 1
+        key, payload = mock_zenoh_session.put.call_args[0]
+        assert key == "colmena_service_definitions/svc"
+        assert json.loads(payload)["dockerRoleDefinitions"][0]["imageId"] == "user/api@sha256:1"
+        latest = history.revisions("svc", limit=1)[0]
+        assert (latest.revision, latest.digests, latest.note) == (3, {"user/api": "sha256:1"},
+                                                                  "rollback to revision 1")
+
+    @pytest.mark.unit
+    def test_rollback_unknown_revision(self, history):
+        """Test that a missing revision is reported without publishing."""
+        with pytest.raises(LookupError, match="svc has no revision 4"):
+            rollback(history, "svc", 4)
+
+    @pytest.mark.unit
+    def test_deploy_records_digests(self, temp_dir, history, mock_subprocess, mock_zenoh_open, mock_zenoh_session):
+        """Test that deployments record the digest buildx reported for every image."""
+        mock_zenoh_open.return_value = mock_zenoh_session
+        (temp_dir / "svc" / "api").mkdir(parents=True)
+        (temp_dir / "svc" / "api" / "Dockerfile").write_text("FROM alpine\n")
+        (temp_dir / "svc" / "service_description.json").write_text(json.dumps(_definition("api")))
+
+        def popen(command, **kwargs):
+            metadata_file = command[command.index("--metadata-file") + 1]
+            with open(metadata_file, "w") as f:
+                json.dump({"containerimage.digest": "sha256:abc"}, f)
+            return mock_subprocess.Popen.return_value
+
+        mock_subprocess.Popen.side_effect = popen
+        args = Mock()
+        args.local_debug = False
+
+        with ServicePublisher(history=history) as publisher:
+            deploy_services(args, [str(temp_dir / "svc")], "linux/amd64", "user", False, publisher=publisher)
+            deploy_services(args, [str(temp_dir / "svc")], "linux/amd64", "user", False, publisher=publisher)
+
+        # the second deployment skips the unchanged image and takes its digest from the build manifest
+        assert [each.digests for each in history.revisions("svc")] == [{"user/api": "sha256:abc"}] * 2
@@ -0,0 +1,63 @@
+"""Tests for the metrics module."""
+
+import json
+import subprocess
+
+import pytest
+
+from deployment.metrics import NO_METRICS, MetricsRecorder
+
+
+class TestMetricsRecorder:
+    """Test collecting and writing timing spans."""
+
+    @pytest.mark.unit
+    def test_span_records_attributes(self):
+        """Test that a span keeps the attributes added by the timed block."""
+        metrics = MetricsRecorder()
+
+        with metrics.span("publish", service="svc") as span:
+            span["keys"] = 1
+
+        [recorded] = metrics.spans
+        assert recorded["name"] == "publish"
+        assert recorded["status"] == "ok"
+        assert recorded["attributes"] == {"service": "svc", "keys": 1}
+        assert recorded["duration"] >= 0
+        assert recorded["end"] >= recorded["start"]
+
+    @pytest.mark.unit
+    def test_span_records_failures(self):
+        """Test that a failing block is recorded with its exit code and re-raised."""
+        metrics = MetricsRecorder()
+
+        with pytest.raises(subprocess.CalledProcessError):
+            with metrics.span("build_image", tag="user/api"):
+                raise subprocess.CalledProcessError(2, "docker buildx build")
+
+        [recorded] = metrics.spans
+        assert recorded["status"] == "error"
+        assert recorded["attributes"]["exit_code"] == 2
+
+    @pytest.mark.unit
+    def test_disabled_recorder_keeps_nothing(self):
+        """Test that the default recorder does not collect spans."""
+        with NO_METRICS.span("build"):
+            pass
+        NO_METRICS.add("build_image", 0, 1)
+
+        assert NO_METRICS.spans == []
+
+    @pytest.mark.unit
+    def test_write_json_lines(self, temp_dir):
+        """Test that spans are written one JSON object per line."""
+        metrics = MetricsRecorder()
+        metrics.add("build_image", 10.0, 12.5, tag="user/api", cache="miss")
+        metrics.add("build_image", 12.5, 12.5, tag="user/worker", cache="hit")
+        path = temp_dir / "metrics.jsonl"
+
+        metrics.write(str(path))
+
+        lines = [json.loads(line) for line in path.read_text().splitlines()]
+        assert [line["attributes"]["tag"] for line in lines] == ["user/api", "user/worker"]
+        assert lines[0]["duration"] == 2.5
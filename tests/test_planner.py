@@ -0,0 +1,115 @@
+"""Tests for the planner module."""
+
+import pytest
+
+from deployment.build_image import Image
+from deployment.planner import (
+    DeploymentPlan,
+    dockerfile_references,
+    image_dependencies,
+    normalize_reference,
+    parent_references,
+    topological_order,
+    with_dependents,
+)
+
+
+@pytest.fixture
+def base_and_app(temp_dir):
+    """Create a base image context and an application context building from it."""
+    base_dir = temp_dir / "base"
+    base_dir.mkdir()
+    (base_dir / "Dockerfile").write_text("FROM python:3.11-slim\n")
+    app_dir = temp_dir / "app"
+    app_dir.mkdir()
+    (app_dir / "Dockerfile").write_text("ARG BASE=user/base\nFROM ${BASE} AS runtime\nCOPY . /app\n")
+    return [Image(tag="user/app", id="app", path=str(app_dir)),
+            Image(tag="user/base", id="base", path=str(base_dir))]
+
+
+class TestDockerfileReferences:
+    """Test reading the images a Dockerfile builds from."""
+
+    @pytest.mark.unit
+    def test_stages_args_and_copy_from(self, temp_dir):
+        """Test that build stages are skipped and global ARG defaults are substituted."""
+        (temp_dir / "Dockerfile").write_text(
+            "# syntax=docker/dockerfile:1\n"
+            "ARG TAG=1.0\n"
+            "FROM --platform=$BUILDPLATFORM user/builder:${TAG} AS build\n"
+            "RUN make \\\n"
+            "    all\n"
+            "FROM scratch\n"
+            "COPY --from=build /out /out\n"
+            "COPY --from=0 /out /copy\n"
+            "COPY --from=user/assets /data /data\n")
+
+        assert dockerfile_references(str(temp_dir / "Dockerfile")) == ["user/builder:1.0", "user/assets"]
+
+    @pytest.mark.unit
+    def test_missing_dockerfile(self, temp_dir):
+        """Test that a context without Dockerfile has no references."""
+        assert dockerfile_references(str(temp_dir / "Dockerfile")) == []
+
+    @pytest.mark.unit
+    def test_normalize_reference(self):
+        """Test that Docker Hub names, default tags and digests compare equal."""
+        assert normalize_reference("docker.io/library/python") == "python:latest"
+        assert normalize_reference("user/base@sha256:abc") == "user/base:latest"
+        assert normalize_reference("localhost:5000/base") == "localhost:5000/base:latest"
+        assert normalize_reference("user/base:1.0") == "user/base:1.0"
+
+
+class TestImageGraph:
+    """Test ordering the images of a deployment."""
+
+    @pytest.mark.unit
+    def test_dependencies_and_order(self, base_and_app):
+        """Test that an image is ordered after the image its Dockerfile builds from."""
+        dependencies = image_dependencies(base_and_app)
+
+        assert dependencies == {"user/app": ["user/base"], "user/base": []}
+        assert [each.tag for each in topological_order(base_and_app, dependencies)] == ["user/base", "user/app"]
+
+    @pytest.mark.unit
+    def test_parent_references_as_written(self, temp_dir):
+        """Test that references keep the spelling of the Dockerfile, which build contexts are named after."""
+        (temp_dir / "Dockerfile").write_text("FROM docker.io/user/base:latest\nCOPY --from=user/tools /bin/x /x\n")
+        image = Image(tag="user/app", id="app", path=str(temp_dir))
+
+        assert parent_references(image, ["user/base", "user/tools:latest", "user/app"]) == {
+            "docker.io/user/base:latest": "user/base", "user/tools": "user/tools:latest"}
+
+    @pytest.mark.unit
+    def test_cycle(self):
+        """Test that images depending on each other are rejected."""
+        images = [Image(tag="user/a", id="a", path="/a"), Image(tag="user/b", id="b", path="/b")]
+
+        with pytest.raises(ValueError, match="user/a -> user/b -> user/a"):
+            topological_order(images, {"user/a": ["user/b"], "user/b": ["user/a"]})
+
+    @pytest.mark.unit
+    def test_with_dependents(self):
+        """Test that the images built from a selected image, directly or not, are added."""
+        images = [Image(tag=f"user/{name}", id=name, path=f"/{name}") for name in "abcd"]
+        dependencies = {"user/a": [], "user/b": ["user/a"], "user/c": ["user/b"], "user/d": []}
+
+        selected = with_dependents(images, [images[0]], dependencies)
+
+        assert [each.tag for each in selected] == ["user/a", "user/b", "user/c"]
+
+    @pytest.mark.unit
+    def test_describe(self, base_and_app, sample_service_definition):
+        """Test the printed plan lists every image, why it is built and what is published."""
+        base, app = base_and_app[1], base_and_app[0]
+        plan = DeploymentPlan([(sample_service_definition, [app, base])], [base, app],
+                              {"user/base": "/b", "user/app": "/b"}, image_dependencies(base_and_app),
+                              build=[app], reasons={"user/base": "unchanged since it was last pushed",
+                                                    "user/app": "changed or not pushed yet"})
+
+        lines = plan.describe().splitlines()
+
+        assert lines[0] == "deployment plan: 1 of 2 image(s) to build, 1 service definition(s) to publish"
+        assert lines[1].split() == ["cached", "user/base", "unchanged", "since", "it", "was", "last", "pushed"]
+        assert "build and push" in lines[2] and "after user/base" in lines[2]
+        assert lines[3].split() == ["publish", "test-service"]
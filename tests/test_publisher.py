@@ -0,0 +1,195 @@
+"""Tests for the publisher module."""
+
+import gzip
+import json
+from unittest.mock import Mock, patch
+
+import pytest
+
+from deployment.publisher import ServicePublisher, definition_diff, service_definition_key
+
+
+def _reply(value):
+    """Build a Zenoh reply carrying a JSON payload."""
+    reply = Mock()
+    reply.ok.payload.to_bytes.return_value = json.dumps(value).encode()
+    reply.ok.encoding = "zenoh/bytes"
+    return reply
+
+
+class TestServicePublisher:
+    """Test publishing service definitions over a reusable Zenoh session."""
+
+    @pytest.mark.unit
+    def test_service_definition_key(self, sample_service_definition):
+        """Test the key expression of a service definition."""
+        assert service_definition_key(sample_service_definition) == "colmena_service_definitions/test-service"
+
+    @pytest.mark.unit
+    def test_publish_many_uses_one_session(self, mock_zenoh_open, mock_zenoh_session):
+        """Test that a batch of definitions is published over a single session."""
+        mock_zenoh_open.return_value = mock_zenoh_session
+        definitions = [{"id": {"value": f"service-{i}"}} for i in range(3)]
+
+        with ServicePublisher() as publisher:
+            keys = publisher.publish_many(definitions)
+
+        mock_zenoh_open.assert_called_once()
+        assert keys == [f"colmena_service_definitions/service-{i}" for i in range(3)]
+        assert mock_zenoh_session.put.call_count == 3
+        assert json.loads(mock_zenoh_session.put.call_args_list[1][0][1]) == definitions[1]
+        mock_zenoh_session.close.assert_called_once()
+
+    @pytest.mark.unit
+    def test_session_opened_lazily_and_reopened_after_close(self, mock_zenoh_open, mock_zenoh_session):
+        """Test that the session is opened on first publish and again after close."""
+        mock_zenoh_open.return_value = mock_zenoh_session
+        publisher = ServicePublisher()
+        mock_zenoh_open.assert_not_called()
+
+        publisher.publish({"id": {"value": "a"}})
+        publisher.publish({"id": {"value": "b"}})
+        assert mock_zenoh_open.call_count == 1
+
+        publisher.close()
+        publisher.close()
+        mock_zenoh_session.close.assert_called_once()
+
+        publisher.publish({"id": {"value": "c"}})
+        assert mock_zenoh_open.call_count == 2
+
+    @pytest.mark.unit
+    def test_session_closed_on_error(self, mock_zenoh_open, mock_zenoh_session):
+        """Test that the context manager closes the session when publishing fails."""
+        mock_zenoh_open.return_value = mock_zenoh_session
+        mock_zenoh_session.put.side_effect = Exception("put failed")
+
+        with pytest.raises(Exception, match="put failed"):
+            with ServicePublisher() as publisher:
+                publisher.publish({"id": {"value": "a"}})
+
+        mock_zenoh_session.close.assert_called_once()
+
+
+class TestDeltaPublishing:
+    """Test skipping definitions already stored in the swarm."""
+
+    @pytest.mark.unit
+    def test_definition_diff(self):
+        """Test the structured diff between two definitions."""
+        old = {"id": {"value": "svc"}, "roles": [{"imageId": "a"}, {"imageId": "b"}], "kpis": ["x"]}
+        new = {"id": {"value": "svc"}, "roles": [{"imageId": "a2"}], "env": {"A": "1"}}
+
+        assert definition_diff(old, new) == [
+            {"op": "added", "path": "env", "new": {"A": "1"}},
+            {"op": "removed", "path": "kpis", "old": ["x"]},
+            {"op": "changed", "path": "roles[0].imageId", "old": "a", "new": "a2"},
+            {"op": "removed", "path": "roles[1]", "old": {"imageId": "b"}},
+        ]
+        assert definition_diff(new, json.loads(json.dumps(new))) == []
+
+    @pytest.mark.unit
+    def test_unchanged_definition_is_not_published(self, mock_zenoh_open, mock_zenoh_session,
+                                                   sample_service_definition):
+        """Test that an equal stored definition skips the put."""
+        mock_zenoh_open.return_value = mock_zenoh_session
+        stored = json.loads(json.dumps(sample_service_definition, sort_keys=True))
+        mock_zenoh_session.get.return_value = [_reply(stored)]
+
+        with ServicePublisher(only_changed=True) as publisher:
+            assert publisher.publish(sample_service_definition) is None
+
+        mock_zenoh_session.get.assert_called_once()
+        assert mock_zenoh_session.get.call_args[0][0] == "colmena_service_definitions/test-service"
+        mock_zenoh_session.put.assert_not_called()
+
+    @pytest.mark.unit
+    def test_changed_definition_is_published_with_diff(self, mock_zenoh_open, mock_zenoh_session,
+                                                       sample_service_definition, capsys):
+        """Test that a different stored definition is reported and replaced."""
+        mock_zenoh_open.return_value = mock_zenoh_session
+        stored = json.loads(json.dumps(sample_service_definition))
+        stored["dockerRoleDefinitions"][0]["imageId"] = "old-image"
+        mock_zenoh_session.get.return_value = [_reply(stored)]
+
+        with ServicePublisher(only_changed=True) as publisher:
+            assert publisher.publish(sample_service_definition) == "colmena_service_definitions/test-service"
+
+        mock_zenoh_session.put.assert_called_once()
+        assert '~ dockerRoleDefinitions[0].imageId: "old-image" -> "worker-image"' in capsys.readouterr().out
+
+    @pytest.mark.unit
+    def test_missing_definition_is_published(self, mock_zenoh_open, mock_zenoh_session,
+                                             sample_service_definition):
+        """Test that a definition nobody stores yet is published."""
+        mock_zenoh_open.return_value = mock_zenoh_session
+        mock_zenoh_session.get.return_value = []
+
+        with ServicePublisher(only_changed=True) as publisher:
+            publisher.publish(sample_service_definition)
+
+        mock_zenoh_session.put.assert_called_once()
+
+
+class TestWaitUntilVisible:
+    """Test waiting for a published definition to be visible on the swarm."""
+
+    @pytest.mark.unit
+    def test_publish_waits_for_the_new_definition(self, mock_zenoh_open, mock_zenoh_session,
+                                                  sample_service_definition):
+        """Test that the key is queried back until the swarm answers with the new definition."""
+        mock_zenoh_open.return_value = mock_zenoh_session
+        old = json.loads(json.dumps(sample_service_definition))
+        old["dockerRoleDefinitions"][0]["imageId"] = "old-image"
+        mock_zenoh_session.get.side_effect = [[], [_reply(old)], [_reply(sample_service_definition)]]
+
+        with patch("deployment.publisher.VISIBILITY_POLL_INTERVAL", 0.01):
+            with ServicePublisher(wait_timeout=5) as publisher:
+                key = publisher.publish(sample_service_definition)
+
+        assert mock_zenoh_session.get.call_count == 3
+        assert publisher.visible_after[key] >= 0.02
+
+    @pytest.mark.unit
+    def test_publish_times_out(self, mock_zenoh_open, mock_zenoh_session, sample_service_definition):
+        """Test that a definition no peer answers with raises a TimeoutError."""
+        mock_zenoh_open.return_value = mock_zenoh_session
+        mock_zenoh_session.get.return_value = []
+
+        with patch("deployment.publisher.VISIBILITY_POLL_INTERVAL", 0.01):
+            with ServicePublisher(wait_timeout=0.05) as publisher:
+                with pytest.raises(TimeoutError, match="test-service was not visible"):
+                    publisher.publish(sample_service_definition)
+
+        mock_zenoh_session.put.assert_called_once()
+        assert all(call[1]["timeout"] <= 0.05 for call in mock_zenoh_session.get.call_args_list)
+
+
+class TestEncodedPublishing:
+    """Test publishing with an explicit wire encoding."""
+
+    @pytest.mark.unit
+    def test_publish_gzip_sets_encoding(self, mock_zenoh_open, mock_zenoh_session, sample_service_definition):
+        """Test that opt-in encodings tag the put with their Zenoh encoding."""
+        mock_zenoh_open.return_value = mock_zenoh_session
+
+        with ServicePublisher(encoding="gzip") as publisher:
+            publisher.publish(sample_service_definition)
+
+        key, payload = mock_zenoh_session.put.call_args[0]
+        assert mock_zenoh_session.put.call_args[1] == {"encoding": "application/json;gzip"}
+        assert json.loads(gzip.decompress(payload)) == sample_service_definition
+
+    @pytest.mark.unit
+    def test_current_decodes_stored_encoding(self, mock_zenoh_open, mock_zenoh_session,
+                                             sample_service_definition):
+        """Test that stored definitions are decoded according to their encoding."""
+        mock_zenoh_open.return_value = mock_zenoh_session
+        reply = Mock()
+        reply.ok.payload.to_bytes.return_value = gzip.compress(json.dumps(sample_service_definition).encode())
+        reply.ok.encoding = "application/json;gzip"
+        mock_zenoh_session.get.return_value = [reply]
+
+        with ServicePublisher(only_changed=True, encoding="gzip") as publisher:
+            assert publisher.current("test-service") == sample_service_definition
+            assert publisher.publish(sample_service_definition) is None
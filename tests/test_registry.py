@@ -0,0 +1,112 @@
+"""Tests for the registry module."""
+
+import json
+from unittest.mock import Mock, patch
+
+import pytest
+
+from deployment.build_image import Image
+from deployment.options import DeployOptions
+from deployment.registry import RemoteImage, inspect_remote, missing_from_registry
+
+
+def _index(digest, *platforms):
+    """Build the manifest list returned by imagetools inspect."""
+    manifests = []
+    for platform in platforms:
+        os_name, architecture = platform.split("/")[:2]
+        manifests.append({"digest": f"sha256:{architecture}", "platform": {"os": os_name, "architecture": architecture}})
+    manifests.append({"digest": "sha256:attestation", "platform": {"os": "unknown", "architecture": "unknown"}})
+    return {"mediaType": "application/vnd.oci.image.index.v1+json", "digest": digest, "manifests": manifests}
+
+
+@pytest.fixture
+def stand_in_registry():
+    """Stand-in registry answering docker buildx imagetools inspect from a dict."""
+    tags = {}
+
+    def run(command, **kwargs):
+        tag = command[4]
+        if tag not in tags:
+            return Mock(returncode=1, stdout="", stderr=f"ERROR: {tag}: not found")
+        return Mock(returncode=0, stdout=json.dumps(tags[tag]), stderr="")
+
+    with patch("deployment.registry.subprocess.run", side_effect=run) as mock_run:
+        mock_run.tags = tags
+        yield mock_run
+
+
+class TestInspectRemote:
+    """Test reading tag manifests from the registry."""
+
+    @pytest.mark.unit
+    def test_manifest_list(self, stand_in_registry):
+        """Test digest and platforms of a multi-arch tag, without attestations."""
+        stand_in_registry.tags["user/worker"] = _index("sha256:abc", "linux/amd64", "linux/arm64")
+
+        remote = inspect_remote("user/worker")
+
+        assert remote == RemoteImage(digest="sha256:abc", platforms=["linux/amd64", "linux/arm64"])
+        command = stand_in_registry.call_args[0][0]
+        assert command[:4] == ["docker", "buildx", "imagetools", "inspect"]
+
+    @pytest.mark.unit
+    def test_missing_tag(self, stand_in_registry):
+        """Test that unknown tags return None."""
+        assert inspect_remote("user/unknown") is None
+
+
+class TestMissingFromRegistry:
+    """Test the registry pre-flight check."""
+
+    @pytest.mark.unit
+    def test_missing_from_registry(self, stand_in_registry):
+        """Test which images need a new push."""
+        stand_in_registry.tags.update({
+            "user/same": _index("sha256:same", "linux/amd64", "linux/arm64"),
+            "user/overwritten": _index("sha256:other", "linux/amd64", "linux/arm64"),
+            "user/amd64-only": _index("sha256:amd", "linux/amd64"),
+        })
+        images = [Image(tag=f"user/{name}", id=name, path=f"/build/{name}")
+                  for name in ("same", "overwritten", "amd64-only", "deleted")]
+        expected = {"user/same": "sha256:same", "user/overwritten": "sha256:old",
+                    "user/amd64-only": "sha256:amd", "user/deleted": "sha256:gone"}
+
+        missing = missing_from_registry(images, expected, "linux/amd64,linux/arm64/v8")
+
+        assert [each.id for each in missing] == ["overwritten", "amd64-only", "deleted"]
+
+    @pytest.mark.unit
+    def test_deploy_verifies_unchanged_images(self, temp_dir, sample_service_json_file, mock_subprocess,
+                                              mock_zenoh_open, mock_zenoh_session, stand_in_registry):
+        """Test that unchanged images are only skipped while the registry keeps their digest."""
+        from deployment.colmena_deploy import deploy_service
+
+        mock_zenoh_open.return_value = mock_zenoh_session
+        for path in ("worker", "manager", "context/shared-context"):
+            (temp_dir / path).mkdir(parents=True)
+            (temp_dir / path / "Dockerfile").write_text("FROM alpine\n")
+
+        def build(command, **kwargs):
+            # buildx writes the pushed digest to the metadata file
+            tag = command[command.index("-t") + 1]
+            metadata_file = command[command.index("--metadata-file") + 1]
+            with open(metadata_file, "w") as f:
+                json.dump({"containerimage.digest": f"sha256:{tag.split('/')[1]}"}, f)
+            stand_in_registry.tags[tag] = _index(f"sha256:{tag.split('/')[1]}", "linux/amd64")
+            return mock_subprocess.Popen.return_value
+
+        mock_subprocess.Popen.side_effect = build
+        args = Mock()
+        args.local_debug = False
+
+        deploy_service(args, str(temp_dir), "linux/amd64", "testuser", False, DeployOptions(verify_registry=True))
+        assert mock_subprocess.Popen.call_count == 3
+
+        deploy_service(args, str(temp_dir), "linux/amd64", "testuser", False, DeployOptions(verify_registry=True))
+        assert mock_subprocess.Popen.call_count == 3
+
+        del stand_in_registry.tags["testuser/manager-image"]
+        deploy_service(args, str(temp_dir), "linux/amd64", "testuser", False, DeployOptions(verify_registry=True))
+        assert mock_subprocess.Popen.call_count == 4
+        assert "-t testuser/manager-image" in " ".join(mock_subprocess.Popen.call_args[0][0])
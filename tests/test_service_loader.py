@@ -0,0 +1,109 @@
+"""Tests for the service_loader module."""
+
+import json
+
+import pytest
+
+from deployment.colmena_deploy import load_services
+from deployment.service_loader import ServiceDefinitionError, load_definition, validate_definition
+
+
+def _build_folder(path, definition, folders=()):
+    path.mkdir(parents=True, exist_ok=True)
+    (path / "service_description.json").write_text(json.dumps(definition))
+    for folder in folders:
+        (path / folder).mkdir(parents=True)
+        (path / folder / "Dockerfile").write_text("FROM alpine\n")
+    return path
+
+
+class TestValidateDefinition:
+    """Test checking service descriptions before building."""
+
+    @pytest.mark.unit
+    def test_valid_definition(self, temp_dir, sample_service_definition):
+        """Test that a complete description has no errors."""
+        _build_folder(temp_dir, sample_service_definition, ["worker", "manager", "context/shared-context"])
+
+        assert validate_definition(sample_service_definition, str(temp_dir)) == []
+
+    @pytest.mark.unit
+    def test_reports_every_error(self, temp_dir):
+        """Test that all problems are reported together."""
+        definition = {
+            "id": {},
+            "dockerRoleDefinitions": [
+                {"id": "api", "imageId": "api"},
+                {"id": "api", "imageId": "Worker"},
+                {"imageId": "api"},
+            ],
+        }
+
+        errors = validate_definition(definition, str(temp_dir), check_files=False)
+
+        assert [error.split(": ", 1)[1] for error in errors] == [
+            "id.value: expected a non-empty string",
+            "dockerRoleDefinitions[1].id: 'api' is already used by dockerRoleDefinitions[0]",
+            "dockerRoleDefinitions[1].imageId: 'Worker' is not a valid image name",
+            "dockerRoleDefinitions[2].id: expected a non-empty string",
+            "dockerRoleDefinitions[2].imageId: 'api' is already used by dockerRoleDefinitions[0]",
+            "dockerContextDefinitions: expected a list",
+        ]
+
+    @pytest.mark.unit
+    def test_checks_folders_and_dockerfiles(self, temp_dir, sample_service_definition):
+        """Test that missing folders and Dockerfiles are reported only when checking files."""
+        _build_folder(temp_dir, sample_service_definition, ["worker"])
+        (temp_dir / "manager").mkdir()
+
+        errors = validate_definition(sample_service_definition, str(temp_dir))
+
+        assert len(errors) == 2
+        assert errors[0].endswith(f"{temp_dir}/manager/Dockerfile not found")
+        assert errors[1].endswith(f"folder {temp_dir}/context/shared-context not found")
+        assert validate_definition(sample_service_definition, str(temp_dir), check_files=False) == []
+
+    @pytest.mark.unit
+    def test_rejects_ids_outside_the_build_folder(self, temp_dir):
+        """Test that ids cannot point to other folders."""
+        definition = {"id": {"value": "svc"}, "dockerRoleDefinitions": [{"id": "../api", "imageId": "api"}],
+                      "dockerContextDefinitions": []}
+
+        [error] = validate_definition(definition, str(temp_dir), check_files=False)
+
+        assert "'../api' is not a folder name" in error
+
+    @pytest.mark.unit
+    def test_image_ids_with_tags(self, temp_dir):
+        """Test that image ids may have a registry path and a tag."""
+        definition = {"id": {"value": "svc"}, "dockerRoleDefinitions": [],
+                      "dockerContextDefinitions": [{"id": "db", "imageId": "colmena/postgres:13.2-alpine"}]}
+
+        assert validate_definition(definition, str(temp_dir), check_files=False) == []
+
+
+class TestLoadDefinition:
+    """Test loading service descriptions."""
+
+    @pytest.mark.unit
+    def test_invalid_json(self, temp_dir):
+        """Test that parse errors show where the JSON is broken."""
+        (temp_dir / "service_description.json").write_text('{"id": {"value": "svc"},\n "roles": [}')
+
+        with pytest.raises(ServiceDefinitionError, match="invalid JSON at line 2"):
+            load_definition(str(temp_dir))
+
+    @pytest.mark.unit
+    def test_load_services_reports_all_services(self, temp_dir):
+        """Test that the errors of every build folder are raised together, before any build."""
+        broken = {"id": {"value": "svc"}, "dockerRoleDefinitions": [{"id": "api", "imageId": "api"}],
+                  "dockerContextDefinitions": []}
+        _build_folder(temp_dir / "a", broken)
+        _build_folder(temp_dir / "b", broken)
+
+        with pytest.raises(ServiceDefinitionError) as error:
+            load_services([str(temp_dir / "a"), str(temp_dir / "b")], "testuser")
+
+        assert len(error.value.errors) == 2
+        assert error.value.errors[0].startswith(str(temp_dir / "a"))
+        assert error.value.errors[1].startswith(str(temp_dir / "b"))
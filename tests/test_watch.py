@@ -0,0 +1,156 @@
+"""Tests for the watch module."""
+
+import json
+from unittest.mock import Mock
+
+import pytest
+
+from deployment.watch import InotifyWatcher, PollingWatcher, ServiceWatcher
+
+
+def _built_tags(mock_subprocess):
+    return [call[0][0][call[0][0].index("-t") + 1] for call in mock_subprocess.Popen.call_args_list]
+
+
+class TestFileWatchers:
+    """Test detecting changed files."""
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("create_watcher", [InotifyWatcher, lambda roots: PollingWatcher(roots, interval=0.01)],
+                             ids=["inotify", "polling"])
+    def test_reports_changed_files(self, temp_dir, create_watcher):
+        """Test that changed and created files are reported, also in new subdirectories."""
+        (temp_dir / "Dockerfile").write_text("FROM alpine\n")
+        watcher = create_watcher([(str(temp_dir), True)])
+        try:
+            (temp_dir / "Dockerfile").write_text("FROM alpine:3\n")
+            changed = watcher.changes(debounce=0.05, timeout=2)
+            assert str(temp_dir / "Dockerfile") in changed
+
+            (temp_dir / "src").mkdir()
+            (temp_dir / "src" / "main.py").write_text("print('hi')\n")
+            changed = watcher.changes(debounce=0.05, timeout=2)
+            assert str(temp_dir / "src" / "main.py") in changed
+        finally:
+            watcher.close()
+
+    @pytest.mark.unit
+    def test_timeout_without_changes(self, temp_dir):
+        """Test that nothing is reported when nothing changes."""
+        watcher = PollingWatcher([(str(temp_dir), True)], interval=0.01)
+
+        assert watcher.changes(debounce=0.01, timeout=0.05) == set()
+
+
+class TestServiceWatcher:
+    """Test rebuilding and republishing after changes."""
+
+    @pytest.mark.unit
+    def test_rebuilds_only_changed_image(self, temp_dir, mock_subprocess, local_args, write_service):
+        """Test that only the image whose context changed is rebuilt, and the definition is not republished."""
+        write_service(temp_dir / "svc", "service-a", ["api", "worker"])
+        publisher = Mock()
+        watcher = ServiceWatcher(local_args, [str(temp_dir / "svc")], "linux/amd64", "testuser", publisher)
+        dockerfile = temp_dir / "svc" / "api" / "Dockerfile"
+        dockerfile.write_text("FROM alpine:3\n")
+
+        watcher.process({str(dockerfile)})
+        # a second event for the same content, e.g. a file saved twice
+        watcher.process({str(dockerfile)})
+        watcher.files.close()
+
+        assert _built_tags(mock_subprocess) == ["testuser/api"]
+        publisher.publish.assert_not_called()
+
+    @pytest.mark.unit
+    def test_republishes_changed_description(self, temp_dir, mock_subprocess, local_args, write_service):
+        """Test that a changed description is republished after building its new images."""
+        definition = write_service(temp_dir / "svc", "service-a", ["api"])
+        publisher = Mock()
+        watcher = ServiceWatcher(local_args, [str(temp_dir / "svc")], "linux/amd64", "testuser", publisher)
+        description = temp_dir / "svc" / "service_description.json"
+        definition["dockerRoleDefinitions"][0]["imageId"] = "api-v2"
+        description.write_text(json.dumps(definition))
+
+        watcher.process({str(description)})
+        watcher.files.close()
+
+        assert _built_tags(mock_subprocess) == ["testuser/api-v2"]
+        [published] = [call[0][0] for call in publisher.publish.call_args_list]
+        assert published["dockerRoleDefinitions"][0]["imageId"] == "testuser/api-v2"
+
+    @pytest.mark.unit
+    def test_republishes_with_digests(self, temp_dir, mock_subprocess, local_args, write_service):
+        """Test that a republished definition comes with the digest of the images just built, for the history."""
+        definition = write_service(temp_dir / "svc", "service-a", ["api"])
+
+        def popen(command, **kwargs):
+            with open(command[command.index("--metadata-file") + 1], "w") as f:
+                json.dump({"containerimage.digest": "sha256:abc"}, f)
+            return mock_subprocess.Popen.return_value
+
+        mock_subprocess.Popen.side_effect = popen
+        publisher = Mock()
+        watcher = ServiceWatcher(local_args, [str(temp_dir / "svc")], "linux/amd64", "testuser", publisher)
+        description = temp_dir / "svc" / "service_description.json"
+        definition["dockerRoleDefinitions"][0]["imageId"] = "api-v2"
+        description.write_text(json.dumps(definition))
+
+        watcher.process({str(description)})
+        watcher.files.close()
+
+        [(_, digests)] = [call[0] for call in publisher.publish.call_args_list]
+        assert digests == {"testuser/api-v2": "sha256:abc"}
+
+    @pytest.mark.unit
+    def test_skip_build_only_republishes(self, temp_dir, mock_subprocess, local_args, write_service):
+        """Test that with skip_build nothing is built and role folders are not required."""
+        definition = write_service(temp_dir / "svc", "service-a", ["api"])
+        (temp_dir / "svc" / "api" / "Dockerfile").unlink()
+        publisher = Mock()
+        watcher = ServiceWatcher(local_args, [str(temp_dir / "svc")], "linux/amd64", "testuser", publisher,
+                                 skip_build=True)
+        description = temp_dir / "svc" / "service_description.json"
+        definition["dockerRoleDefinitions"][0]["imageId"] = "api-v2"
+        description.write_text(json.dumps(definition))
+
+        watcher.process({str(description), str(temp_dir / "svc" / "api" / "main.py")})
+        watcher.files.close()
+
+        mock_subprocess.Popen.assert_not_called()
+        [published] = [call[0][0] for call in publisher.publish.call_args_list]
+        assert published["dockerRoleDefinitions"][0]["imageId"] == "testuser/api-v2"
+
+    @pytest.mark.unit
+    def test_failed_build_is_not_published(self, temp_dir, mock_subprocess, local_args, write_service):
+        """Test that a failed build keeps the watcher running without publishing."""
+        definition = write_service(temp_dir / "svc", "service-a", ["api"])
+        mock_subprocess.Popen.return_value.wait.return_value = 1
+        publisher = Mock()
+        watcher = ServiceWatcher(local_args, [str(temp_dir / "svc")], "linux/amd64", "testuser", publisher)
+        description = temp_dir / "svc" / "service_description.json"
+        definition["dockerRoleDefinitions"][0]["imageId"] = "api-v2"
+        description.write_text(json.dumps(definition))
+
+        watcher.process({str(description)})
+        watcher.files.close()
+
+        publisher.publish.assert_not_called()
+
+    @pytest.mark.unit
+    def test_invalid_description_still_rebuilds_changed_images(self, temp_dir, mock_subprocess, local_args,
+                                                               write_service):
+        """Test that role edits saved together with a broken description are still built."""
+        write_service(temp_dir / "svc", "service-a", ["api"])
+        publisher = Mock()
+        watcher = ServiceWatcher(local_args, [str(temp_dir / "svc")], "linux/amd64", "testuser", publisher)
+        description = temp_dir / "svc" / "service_description.json"
+        description.write_text("{invalid")
+        dockerfile = temp_dir / "svc" / "api" / "Dockerfile"
+        dockerfile.write_text("FROM alpine:3\n")
+
+        watcher.process({str(description), str(dockerfile)})
+        watcher.files.close()
+
+        assert _built_tags(mock_subprocess) == ["testuser/api"]
+        publisher.publish.assert_not_called()